@@ -0,0 +1,221 @@
+import concurrent.futures
+import importlib.util
+import json
+import logging
+import os
+import threading
+import numpy as np
+
+# duckdb is optional (the reports are computed with NumPy without it) and is imported on first use,
+# so it isn't loaded at startup
+DUCKDB_INSTALLED = importlib.util.find_spec('duckdb') is not None
+
+logger = logging.getLogger(__name__)
+
+REPORTS = ('monthly_balances', 'fund_units', 'monthly_cash_flows')
+
+# The report queries read two views, `transactions` (timestamp, fund_name, kind, amount, units, carried) and
+# `balances` (id, date, bank, closing_balance, deposit_amt, withdrawal_amt), whichever source backs them.
+# kind is 1 for a buy, -1 for a sell and 0 otherwise, as in snapshot.KIND_CODES. carried is 1 for the
+# carry-forward rows left by archive.py, which hold units but are no money in or out.
+QUERIES = {
+    # Closing balance of the last entry (by date, then id) of every bank in every month
+    'monthly_balances': """
+        SELECT strftime(date_trunc('month', date), '%Y-%m') AS month, bank, closing_balance
+        FROM balances
+        QUALIFY row_number() OVER (PARTITION BY bank, date_trunc('month', date) ORDER BY date DESC, id DESC) = 1
+        ORDER BY month, bank
+    """,
+    # Units held of every fund at the end of each day it had a transaction
+    'fund_units': """
+        SELECT strftime(day, '%Y-%m-%d') AS date, fund_name,
+               sum(units) OVER (PARTITION BY fund_name ORDER BY day) AS units
+        FROM (SELECT CAST(timestamp AS DATE) AS day, fund_name, sum(units * kind) AS units
+              FROM transactions GROUP BY ALL)
+        ORDER BY date, fund_name
+    """,
+    # Money in and out of the bank accounts and the funds per month
+    'monthly_cash_flows': """
+        WITH bank AS (
+            SELECT date_trunc('month', date) AS month, sum(deposit_amt) AS deposits, sum(withdrawal_amt) AS withdrawals
+            FROM balances GROUP BY ALL
+        ), funds AS (
+            SELECT date_trunc('month', timestamp) AS month,
+                   sum(CASE WHEN kind = 1 AND carried = 0 THEN amount ELSE 0 END) AS invested,
+                   sum(CASE WHEN kind = -1 AND carried = 0 THEN amount ELSE 0 END) AS redeemed
+            FROM transactions GROUP BY ALL
+        )
+        SELECT strftime(month, '%Y-%m') AS month, coalesce(deposits, 0) AS deposits, coalesce(withdrawals, 0) AS withdrawals,
+               coalesce(invested, 0) AS invested, coalesce(redeemed, 0) AS redeemed
+        FROM bank FULL OUTER JOIN funds USING (month)
+        ORDER BY month
+    """,
+}
+
+# Views over the application tables when DuckDB can attach the SQLite file
+ATTACHED_VIEWS = """
+    CREATE OR REPLACE VIEW transactions AS
+        SELECT timestamp, fund_name,
+               CASE lower(transaction_type) WHEN 'buy' THEN 1 WHEN 'sell' THEN -1 ELSE 0 END AS kind,
+               coalesce(amount, 0) AS amount, coalesce(units, 0) AS units, coalesce(carried_forward, 0) AS carried
+        FROM finances.mutual_fund_transactions;
+    CREATE OR REPLACE VIEW balances AS
+        SELECT id, date, bank, coalesce(closing_balance, 0) AS closing_balance,
+               coalesce(deposit_amt, 0) AS deposit_amt, coalesce(withdrawal_amt, 0) AS withdrawal_amt
+        FROM finances.account_balances;
+"""
+
+# Views over the snapshot's arrays, registered on each cursor
+SNAPSHOT_VIEWS = """
+    CREATE OR REPLACE TEMP VIEW transactions AS
+        SELECT t.timestamp, f.fund_name, t.kind, t.amount, t.units, t.carried
+        FROM transaction_columns t JOIN fund_names f USING (fund);
+    CREATE OR REPLACE TEMP VIEW balances AS
+        SELECT b.id, b.date, n.bank, b.closing_balance, b.deposit_amt, b.withdrawal_amt
+        FROM balance_columns b JOIN bank_names n USING (bank_index);
+"""
+
+def _columns(array, rename=None):
+    # DuckDB ignores the stride of a structured array's field views, so each field is copied to a
+    # contiguous column (datetime64[s] as datetime64[us], the only precision it converts)
+    rename = rename or {}
+    return {rename.get(name, name): array[name].astype('datetime64[us]') if array.dtype[name].kind == 'M' else np.ascontiguousarray(array[name])
+            for name in array.dtype.names}
+
+def _months(values):
+    return np.asarray(values).astype('datetime64[M]')
+
+def monthly_balances(snapshot):
+    balances = snapshot.balances
+    if not len(balances):
+        return []
+    months = _months(balances['date'])
+    key = months.astype(np.int64) * len(snapshot.banks) + balances['bank']
+    # balances is sorted by (date, id), so the last occurrence of each (month, bank) is its closing entry
+    last = len(key) - 1 - np.unique(key[::-1], return_index=True)[1]
+    rows = [{'month': month, 'bank': snapshot.banks[bank], 'closing_balance': closing_balance}
+            for month, bank, closing_balance in zip(np.datetime_as_string(months[last]).tolist(), balances['bank'][last].tolist(),
+                                                    balances['closing_balance'][last].tolist())]
+    return sorted(rows, key=lambda row: (row['month'], row['bank']))
+
+def fund_units(snapshot):
+    transactions = snapshot.transactions
+    if not len(transactions):
+        return []
+    days = transactions['timestamp'].astype('datetime64[D]')
+    order = np.lexsort((days, transactions['fund']))
+    funds, days, units = transactions['fund'][order], days[order], snapshot.signed_units()[order]
+    # One group per (fund, day), then a running total within each fund
+    starts = np.flatnonzero(np.r_[True, (funds[1:] != funds[:-1]) | (days[1:] != days[:-1])])
+    daily = np.add.reduceat(units, starts)
+    funds, days = funds[starts], days[starts]
+    totals = np.cumsum(daily)
+    fund_starts = np.r_[True, funds[1:] != funds[:-1]]
+    held = totals - (totals - daily)[fund_starts][np.cumsum(fund_starts) - 1]
+    rows = [{'date': day, 'fund_name': snapshot.fund_names[fund], 'units': value}
+            for day, fund, value in zip(np.datetime_as_string(days).tolist(), funds.tolist(), held.tolist())]
+    return sorted(rows, key=lambda row: (row['date'], row['fund_name']))
+
+def monthly_cash_flows(snapshot):
+    transactions, balances = snapshot.transactions, snapshot.balances
+    transaction_months, balance_months = _months(transactions['timestamp']), _months(balances['date'])
+    months, index = np.unique(np.concatenate([balance_months, transaction_months]), return_inverse=True)
+    balance_index, transaction_index = index[:len(balances)], index[len(balances):]
+    # Carry-forward rows hold units but are no money in or out
+    kinds = np.where(transactions['carried'] == 1, 0, transactions['kind'])
+    columns = {
+        'deposits': np.bincount(balance_index, weights=balances['deposit_amt'], minlength=len(months)),
+        'withdrawals': np.bincount(balance_index, weights=balances['withdrawal_amt'], minlength=len(months)),
+        'invested': np.bincount(transaction_index, weights=transactions['amount'] * (kinds == 1), minlength=len(months)),
+        'redeemed': np.bincount(transaction_index, weights=transactions['amount'] * (kinds == -1), minlength=len(months)),
+    }
+    columns = {name: values.tolist() for name, values in columns.items()}
+    return [dict({'month': month}, **{name: values[i] for name, values in columns.items()})
+            for i, month in enumerate(np.datetime_as_string(months).tolist())]
+
+NUMPY_REPORTS = {'monthly_balances': monthly_balances, 'fund_units': fund_units, 'monthly_cash_flows': monthly_cash_flows}
+
+class Analytics:
+    """
+    Runs the roll-up reports (REPORTS). With DuckDB installed they run as SQL, either over the SQLite
+    file attached read-only (when DuckDB's sqlite extension is available) or over the snapshot's
+    columns; several reports run in parallel on their own cursors.
+    Without DuckDB they are computed from the snapshot with NumPy. Neither touches db_session.
+    Results are kept until the snapshot's data versions change.
+    """
+
+    def __init__(self):
+        self.configure()
+
+    def configure(self, backend='auto', database_path=None):
+        """backend is 'duckdb', 'numpy' or 'auto' (DuckDB when it is installed)."""
+        if backend not in ('auto', 'duckdb', 'numpy'):
+            raise ValueError(f"Unknown analytics backend: {backend}")
+        if backend == 'duckdb' and not DUCKDB_INSTALLED:
+            raise ValueError("The duckdb analytics backend needs the duckdb package")
+        if backend == 'auto':
+            backend = 'duckdb' if DUCKDB_INSTALLED else 'numpy'
+        self.backend = backend
+        self.database_path = os.path.abspath(database_path) if database_path else None
+        self._connection = None
+        self._pid = None
+        self._attached = False
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def _duckdb(self):
+        import duckdb
+        # DuckDB connections can't be carried over a fork; each worker process opens its own
+        with self._lock:
+            if self._connection is None or self._pid != os.getpid():
+                self._connection = duckdb.connect()
+                self._pid = os.getpid()
+                self._attached = False
+                if self.database_path and os.path.exists(self.database_path):
+                    try:
+                        self._connection.execute('LOAD sqlite')
+                        self._connection.execute(f"ATTACH '{self.database_path.replace(chr(39), chr(39) * 2)}' AS finances (TYPE SQLITE, READ_ONLY)")
+                        self._connection.execute(ATTACHED_VIEWS)
+                        self._attached = True
+                    except duckdb.Error as e:
+                        logger.warning(f"DuckDB can't attach {self.database_path}, reading the snapshot instead: {e}")
+            return self._connection
+
+    def _query(self, connection, name, snapshot):
+        cursor = connection.cursor()
+        try:
+            if not self._attached:
+                cursor.register('transaction_columns', _columns(snapshot.transactions))
+                cursor.register('balance_columns', _columns(snapshot.balances, {'bank': 'bank_index'}))
+                cursor.register('fund_names', {'fund': np.arange(len(snapshot.fund_names), dtype=np.int32),
+                                               'fund_name': np.array(snapshot.fund_names, dtype=object)})
+                cursor.register('bank_names', {'bank_index': np.arange(len(snapshot.banks), dtype=np.int32),
+                                               'bank': np.array(snapshot.banks, dtype=object)})
+                cursor.execute(SNAPSHOT_VIEWS)
+            result = cursor.execute(QUERIES[name])
+            columns = [column[0] for column in result.description]
+            return [dict(zip(columns, row)) for row in result.fetchall()]
+        finally:
+            cursor.close()
+
+    def run(self, names, snapshot):
+        """Returns {name: rows} for the reports in names, each row a dict."""
+        unknown = [name for name in names if name not in REPORTS]
+        if unknown:
+            raise ValueError(f"Unknown reports: {', '.join(unknown)}")
+        versions = json.dumps(snapshot.versions, sort_keys=True)
+        results = {name: self._results[name][1] for name in names
+                   if name in self._results and self._results[name][0] == versions}
+        missing = [name for name in names if name not in results]
+        if self.backend == 'duckdb' and missing:
+            connection = self._duckdb()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(missing)) as executor:
+                futures = {name: executor.submit(self._query, connection, name, snapshot) for name in missing}
+                results.update({name: future.result() for name, future in futures.items()})
+        else:
+            results.update({name: NUMPY_REPORTS[name](snapshot) for name in missing})
+        for name in missing:
+            self._results[name] = (versions, results[name])
+        return results
+
+analytics = Analytics()
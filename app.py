@@ -1,38 +1,132 @@
 import os
-from flask import Flask, request, redirect, url_for, render_template, flash, get_flashed_messages
+from flask import Flask, Blueprint, current_app, has_app_context, request, redirect, url_for, render_template, flash, get_flashed_messages, jsonify
 from werkzeug.utils import secure_filename
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, inspect
+from sqlalchemy import create_engine, event, Column, Integer, String, Float, DateTime, inspect
 from sqlalchemy.orm import scoped_session, sessionmaker, declarative_base
-from models import Base, AccountBalance, Fund, MutualFundTransaction, FixedDeposit
-import pandas as pd
+from models import Base, AccountBalance, Fund, MutualFundTransaction, FixedDeposit, ImportRun, CategoryRule, ScheduledJob, IngestedFile
 import sys
 import json
-import requests
-from fuzzywuzzy import fuzz
-from fuzzywuzzy import process
-from pyxirr import xirr
 import datetime
+import numpy as np
 from sqlalchemy import text,func
 import locale
-from fileparse import *
+import threading
+from flask.globals import app_ctx
+from cache import shared_cache
+from mfapi import mfapi
+# pandas, tabula, PyPDF2, requests and fuzzywuzzy are imported by the routes that use them (mostly
+# through fileparse), so importing this module and starting a worker stays cheap
+from bulkops import parse_operations, apply_operations
+from instrumentation import init_instrumentation
+from delivery import init_delivery
+from tracing import slowest_stages
+from dataversion import track_data_versions, data_versions
+from snapshot import KIND_CODES, get_snapshot
+from analytics import REPORTS, analytics
+from categorizer import RULE_KINDS, UNCATEGORIZED, backfill_categories, spend_by_category
+from search import SEARCH_TABLES, init_search, search, search_available
+from scheduler import JOBS, job_status, parse_schedule
+from reconcile import GAP_DAYS, audit_balances, describe as describe_reconciliation
+from metrics import RISK_FREE_RATE, RISK_YEARS, correlation_report, fund_metrics
+from archive import PARQUET_INSTALLED, archive_horizon, history, read_archive
+from projection import DEFAULT_PATHS, MIN_HISTORY_MONTHS, goal_projection
+from charts import chart_args, cached_json_response, closing_balance_history, holdings_history, window
+from fdengine import COMPOUNDING_PERIODS, add_months, compute_fixed_deposits, maturity_ladder, maturity_date as fd_maturity_date
 
 locale.setlocale(locale.LC_ALL, '')
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'xlsx','pdf'}
-DATABASE_URI = 'sqlite:///finances.db'
-
-app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SECRET_KEY'] = 'super secret key' # Replace with a real secret key
-
-engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+DATABASE_URI = os.environ.get('DATABASE_URI', 'sqlite:///finances.db')
+CACHE_PATH = os.environ.get('CACHE_PATH', 'finapp_cache.db')
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', 'snapshot')
+ANALYTICS_BACKEND = os.environ.get('ANALYTICS_BACKEND', 'numpy')
+MFAPI_MODE = os.environ.get('MFAPI_MODE', 'live')
+HTTP_CACHE_PATH = os.environ.get('HTTP_CACHE_PATH', 'http_cache.db')
+MFAPI_FIXTURES = os.environ.get('MFAPI_FIXTURES', os.path.join('fixtures', 'mfapi'))
+SCHEDULE = parse_schedule(os.environ.get('SCHEDULE'))
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'archive')
+ARCHIVE_HORIZON_DAYS = int(os.environ['ARCHIVE_HORIZON_DAYS']) if os.environ.get('ARCHIVE_HORIZON_DAYS') else None
+TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR', 'template_cache')
+UPLOAD_RETENTION_DAYS = int(os.environ.get('UPLOAD_RETENTION_DAYS', 7))
+RISK_FREE_RATE = float(os.environ.get('RISK_FREE_RATE', RISK_FREE_RATE))
+PROJECTION_WORKERS = int(os.environ.get('PROJECTION_WORKERS', 1))
+
+def session_scope():
+    # One session per application context (i.e. per request), so threaded workers never share a
+    # session; code running outside Flask (imports from the command line) gets one per thread
+    if has_app_context():
+        return id(app_ctx._get_current_object())
+    return threading.get_ident()
+
+# Bound to the application's engine by create_app()
 db_session = scoped_session(sessionmaker(autocommit=False,
-                                         autoflush=False,
-                                         bind=engine))
+                                         autoflush=False),
+                            scopefunc=session_scope)
 Base.query = db_session.query_property()
 
+main = Blueprint('main', __name__)
+
+def create_app(config=None):
+    """
+    Creates the Flask application. `config` overrides the defaults below, e.g.
+    create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///test.db'}).
+    db_session is shared by the process, so it is bound to the engine of the last app created.
+    """
+    app = Flask(__name__)
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SECRET_KEY'] = 'super secret key' # Replace with a real secret key
+    app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING') == '1' # Add a Server-Timing header to responses
+    app.config['CACHE_PATH'] = CACHE_PATH # SQLite file shared by all workers; None disables the cache
+    app.config['SNAPSHOT_DIR'] = SNAPSHOT_DIR # Memory-mapped analytics snapshot shared by all workers; None keeps it per process
+    app.config['ANALYTICS_BACKEND'] = ANALYTICS_BACKEND # 'numpy', 'duckdb' or 'auto' (DuckDB when installed) for the roll-up reports
+    app.config['MFAPI_MODE'] = MFAPI_MODE # 'live', 'record' (also saves fixtures) or 'replay' (fixtures only, no network), see mfapi.py
+    app.config['HTTP_CACHE_PATH'] = HTTP_CACHE_PATH # SQLite file caching mfapi.in responses for all workers; None disables it
+    app.config['MFAPI_FIXTURES'] = MFAPI_FIXTURES # Directory of recorded mfapi.in responses
+    app.config['SCHEDULER'] = os.environ.get('SCHEDULER', '1') == '1' # Run the maintenance jobs in the served workers, see scheduler.py
+    app.config['SCHEDULE'] = SCHEDULE # job name -> schedule, overriding scheduler.DEFAULT_SCHEDULE
+    app.config['UPLOAD_RETENTION_DAYS'] = UPLOAD_RETENTION_DAYS # Uploaded statements older than this are removed
+    app.config['RISK_FREE_RATE'] = RISK_FREE_RATE # Annual rate the Sharpe and Sortino ratios are measured against
+    app.config['ARCHIVE_DIR'] = ARCHIVE_DIR # Parquet files of the balance and transaction rows archived by archive.py
+    app.config['ARCHIVE_HORIZON_DAYS'] = ARCHIVE_HORIZON_DAYS # Rows older than this are archived daily by the scheduler; None keeps every row hot
+    app.config['TEMPLATE_CACHE_DIR'] = TEMPLATE_CACHE_DIR # Compiled templates shared by all workers; None compiles them in each
+    app.config['PROJECTION_WORKERS'] = PROJECTION_WORKERS # Processes simulating goal projections; 1 simulates in the request
+    if config:
+        app.config.update(config)
+
+    engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', configure_sqlite_connection)
+    db_session.remove()
+    db_session.configure(bind=engine)
+    app.extensions['engine'] = engine
+    shared_cache.configure(app.config['CACHE_PATH'])
+    mfapi.configure(app.config['MFAPI_MODE'], app.config['HTTP_CACHE_PATH'], app.config['MFAPI_FIXTURES'])
+    analytics.configure(app.config['ANALYTICS_BACKEND'], engine.url.database if engine.dialect.name == 'sqlite' else None)
+
+    app.register_blueprint(main)
+    init_instrumentation(app)
+    init_delivery(app)
+    track_data_versions()
+    return app
+
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    # WAL lets dashboard reads proceed while an import is writing, and the busy timeout makes
+    # concurrent writers from other workers wait for the lock instead of failing
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA busy_timeout=30000')
+    cursor.close()
+
+def __getattr__(name):
+    # `app.app` builds a default application the first time it is used, for callers that expect a module-level app
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 def load_fund_codes(cache_file='fund_mapping_cache.json'):
     fund_code_mapping = {}
 
@@ -46,7 +140,7 @@ def load_fund_codes(cache_file='fund_mapping_cache.json'):
 
     try:
         # Fetch the list of all mutual funds
-        response = requests.get("https://api.mfapi.in/mf")
+        response = mfapi.get("mf")
 
         if response.status_code == 200:
             funds_data = response.json()
@@ -91,7 +185,7 @@ def fetch_current_nav(fund_code):
         return None
 
     try:
-        response = requests.get(f"https://api.mfapi.in/mf/{fund_code}")
+        response = mfapi.get(f"mf/{fund_code}")
         if response.status_code == 200:
             data = response.json()
             if 'data' in data and data['data']:
@@ -106,17 +200,59 @@ def fetch_current_nav(fund_code):
     return None
 
 
+# Columns added to existing tables after they were first created; create_all only creates missing tables
+ADDED_COLUMNS = [
+    ('fixed_deposits', 'compounding', "VARCHAR(20) NOT NULL DEFAULT 'quarterly'"),
+    ('data_version', 'rewritten', "INTEGER NOT NULL DEFAULT 0"),
+    ('account_balances', 'category', "VARCHAR(60)"),
+    ('account_balances', 'carried_forward', "INTEGER"),
+    ('mutual_fund_transactions', 'carried_forward', "INTEGER"),
+]
+
 def init_db():
+    engine = db_session.get_bind()
     Base.metadata.create_all(bind=engine)
-
-@app.teardown_appcontext
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table_name, column_name, column_type in ADDED_COLUMNS:
+            if column_name not in [column['name'] for column in inspector.get_columns(table_name)]:
+                connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}"))
+        # create_all only creates the indexes of tables it creates
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+        init_search(connection)
+
+@main.teardown_app_request
 def shutdown_session(exception=None):
     db_session.remove()
 
+def format_currency(value):
+    """Formats an amount with the locale's currency symbol and grouping, dropping the paise."""
+    try:
+        return locale.currency(value, grouping=True).split('.')[0]
+    except ValueError:
+        # The C locale (containers, benchmark runs) has no currency format
+        return f"{int(value):,}"
+
+def analytics_snapshot():
+    """Returns the columnar snapshot of transactions, balances and NAVs used by the analytical routes."""
+    return get_snapshot(db_session, current_app.config['SNAPSHOT_DIR'])
+
+def holding_values(snapshot):
+    """Current value of the units held of each fund, by fund code (as on the performance page)."""
+    values = snapshot.units_held() * np.nan_to_num(np.asarray(snapshot.navs))
+    return {code: value for code, value in zip(snapshot.fund_codes, values.tolist()) if code}
+
+def holdings_metrics(snapshot, as_of=None):
+    """Rolling returns and risk metrics of every fund in the snapshot, and of the portfolio weighted by current value."""
+    return fund_metrics(db_session, [code for code in snapshot.fund_codes if code], as_of, holding_values(snapshot),
+                        current_app.config['RISK_FREE_RATE'])
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-@app.route('/', methods=['GET', 'POST'])
+@main.route('/', methods=['GET', 'POST'])
 def upload_file():
     if request.method == 'POST':
         if 'mutual_funds_file' not in request.files or 'account_balances_file' not in request.files:
@@ -135,26 +271,27 @@ def upload_file():
 
         if mutual_funds_file and allowed_file(mutual_funds_file.filename):
             mutual_funds_filename = secure_filename(mutual_funds_file.filename)
-            mutual_funds_filepath = os.path.join(app.config['UPLOAD_FOLDER'], mutual_funds_filename)
+            mutual_funds_filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], mutual_funds_filename)
             mutual_funds_file.save(mutual_funds_filepath)
 
         if account_balances_file and allowed_file(account_balances_file.filename):
             account_balances_filename = secure_filename(account_balances_file.filename)
-            account_balances_filepath = os.path.join(app.config['UPLOAD_FOLDER'], account_balances_filename)
+            account_balances_filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], account_balances_filename)
             account_balances_file.save(account_balances_filepath)
 
         if not mutual_funds_filepath and not account_balances_filepath:
             flash('Invalid file type for one or both files', 'danger')
-            return redirect(url_for('upload_file')) # Redirect back to the upload page
+            return redirect(url_for('main.upload_file')) # Redirect back to the upload page
 
         pdf_password = request.form.get('pdf_password')
 
         # Process files without committing to get new and last entries
+        from fileparse import process_excel_data
         result = process_excel_data(db_session, mutual_funds_filepath, account_balances_filepath, password=pdf_password, commit_changes=False)
 
         if result.get('error'):
             flash(f"Error processing files: {result['error']}", 'danger')
-            return redirect(url_for('upload_file'))
+            return redirect(url_for('main.upload_file'))
 
         # Render confirmation page with last and new entries
         return render_template('confirm_upload.html',
@@ -162,127 +299,102 @@ def upload_file():
                                new_mutual_fund_transactions=result.get('new_mutual_fund_transactions', []),
                                last_account_balances=result.get('last_account_balances', []),
                                new_account_balances=result.get('new_account_balances', []),
+                               reconciliation_issues=describe_reconciliation(result['reconciliation']) if result.get('reconciliation') else [],
+                               skipped_funds=result.get('skipped_funds', {}),
                                mutual_funds_file=mutual_funds_filename,
                                account_balances_file=account_balances_filename)
 
     # Existing GET logic unchanged
-    # Fetch latest account balance for each bank and sum their closing balances
-    from sqlalchemy import func, and_, select
-    # Subquery to get max date per bank
-    max_date_subq = db_session.query(
-        AccountBalance.bank,
-        func.max(AccountBalance.date).label('max_date')
-    ).group_by(AccountBalance.bank).subquery()
-
-    # Subquery to get max id per bank and max date (to uniquely identify latest entry)
-    max_id_subq = db_session.query(
-        AccountBalance.bank,
-        AccountBalance.date,
-        func.max(AccountBalance.id).label('max_id')
-    ).join(
-        max_date_subq,
-        and_(
-            AccountBalance.bank == max_date_subq.c.bank,
-            AccountBalance.date == max_date_subq.c.max_date
-        )
-    ).group_by(AccountBalance.bank, AccountBalance.date).subquery()
-
-    # Query to get latest unique entries per bank by joining on bank, date, and id
-    latest_balances = db_session.query(AccountBalance).join(
-        max_id_subq,
-        and_(
-            AccountBalance.bank == max_id_subq.c.bank,
-            AccountBalance.date == max_id_subq.c.date,
-            AccountBalance.id == max_id_subq.c.max_id
-        )
-    ).all()
-    latest_balance = sum(balance.closing_balance for balance in latest_balances) if latest_balances else 0
-    
-    # Calculate total current value of mutual funds
-    fund_performance = {}
-    transactions = MutualFundTransaction.query.order_by(MutualFundTransaction.timestamp).all()
-    funds = db_session.query(Fund).all()
-    fund_info = {fund.fund_name: {'fund_code': fund.fund_code, 'current_nav': fund.current_nav} for fund in funds}
+    snapshot = analytics_snapshot()
+    # Sum the closing balance of the latest entry of each bank
+    latest_balance = float(snapshot.balances['closing_balance'][snapshot.latest_balances()].sum())
 
-    for transaction in transactions:
-        fund_name = transaction.fund_name
-        if fund_name not in fund_performance:
-            fund_performance[fund_name] = {
-                'total_units': 0,
-                'current_nav': fund_info.get(fund_name, {}).get('current_nav', 0.0)
-            }
-        if transaction.transaction_type.lower() == 'buy':
-            fund_performance[fund_name]['total_units'] += transaction.units
-        elif transaction.transaction_type.lower() == 'sell':
-            fund_performance[fund_name]['total_units'] -= transaction.units
-
-    total_mutual_fund_value = sum(fund['total_units'] * fund['current_nav'] for fund in fund_performance.values() if fund['current_nav'] is not None)
+    # Calculate total current value of mutual funds at their current NAVs
+    navs = np.nan_to_num(np.asarray(snapshot.navs))
+    total_mutual_fund_value = float((snapshot.units_held() * navs).sum())
 
-    # Calculate total fixed deposit amount
-    total_fixed_deposit_amount = db_session.query(func.sum(FixedDeposit.amount)).scalar() or 0
+    # Calculate current value (principal plus accrued interest) of fixed deposits that are still held
+    held_fixed_deposits = FixedDeposit.query.filter(FixedDeposit.status != 'closed').all()
+    total_fixed_deposit_amount = float(compute_fixed_deposits(held_fixed_deposits)['current_value'].sum())
 
     # Calculate total portfolio net worth
-    total_net_worth = locale.currency(int(latest_balance + total_mutual_fund_value + total_fixed_deposit_amount),grouping=True).split('.')[0]
+    total_net_worth = format_currency(int(latest_balance + total_mutual_fund_value + total_fixed_deposit_amount))
 
-    return render_template('index.html', latest_balance=locale.currency(latest_balance,grouping=True).split('.')[0], 
-                        total_mutual_fund_value=locale.currency((total_mutual_fund_value), grouping=True).split('.')[0],
-                        total_fixed_deposit_amount=locale.currency((total_fixed_deposit_amount), grouping=True).split('.')[0],
+    return render_template('index.html', latest_balance=format_currency(latest_balance),
+                        total_mutual_fund_value=format_currency(total_mutual_fund_value),
+                        total_fixed_deposit_amount=format_currency(total_fixed_deposit_amount),
                         total_net_worth=total_net_worth)
 
-@app.route('/confirm_upload', methods=['POST'])
+@main.route('/confirm_upload', methods=['POST'])
 def confirm_upload():
     confirm = request.form.get('confirm')
     mutual_funds_file = request.form.get('mutual_funds_file', '')
     account_balances_file = request.form.get('account_balances_file', '')
 
     if confirm == 'yes':
-        mutual_funds_filepath = os.path.join(app.config['UPLOAD_FOLDER'], mutual_funds_file) if mutual_funds_file else ''
-        account_balances_filepath = os.path.join(app.config['UPLOAD_FOLDER'], account_balances_file) if account_balances_file else ''
+        mutual_funds_filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], mutual_funds_file) if mutual_funds_file else ''
+        account_balances_filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], account_balances_file) if account_balances_file else ''
 
         # Process files with commit_changes=True to commit to database
+        from fileparse import process_excel_data
         result = process_excel_data(db_session, mutual_funds_filepath, account_balances_filepath, commit_changes=True)
 
         if result.get('error'):
             flash(f"Error committing data: {result['error']}", 'danger')
         else:
             flash('Data successfully committed to the database.', 'success')
+            if result.get('skipped_funds'):
+                flash(f"Transactions of funds that could not be added were not imported: {', '.join(result['skipped_funds'])}", 'info')
     else:
         flash('Upload cancelled. No changes were made.', 'info')
 
-    return redirect(url_for('upload_file'))
+    return redirect(url_for('main.upload_file'))
 
-@app.route('/balances')
+@main.route('/balances')
 def show_balances():
-    account_balances = AccountBalance.query.order_by(AccountBalance.date.asc()) # Order by date ascending for chart
-    acdf= pd.read_sql(account_balances.statement, account_balances.session.bind)
-    acdf = acdf.sort_values('date')
-    acdf['month'] = acdf['date'].dt.to_period('M')
-    acdf=acdf.groupby(['bank','month']).last().reset_index()[['bank','month','closing_balance']]
-    account_balances_data = []
-    for i,balance in acdf.iterrows():
-        account_balances_data.append({
-            'date': balance.month.strftime('%Y-%m-%d'), # Format date as string
-            'closing_balance': balance.closing_balance,
-            'bank': balance.bank
-        })
-    return render_template('balances.html', account_balances=db_session.execute(text('SELECT bank, MAX(date) as date, closing_balance FROM account_balances GROUP BY bank')), account_balances_data=account_balances_data)
-
-@app.route('/transactions')
+    # The chart loads its series from /api/charts/balances
+    snapshot = analytics_snapshot()
+    latest = snapshot.balances[snapshot.latest_balances()]
+    account_balances = [{'bank': snapshot.banks[bank], 'date': date, 'closing_balance': closing_balance}
+                        for bank, date, closing_balance in zip(latest['bank'].tolist(), latest['date'].tolist(), latest['closing_balance'].tolist())]
+    # Month-end balance of every bank with the month's deposits and withdrawals, newest first
+    reports = analytics.run(['monthly_balances', 'monthly_cash_flows'], snapshot)
+    banks = sorted({row['bank'] for row in reports['monthly_balances']}, key=str)
+    month_end = {(row['month'], row['bank']): row['closing_balance'] for row in reports['monthly_balances']}
+    monthly_summary = [{'month': row['month'], 'balances': [month_end.get((row['month'], bank)) for bank in banks],
+                        'deposits': row['deposits'], 'withdrawals': row['withdrawals']}
+                       for row in reversed(reports['monthly_cash_flows']) if any((row['month'], bank) in month_end for bank in banks)]
+    return render_template('balances.html', account_balances=account_balances, banks=banks, monthly_summary=monthly_summary)
+
+@main.route('/transactions')
 def show_transactions():
     transactions = MutualFundTransaction.query.order_by(MutualFundTransaction.timestamp.desc()).all()
     return render_template('transactions.html', transactions=transactions)
 
-@app.route('/performance')
+@main.route('/performance')
 def show_performance():
     fund_performance = {}
-    transactions = MutualFundTransaction.query.order_by(MutualFundTransaction.timestamp).all()
-
-    # Fetch all funds to get fund_code and current_nav
-    funds = db_session.query(Fund).all()
-    fund_info = {fund.fund_name: {'fund_code': fund.fund_code, 'current_nav': fund.current_nav} for fund in funds}
-
-    for transaction in transactions:
-        fund_name = transaction.fund_name
+    snapshot = analytics_snapshot()
+    transactions = snapshot.transactions
+    navs = np.nan_to_num(np.asarray(snapshot.navs)).tolist()
+    # XIRR sees archived transactions as they happened rather than the carry-forward rows standing in
+    # for them; without pyarrow to read the archive, the carried positions count as bought at the horizon
+    archived_cash_flows = {}
+    carried_as_bought = bool(transactions['carried'].any())
+    if carried_as_bought and PARQUET_INSTALLED:
+        archived = read_archive(db_session, current_app.config['ARCHIVE_DIR'], MutualFundTransaction)
+        for fund_name, transaction_type, amount, timestamp in zip(archived['fund_name'].tolist(), archived['transaction_type'].tolist(),
+                                                                  archived['amount'].fillna(0).tolist(), archived['timestamp'].tolist()):
+            kind = KIND_CODES.get(str(transaction_type).lower(), 0)
+            archived_cash_flows.setdefault(fund_name, []).append((-abs(amount) if kind == KIND_CODES['buy'] else abs(amount), timestamp))
+        carried_as_bought = False
+
+    # Walk the transaction columns in (timestamp, id) order; average cost basis depends on the order
+    for timestamp, fund, kind, amount, units, nav, carried in zip(transactions['timestamp'].tolist(), transactions['fund'].tolist(),
+                                                                  transactions['kind'].tolist(), transactions['amount'].tolist(),
+                                                                  transactions['units'].tolist(), transactions['nav'].tolist(),
+                                                                  transactions['carried'].tolist()):
+        fund_name = snapshot.fund_names[fund]
 
         if fund_name not in fund_performance:
             fund_performance[fund_name] = {
@@ -290,43 +402,40 @@ def show_performance():
                 'total_units': 0,
                 'realized_gains': 0.0,
                 'unrealized_gains': 0.0,
-                'xirr_cash_flows': [], # For XIRR calculation [(amount, date)]
+                'xirr_cash_flows': archived_cash_flows.pop(fund_name, []), # For XIRR calculation [(amount, date)]
                 'cost_basis': 0.0, # For average cost basis tracking
-                'transactions': [],
-                'fund_code': fund_info.get(fund_name, {}).get('fund_code'), # Get fund code from fund_info
-                'current_nav': fund_info.get(fund_name, {}).get('current_nav', 0.0) # Get current_nav from fund_info
+                'fund_code': snapshot.fund_codes[fund],
+                'current_nav': navs[fund]
             }
 
         fund_data = fund_performance[fund_name]
-        fund_data['transactions'].append(transaction)
 
         # For XIRR calculation, amount is negative for buys, positive for sells
-        xirr_amount = -abs(transaction.amount) if transaction.transaction_type.lower() == 'buy' else abs(transaction.amount)
-        fund_data['xirr_cash_flows'].append((xirr_amount, transaction.timestamp))
-
+        xirr_amount = -abs(amount) if kind == KIND_CODES['buy'] else abs(amount)
+        if not carried or carried_as_bought:
+            fund_data['xirr_cash_flows'].append((xirr_amount, timestamp))
 
-        if transaction.transaction_type.lower() == 'buy':
-            fund_data['total_invested'] += transaction.amount
-            fund_data['total_units'] += transaction.units
+        if kind == KIND_CODES['buy']:
+            fund_data['total_invested'] += amount
+            fund_data['total_units'] += units
             # Update average cost basis
-            fund_data['cost_basis'] += transaction.amount
-        elif transaction.transaction_type.lower() == 'sell':
+            fund_data['cost_basis'] += amount
+        elif kind == KIND_CODES['sell']:
             # Calculate realized gains using average cost basis
+            average_cost_per_unit = 0.0
             if fund_data['total_units'] > 0:
                 average_cost_per_unit = fund_data['cost_basis'] / fund_data['total_units']
-                realized_gain = (transaction.nav - average_cost_per_unit) * transaction.units
-                fund_data['realized_gains'] += realized_gain # Take absolute value of realized gain
+                realized_gain = (nav - average_cost_per_unit) * units
+                fund_data['realized_gains'] += realized_gain
 
             # Update total_units for sell transactions
-            fund_data['total_units'] -= transaction.units
+            fund_data['total_units'] -= units
             # Update cost basis after selling
-            fund_data['cost_basis'] -= average_cost_per_unit * transaction.units
+            fund_data['cost_basis'] -= average_cost_per_unit * units
 
 
     # Calculate Unrealized Gains and XIRR
-    import numpy_financial as npf
-    import datetime
-    import requests
+    from pyxirr import xirr
 
     for fund_name, fund_data in fund_performance.items():
         current_nav = fund_data['current_nav'] # Use current_nav from fund_info
@@ -358,40 +467,13 @@ def show_performance():
             print(f"XIRR not calculated for {fund_name}: Insufficient cash flows or current NAV <= 0")
             fund_data['xirr'] = 0.0 # Not enough cash flows or current NAV to calculate XIRR
 
-        # Calculate Unrealized Gains and XIRR
-        if fund_data['total_units'] > 0 and current_nav > 0:
-            current_value = fund_data['total_units'] * current_nav
-            # Unrealized gain is current value minus the remaining cost basis
-            remaining_cost_basis = fund_data['cost_basis']
-            fund_data['unrealized_gains'] = current_value - remaining_cost_basis
-        else:
-             fund_data['unrealized_gains'] = 0.0 # No units or current NAV, no unrealized gain
-
-        # Calculate XIRR
-        if len(fund_data['xirr_cash_flows']) > 1 and current_nav > 0:
-            # Add the current value as a final cash flow at today's date for XIRR
-            today = datetime.date.today()
-            final_cash_flow_amount = fund_data['total_units'] * current_nav
-            xirr_values = [cf[0] for cf in fund_data['xirr_cash_flows']] + [final_cash_flow_amount]
-            xirr_dates = [cf[1] for cf in fund_data['xirr_cash_flows']] + [today]
-
-            try:
-                # Convert datetime objects to date objects for xirr
-                xirr_dates = [d.date() if isinstance(d, datetime.datetime) else d for d in xirr_dates]
-                fund_data['xirr'] = xirr(xirr_dates,xirr_values)
-            except Exception as e:
-                print(f"  Error calculating overall XIRR: {e}")
-                fund_data['xirr'] = 0.0 # Handle cases where XIRR cannot be calculated (e.g., no cash flows)
-        else:
-            print(f"XIRR not calculated for {fund_name}: Insufficient cash flows or current NAV <= 0")
-            fund_data['xirr'] = 0.0 # Not enough cash flows or current NAV to calculate XIRR
-
     # Calculate total realized and unrealized gains
     total_realized_gains = sum(fund['realized_gains'] for fund in fund_performance.values())
     total_unrealized_gains = sum(fund['unrealized_gains'] for fund in fund_performance.values())
 
     # Calculate overall XIRR
-    overall_xirr_cash_flows = []
+    # Funds sold in full before the archive horizon still count towards it
+    overall_xirr_cash_flows = [cash_flow for cash_flows in archived_cash_flows.values() for cash_flow in cash_flows]
     for fund_data in fund_performance.values():
         overall_xirr_cash_flows.extend(fund_data['xirr_cash_flows'])
 
@@ -411,102 +493,29 @@ def show_performance():
             print(f"  Error calculating overall XIRR: {e}")
             overall_xirr = 0.0
 
-    # Calculate total realized and unrealized gains
-    total_realized_gains = sum(fund['realized_gains'] for fund in fund_performance.values())
-    total_unrealized_gains = sum(fund['unrealized_gains'] for fund in fund_performance.values())
-
-    # Calculate overall XIRR
-    overall_xirr_cash_flows = []
+    # Rolling returns, volatility, drawdown and risk-adjusted returns from the NAV history
+    metrics = holdings_metrics(snapshot)
     for fund_data in fund_performance.values():
-        overall_xirr_cash_flows.extend(fund_data['xirr_cash_flows'])
-
-    overall_xirr = 0.0
-    if len(overall_xirr_cash_flows) > 1:
-        # Add the current total value as a final cash flow at today's date for overall XIRR
-        today = datetime.date.today()
-        total_current_value = sum(fund['total_units'] * fund['current_nav'] for fund in fund_performance.values() if fund['current_nav'] > 0)
-        overall_xirr_values = [cf[0] for cf in overall_xirr_cash_flows] + [total_current_value]
-        overall_xirr_dates = [cf[1] for cf in overall_xirr_cash_flows] + [today]
-
-        try:
-            # Convert datetime objects to date objects for xirr
-            overall_xirr_dates = [d.date() if isinstance(d, datetime.datetime) else d for d in overall_xirr_dates]
-            overall_xirr = xirr(overall_xirr_dates, overall_xirr_values)
-        except Exception as e:
-            print(f"  Error calculating overall XIRR: {e}")
-            overall_xirr = 0.0
-
-    # --- Chart Data Preparation ---
-    portfolio_history = {}
-    fund_history = {fund_name: {} for fund_name in fund_performance.keys()}
-
-    all_dates = sorted(list(set([t.timestamp.date() for t in transactions])))
-    if not all_dates:
-        all_dates = [datetime.date.today()] # Ensure at least today's date if no transactions
-
-    # Initialize holdings and cost basis
-    current_holdings = {fund_name: 0.0 for fund_name in fund_performance.keys()}
-    current_cost_basis = {fund_name: 0.0 for fund_name in fund_performance.keys()}
-
-    # Iterate through dates and calculate portfolio value
-    for date in all_dates:
-        # Process transactions up to this date
-        transactions_on_date = [t for t in transactions if t.timestamp.date() == date]
-        for transaction in transactions_on_date:
-            fund_name = transaction.fund_name
-            if transaction.transaction_type.lower() == 'buy':
-                current_holdings[fund_name] += transaction.units
-                current_cost_basis[fund_name] += transaction.amount
-            elif transaction.transaction_type.lower() == 'sell':
-                 # Adjust cost basis for sells based on average cost
-                 if fund_performance[fund_name]['total_units'] > 0: # Use total units from initial calculation
-                     average_cost_per_unit = fund_performance[fund_name]['cost_basis'] / fund_performance[fund_name]['total_units']
-                     current_cost_basis[fund_name] -= average_cost_per_unit * transaction.units
-                 current_holdings[fund_name] -= transaction.units
-
-
-        # Fetch NAVs for this date (simplified: using latest available NAV)
-        # A more accurate approach would fetch historical NAVs for each date
-        current_navs = {fund_name: fund_performance[fund_name]['current_nav'] for fund_name in fund_performance.keys()} # Using latest NAV for simplicity
-
-        # Calculate portfolio value on this date
-        portfolio_value_on_date = 0
-        for fund_name, units in current_holdings.items():
-            if fund_name in current_navs and current_navs[fund_name] > 0:
-                 fund_value = units * current_navs[fund_name]
-                 portfolio_value_on_date += fund_value
-                 fund_history[fund_name][date.isoformat()] = fund_value # Store fund value history
-
-        portfolio_history[date.isoformat()] = portfolio_value_on_date # Store total portfolio value history
-
-    # Ensure today's value is included if not already
-    today_str = datetime.date.today().isoformat()
-    if today_str not in portfolio_history:
-         total_current_value = sum(fund['total_units'] * fund['current_nav'] for fund in fund_performance.values() if fund['current_nav'] > 0)
-         portfolio_history[today_str] = total_current_value
-         for fund_name, fund_data in fund_performance.items():
-              if fund_data['current_nav'] > 0:
-                   fund_history[fund_name][today_str] = fund_data['total_units'] * fund_data['current_nav']
-
-
-    # Sort history by date
-    sorted_portfolio_history = sorted(portfolio_history.items())
-    sorted_fund_history = {fund_name: sorted(history.items()) for fund_name, history in fund_history.items()}
+        fund_data['metrics'] = metrics['funds'].get(fund_data['fund_code'])
 
+    # Money invested in and redeemed from the funds per month, newest first
+    monthly_investments = [row for row in reversed(analytics.run(['monthly_cash_flows'], snapshot)['monthly_cash_flows'])
+                           if row['invested'] or row['redeemed']]
 
+    # The charts load their series from /api/charts/portfolio
     return render_template('performance.html',
                            fund_performance=fund_performance,
                            total_realized_gains=total_realized_gains,
                            total_unrealized_gains=total_unrealized_gains,
                            overall_xirr=overall_xirr,
-                           portfolio_history=sorted_portfolio_history,
-                           fund_history=sorted_fund_history)
+                           portfolio_metrics=metrics['portfolio'],
+                           monthly_investments=monthly_investments)
 
-@app.route('/update_database', methods=['GET'])
+@main.route('/update_database', methods=['GET'])
 def update_database_form():
     return render_template('update_database.html')
 
-@app.route('/add_transaction', methods=['POST'])
+@main.route('/add_transaction', methods=['POST'])
 def add_transaction():
     try:
         fund_name = request.form['fund_name']
@@ -527,12 +536,12 @@ def add_transaction():
         )
         db_session.add(new_transaction)
         db_session.commit()
-        return redirect(url_for('show_transactions')) # Redirect to transactions page
+        return redirect(url_for('main.show_transactions')) # Redirect to transactions page
     except Exception as e:
         db_session.rollback()
         return f"Error adding transaction: {e}", 500
 
-@app.route('/edit_transaction/<int:transaction_id>', methods=['GET', 'POST'])
+@main.route('/edit_transaction/<int:transaction_id>', methods=['GET', 'POST'])
 def edit_transaction(transaction_id):
     transaction = MutualFundTransaction.query.get(transaction_id)
     if request.method == 'POST':
@@ -546,13 +555,13 @@ def edit_transaction(transaction_id):
             transaction.timestamp = datetime.datetime.fromisoformat(timestamp_str)
 
             db_session.commit()
-            return redirect(url_for('show_transactions')) # Redirect to transactions page
+            return redirect(url_for('main.show_transactions')) # Redirect to transactions page
         except Exception as e:
             db_session.rollback()
             return f"Error updating transaction: {e}", 500
     return render_template('update_database.html', transaction=transaction)
 
-@app.route('/new_transaction', methods=['GET', 'POST'])
+@main.route('/new_transaction', methods=['GET', 'POST'])
 def new_transaction():
     if request.method == 'POST':
         try:
@@ -566,32 +575,62 @@ def new_transaction():
             )
             db_session.add(new_transaction)
             db_session.commit()
-            return redirect(url_for('show_transactions')) # Redirect to transactions page
+            return redirect(url_for('main.show_transactions')) # Redirect to transactions page
         except Exception as e:
             db_session.rollback()
             return f"Error adding transaction: {e}", 500
     return render_template('create_transaction.html')
 
-@app.route('/delete_transaction/<int:transaction_id>', methods=['POST'])
+@main.route('/delete_transaction/<int:transaction_id>', methods=['POST'])
 def delete_transaction(transaction_id):
     transaction = MutualFundTransaction.query.get(transaction_id)
     if transaction:
         try:
             db_session.delete(transaction)
             db_session.commit()
-            return redirect(url_for('show_transactions')) # Redirect to transactions page
+            return redirect(url_for('main.show_transactions')) # Redirect to transactions page
         except Exception as e:
             db_session.rollback()
             return f"Error deleting transaction: {e}", 500
     return "Transaction not found", 404
 
-@app.route('/fixed_deposits', methods=['GET'])
+def bulk_update(model):
+    """Validates and applies a JSON array of create/update/delete operations in one transaction."""
+    def rejected(error, results, status_code):
+        # Valid items of a rejected batch are reported as skipped, since nothing was written
+        for result in results:
+            result['status'] = result['status'] or 'skipped'
+        return jsonify({'success': False, 'error': error, 'results': results}), status_code
+
+    try:
+        operations, results = parse_operations(model, request.get_json(silent=True))
+    except ValueError as e:
+        return rejected(str(e), [], 400)
+    if any(result['error'] for result in results):
+        return rejected('Validation failed, no changes were made', results, 400)
+    try:
+        if not apply_operations(db_session, model, operations, results):
+            return rejected('Some rows were not found or already deleted in the batch, no changes were made', results, 404)
+    except Exception as e:
+        return rejected(f"Error applying bulk operations: {e}", results, 500)
+    return jsonify({'success': True, 'error': None, 'results': results})
+
+@main.route('/api/transactions/bulk', methods=['POST'])
+def bulk_transactions():
+    return bulk_update(MutualFundTransaction)
+
+@main.route('/fixed_deposits', methods=['GET'])
 def show_fixed_deposits():
     # Retrieve all fixed deposits, regardless of status
     fixed_deposits = FixedDeposit.query.order_by(FixedDeposit.maturity_date.asc()).all()
-    return render_template('fixed_deposits.html', fixed_deposits=fixed_deposits)
-
-@app.route('/new_fixed_deposit', methods=['GET', 'POST'])
+    fd_values = compute_fixed_deposits(fixed_deposits)
+    interest_by_fy = {fy: float(interest.sum()) for fy, interest in fd_values['interest_by_fy'].items()}
+    return render_template('fixed_deposits.html',
+                           fixed_deposits=zip(fixed_deposits, fd_values['current_value'], fd_values['maturity_value']),
+                           interest_by_fy=interest_by_fy,
+                           maturity_ladder=maturity_ladder(fixed_deposits, fd_values['maturity_value']))
+
+@main.route('/new_fixed_deposit', methods=['GET', 'POST'])
 def new_fixed_deposit():
     if request.method == 'POST':
         try:
@@ -599,37 +638,32 @@ def new_fixed_deposit():
                 bank=request.form['bank'],
                 amount=float(request.form['amount']),
                 interest_rate=float(request.form['interest_rate']),
-                start_date=datetime.datetime.fromisoformat(request.form['start_date'])
+                start_date=datetime.datetime.fromisoformat(request.form['start_date']),
+                compounding=request.form.get('compounding', 'quarterly')
             )
+            if new_fd.compounding not in COMPOUNDING_PERIODS:
+                return "Invalid compounding", 400 # Should not happen with dropdown
 
             duration = int(request.form['duration'])
             duration_unit = request.form['duration_unit']
-            start_date = new_fd.start_date
-
-            # Calculate maturity date based on duration unit
-            if duration_unit == 'years':
-                maturity_date = start_date + datetime.timedelta(days=duration * 365.25) # Approximate years
-            elif duration_unit == 'months':
-                # This is a simplified approach for months, a more robust solution might be needed
-                maturity_date = start_date + datetime.timedelta(days=duration * 30.44) # Approximate months
-            elif duration_unit == 'days':
-                maturity_date = start_date + datetime.timedelta(days=duration)
-            else:
-                return "Invalid duration unit", 400 # Should not happen with dropdown
 
-            new_fd.maturity_date = maturity_date
+            # Calculate maturity date based on duration unit, using exact calendar months
+            try:
+                new_fd.maturity_date = fd_maturity_date(new_fd.start_date, duration, duration_unit)
+            except ValueError:
+                return "Invalid duration unit", 400 # Should not happen with dropdown
 
             db_session.add(new_fd)
             db_session.commit()
             flash('Fixed Deposit added successfully!', 'success')
-            return redirect(url_for('show_fixed_deposits'))
+            return redirect(url_for('main.show_fixed_deposits'))
         except Exception as e:
             db_session.rollback()
             flash(f"Error adding fixed deposit: {e}", 'danger')
             return f"Error adding fixed deposit: {e}", 500
     return render_template('create_fixed_deposit.html')
 
-@app.route('/edit_fixed_deposit/<int:fd_id>', methods=['GET', 'POST'])
+@main.route('/edit_fixed_deposit/<int:fd_id>', methods=['GET', 'POST'])
 def edit_fixed_deposit(fd_id):
     fd = FixedDeposit.query.get(fd_id)
     if request.method == 'POST':
@@ -639,42 +673,39 @@ def edit_fixed_deposit(fd_id):
             fd.interest_rate = float(request.form['interest_rate'])
             fd.start_date = datetime.datetime.fromisoformat(request.form['start_date'])
             fd.maturity_date = datetime.datetime.fromisoformat(request.form['maturity_date'])
+            compounding = request.form.get('compounding', fd.compounding)
+            if compounding not in COMPOUNDING_PERIODS:
+                return "Invalid compounding", 400
+            fd.compounding = compounding
 
             db_session.commit()
-            return redirect(url_for('show_fixed_deposits'))
+            return redirect(url_for('main.show_fixed_deposits'))
         except Exception as e:
             db_session.rollback()
             return f"Error updating fixed deposit: {e}", 500
     return render_template('edit_fixed_deposit.html', fd=fd)
 
-@app.route('/delete_fixed_deposit/<int:fd_id>', methods=['POST'])
+@main.route('/delete_fixed_deposit/<int:fd_id>', methods=['POST'])
 def delete_fixed_deposit(fd_id):
     fd = FixedDeposit.query.get(fd_id)
     if fd:
         try:
             db_session.delete(fd)
             db_session.commit()
-            return redirect(url_for('show_fixed_deposits'))
+            return redirect(url_for('main.show_fixed_deposits'))
         except Exception as e:
             db_session.rollback()
             return f"Error deleting fixed deposit: {e}", 500
     return "Fixed Deposit not found", 404
 
-@app.route('/close_fixed_deposit/<int:fd_id>', methods=['POST'])
+@main.route('/close_fixed_deposit/<int:fd_id>', methods=['POST'])
 def close_fixed_deposit(fd_id):
     fd = FixedDeposit.query.get(fd_id)
     if fd:
         try:
-            # Calculate interest earned
-            # Assuming simple interest for the duration from start_date to closure_date
-            # If compounding is needed, a more complex calculation is required.
-            # For simplicity, using today's date as the closure date for calculation
+            # Calculate interest earned up to today (or maturity, if earlier) using the deposit's compounding
             closure_date = datetime.datetime.now()
-            duration_days = (closure_date - fd.start_date).days
-            # Simple interest formula: Principal * Rate * Time / 100
-            # Time in years = duration_days / 365.25 (to account for leap years)
-            time_years = duration_days / 365.25
-            total_interest = (fd.amount * fd.interest_rate * time_years) / 100
+            total_interest = float(compute_fixed_deposits([fd], closure_date)['accrued_interest'][0])
 
             fd.total_interest_earned = total_interest
             fd.status = 'closed' # Or 'matured' if closure_date >= maturity_date
@@ -682,20 +713,353 @@ def close_fixed_deposit(fd_id):
 
             db_session.commit()
             flash(f'Fixed Deposit {fd_id} closed successfully. Interest earned: {total_interest:.2f}', 'success')
-            return redirect(url_for('show_fixed_deposits'))
+            return redirect(url_for('main.show_fixed_deposits'))
         except Exception as e:
             db_session.rollback()
             flash(f"Error closing fixed deposit {fd_id}: {e}", 'danger')
-            return redirect(url_for('show_fixed_deposits'))
+            return redirect(url_for('main.show_fixed_deposits'))
     flash(f"Fixed Deposit {fd_id} not found", 'danger')
     return "Fixed Deposit not found", 404
 
+@main.route('/api/fixed_deposits/bulk', methods=['POST'])
+def bulk_fixed_deposits():
+    return bulk_update(FixedDeposit)
+
+@main.route('/spending', methods=['GET'])
+def show_spending():
+    # Monthly spend per category (newest month first) and the rules that assign the categories
+    report = spend_by_category(db_session)
+    categories = sorted({row['category'] for row in report}, key=lambda category: (category == UNCATEGORIZED, category))
+    spent = {(row['month'], row['category']): row['spent'] for row in report}
+    months = sorted({row['month'] for row in report}, reverse=True)
+    monthly_spend = [{'month': month, 'spent': [spent.get((month, category), 0.0) for category in categories]} for month in months]
+    rules = CategoryRule.query.order_by(CategoryRule.priority.desc(), CategoryRule.category, CategoryRule.id).all()
+    return render_template('spending.html', categories=categories, monthly_spend=monthly_spend, rules=rules, rule_kinds=RULE_KINDS)
+
+@main.route('/category_rules', methods=['POST'])
+def add_category_rule():
+    try:
+        rule = CategoryRule(
+            category=request.form['category'].strip(),
+            pattern=request.form['pattern'].strip(),
+            kind=request.form.get('kind', 'keyword'),
+            priority=int(request.form.get('priority') or 0)
+        )
+        if not rule.category or not rule.pattern or rule.kind not in RULE_KINDS:
+            return "Invalid category rule", 400
+        db_session.add(rule)
+        db_session.commit()
+        # Entries without a category may match the new rule; recategorize to apply it over other rules
+        result = backfill_categories(db_session)
+        flash(f"Category rule added, {result['changed']} entries categorized", 'success')
+        return redirect(url_for('main.show_spending'))
+    except Exception as e:
+        db_session.rollback()
+        return f"Error adding category rule: {e}", 500
+
+@main.route('/delete_category_rule/<int:rule_id>', methods=['POST'])
+def delete_category_rule(rule_id):
+    rule = CategoryRule.query.get(rule_id)
+    if rule:
+        try:
+            db_session.delete(rule)
+            db_session.commit()
+            return redirect(url_for('main.show_spending'))
+        except Exception as e:
+            db_session.rollback()
+            return f"Error deleting category rule: {e}", 500
+    return "Category rule not found", 404
+
+@main.route('/categories/backfill', methods=['POST'])
+def recategorize():
+    # Classifies every stored entry again with the current rules, in batches
+    try:
+        result = backfill_categories(db_session, recategorize=True)
+    except Exception as e:
+        db_session.rollback()
+        return f"Error categorizing entries: {e}", 500
+    flash(f"{result['changed']} of {result['scanned']} entries recategorized", 'success')
+    return redirect(url_for('main.show_spending'))
+
+@main.route('/api/spending', methods=['GET'])
+def spending_report():
+    # Monthly spend per category between ?start= and ?end= (ISO dates, end exclusive)
+    try:
+        start, end, _ = chart_args()
+    except ValueError as e:
+        return jsonify({'error': f"Invalid report arguments: {e}"}), 400
+    rows = spend_by_category(db_session, start and datetime.datetime.fromisoformat(start), end and datetime.datetime.fromisoformat(end))
+    return jsonify({'start': start, 'end': end, 'rows': rows})
+
+def search_args():
+    """Reads the q, kind (repeatable), page and per_page query arguments of a search request."""
+    return (request.args.get('q', ''), request.args.getlist('kind') or None,
+            request.args.get('page', 1, type=int), request.args.get('per_page', 20, type=int))
+
+@main.route('/search', methods=['GET'])
+def show_search():
+    query, kinds, page, per_page = search_args()
+    if not search_available(db_session.get_bind()):
+        return "Search needs an SQLite database", 501
+    results = search(db_session, query, kinds, page, per_page)
+    return render_template('search.html', query=query, kinds=kinds or list(SEARCH_TABLES), all_kinds=list(SEARCH_TABLES), **results)
+
+@main.route('/api/search', methods=['GET'])
+def search_api():
+    # Ranked full-text search, e.g. /api/search?q=swiggy&kind=balance&page=2
+    query, kinds, page, per_page = search_args()
+    if not search_available(db_session.get_bind()):
+        return jsonify({'error': "Search needs an SQLite database"}), 501
+    return jsonify(dict(search(db_session, query, kinds, page, per_page), query=query))
+
+@main.route('/api/import_runs', methods=['GET'])
+def show_import_runs():
+    # Recent imports with their stage timings, and the stages that took longest over the last `limit` runs
+    limit = request.args.get('limit', 50, type=int)
+    runs = ImportRun.query.order_by(ImportRun.started_at.desc()).limit(limit).all()
+    return jsonify({
+        'runs': [{
+            'run_id': run.run_id,
+            'name': run.name,
+            'files': json.loads(run.files or '[]'),
+            'mode': run.mode,
+            'started_at': run.started_at.isoformat() if run.started_at else None,
+            'duration_ms': run.duration_ms,
+            'status': run.status,
+            'error': run.error,
+            'rows': run.rows,
+            'spans': json.loads(run.spans or '[]'),
+        } for run in runs],
+        'slowest_stages': slowest_stages(db_session, limit),
+    })
+
+@main.route('/api/ingested_files', methods=['GET'])
+def show_ingested_files():
+    # Statements picked up by the watch-folder importer (watcher.py), newest first
+    limit = request.args.get('limit', 50, type=int)
+    files = IngestedFile.query.order_by(IngestedFile.started_at.desc()).limit(limit).all()
+    return jsonify({'files': [{
+        'path': file.path,
+        'sha256': file.sha256,
+        'kind': file.kind,
+        'status': file.status,
+        'error': file.error,
+        'rows': file.rows,
+        'started_at': file.started_at.isoformat() if file.started_at else None,
+        'finished_at': file.finished_at.isoformat() if file.finished_at else None,
+    } for file in files]})
+
+def archived_history(model, start):
+    """
+    Every row of model's table, archived or hot, when a chart starting at `start` (None for the whole
+    history) reaches back before the archive horizon; None when the hot rows cover it, or pyarrow
+    isn't installed to read the archive.
+    """
+    if not PARQUET_INSTALLED:
+        return None
+    horizon = archive_horizon(db_session, current_app.config['ARCHIVE_DIR'])
+    if horizon is None or (start and datetime.date.fromisoformat(start) >= horizon):
+        return None
+    return history(db_session, current_app.config['ARCHIVE_DIR'], model)
+
+@main.route('/api/charts/portfolio', methods=['GET'])
+def portfolio_chart():
+    # Total portfolio value (or one fund's, with ?fund=) at current NAVs, downsampled to ?points= between ?start= and ?end=
+    try:
+        start, end, points = chart_args()
+    except ValueError as e:
+        return jsonify({'error': f"Invalid chart arguments: {e}"}), 400
+    fund_name = request.args.get('fund')
+    today = datetime.date.today()
+    versions = data_versions(db_session, {Fund.__tablename__, MutualFundTransaction.__tablename__})
+
+    def build():
+        snapshot = analytics_snapshot()
+        transactions = snapshot.transactions
+        timestamps, funds, signed_units, navs = transactions['timestamp'], transactions['fund'], snapshot.signed_units(), snapshot.navs
+        rows = archived_history(MutualFundTransaction, start)
+        if rows is not None:
+            # Funds only found in the archive are valued at their stored NAV
+            fund_names = list(snapshot.fund_names)
+            positions = {name: i for i, name in enumerate(fund_names)}
+            for name in rows['fund_name'].unique().tolist():
+                if name not in positions:
+                    positions[name] = len(fund_names)
+                    fund_names.append(name)
+            stored = dict(db_session.query(Fund.fund_name, Fund.current_nav).filter(Fund.fund_name.in_(fund_names[len(snapshot.navs):])).all())
+            navs = np.r_[np.asarray(snapshot.navs, dtype=float), [stored.get(name) or 0.0 for name in fund_names[len(snapshot.navs):]]]
+            timestamps = rows['timestamp'].to_numpy(dtype='datetime64[s]')
+            funds = rows['fund_name'].map(positions).to_numpy()
+            signed_units = rows['units'].fillna(0).to_numpy() * rows['transaction_type'].str.lower().map(KIND_CODES).fillna(0).to_numpy()
+        days, portfolio_values, fund_values = holdings_history(timestamps, funds, signed_units, navs, today)
+        if not fund_name:
+            name, values = 'Total Portfolio Value', portfolio_values
+        else:
+            name = fund_name
+            values = fund_values.get(snapshot.fund_names.index(fund_name)) if fund_name in snapshot.fund_names else None
+        data, total_points = window(days, values, start, end, points) if values is not None else ([], 0)
+        return {'versions': versions, 'start': start, 'end': end, 'points': points,
+                'series': [{'name': name, 'total_points': total_points, 'data': data}]}
+
+    return cached_json_response(['portfolio', versions, today, fund_name, start, end, points], build)
+
+@main.route('/api/charts/balances', methods=['GET'])
+def balances_chart():
+    # Daily closing balance per bank, each series downsampled to ?points= between ?start= and ?end=
+    try:
+        start, end, points = chart_args()
+    except ValueError as e:
+        return jsonify({'error': f"Invalid chart arguments: {e}"}), 400
+    versions = data_versions(db_session, {AccountBalance.__tablename__})
+
+    def build():
+        snapshot = analytics_snapshot()
+        balances = snapshot.balances
+        banks = snapshot.banks
+        dates, bank_indexes, closing = balances['date'], balances['bank'], balances['closing_balance']
+        rows = archived_history(AccountBalance, start)
+        if rows is not None:
+            bank_names = [bank if isinstance(bank, str) else None for bank in rows['bank'].tolist()]
+            banks = list(dict.fromkeys(bank_names))
+            positions = {bank: i for i, bank in enumerate(banks)}
+            dates = rows['date'].to_numpy(dtype='datetime64[s]')
+            bank_indexes = np.array([positions[bank] for bank in bank_names], dtype=np.int64)
+            closing = rows['closing_balance'].to_numpy()
+        series = []
+        for bank, (days, closing_balances) in closing_balance_history(dates, bank_indexes, closing).items():
+            data, total_points = window(days, closing_balances, start, end, points)
+            series.append({'name': banks[bank], 'total_points': total_points, 'data': data})
+        series.sort(key=lambda item: str(item['name']))
+        return {'versions': versions, 'start': start, 'end': end, 'points': points, 'series': series}
+
+    return cached_json_response(['balances', versions, start, end, points], build)
+
+@main.route('/api/analytics/<report>', methods=['GET'])
+def analytics_report(report):
+    # One of the roll-up reports in analytics.REPORTS as {'report', 'rows'}
+    if report not in REPORTS:
+        return jsonify({'error': f"Unknown report: {report}", 'reports': list(REPORTS)}), 404
+    snapshot = analytics_snapshot()
+    return cached_json_response(['analytics', report, snapshot.versions],
+                                lambda: {'report': report, 'versions': snapshot.versions, 'rows': analytics.run([report], snapshot)[report]})
+
+@main.route('/api/reconciliation', methods=['GET'])
+def reconciliation_report():
+    # Breaks in the running balance, date gaps and duplicated rows of every account, over the whole history
+    try:
+        gap_days = int(request.args.get('gap_days', GAP_DAYS))
+    except ValueError:
+        return jsonify({'error': "gap_days must be a number of days"}), 400
+    snapshot = analytics_snapshot()
+    return cached_json_response(['reconciliation', snapshot.versions, gap_days],
+                                lambda: dict(audit_balances(snapshot, gap_days=gap_days), versions=snapshot.versions))
+
+@main.route('/api/metrics', methods=['GET'])
+def metrics_report():
+    # Rolling returns and risk metrics per fund and for the portfolio, as of ?as_of= (today by default)
+    try:
+        as_of = datetime.date.fromisoformat(request.args['as_of']) if request.args.get('as_of') else None
+    except ValueError:
+        return jsonify({'error': "as_of must be a date (YYYY-MM-DD)"}), 400
+    snapshot = analytics_snapshot()
+    report = holdings_metrics(snapshot, as_of)
+    names = dict(zip(snapshot.fund_codes, snapshot.fund_names))
+    report['funds'] = [dict(metrics or {}, fund_code=code, fund_name=names.get(code), available=metrics is not None)
+                       for code, metrics in report['funds'].items()]
+    return jsonify(report)
+
+def holdings_correlation():
+    # ?as_of= (today by default) and ?years= of daily returns; raises ValueError for bad arguments
+    as_of = datetime.date.fromisoformat(request.args['as_of']) if request.args.get('as_of') else None
+    years = float(request.args.get('years', RISK_YEARS))
+    if not 0 < years <= 30:
+        raise ValueError("years must be between 0 and 30")
+    snapshot = analytics_snapshot()
+    report = correlation_report(db_session, holding_values(snapshot), as_of, years)
+    names = dict(zip(snapshot.fund_codes, snapshot.fund_names))
+    return dict(report, names=[names.get(code, code) for code in report['funds']])
+
+@main.route('/correlation', methods=['GET'])
+def show_correlation():
+    # How much the funds held move together, as a heatmap of the correlation matrix
+    try:
+        report = holdings_correlation()
+    except ValueError as e:
+        # Without arguments the redirect would fail the same way again
+        if request.args:
+            flash(f"Invalid arguments: {e}", 'danger')
+            return redirect(url_for('main.show_correlation'))
+        return render_template('correlation.html', report=None, redundant_pairs=[], error=str(e))
+    names = dict(zip(report['funds'], report['names']))
+    redundant_pairs = [dict(pair, names=[names[code] for code in pair['funds']]) for pair in report.get('redundant_pairs', [])]
+    return render_template('correlation.html', report=report, redundant_pairs=redundant_pairs)
+
+@main.route('/api/correlation', methods=['GET'])
+def correlation_api():
+    # Correlation matrix of the daily returns of the funds held and diversification statistics
+    try:
+        return jsonify(holdings_correlation())
+    except ValueError as e:
+        return jsonify({'error': f"Invalid arguments: {e}"}), 400
+
+def portfolio_projection():
+    # ?target= (ten years from today by default), ?paths=, ?goal= and ?sip= to replace the inferred SIPs;
+    # raises ValueError for bad arguments
+    today = datetime.date.today()
+    target = datetime.date.fromisoformat(request.args['target']) if request.args.get('target') \
+        else add_months(np.datetime64(today, 'D'), 120).item() # 29 Feb becomes 28 Feb
+    paths = int(request.args.get('paths', DEFAULT_PATHS))
+    goal = float(request.args['goal']) if request.args.get('goal') else None
+    sip = float(request.args['sip']) if request.args.get('sip') else None
+    return goal_projection(db_session, analytics_snapshot(), target, paths, goal, sip, current_app.config['PROJECTION_WORKERS'])
+
+@main.route('/projection', methods=['GET'])
+def show_projection():
+    # Percentile bands of the projected portfolio value, with a form for the target date and goal
+    try:
+        report = portfolio_projection()
+    except ValueError as e:
+        # Without arguments the redirect would fail the same way again
+        if request.args:
+            flash(f"Invalid arguments: {e}", 'danger')
+            return redirect(url_for('main.show_projection'))
+        return render_template('projection.html', report=None, min_history_months=MIN_HISTORY_MONTHS, args=request.args, error=str(e))
+    return render_template('projection.html', report=report, min_history_months=MIN_HISTORY_MONTHS, args=request.args)
+
+@main.route('/api/projection', methods=['GET'])
+def projection_api():
+    # Monte Carlo projection of the portfolio value from the current holdings, SIPs and fixed deposits
+    try:
+        report = portfolio_projection()
+    except ValueError as e:
+        return jsonify({'error': f"Invalid arguments: {e}"}), 400
+    if report is None:
+        return jsonify({'error': f"Less than {MIN_HISTORY_MONTHS} months of NAV history for the funds held; refresh it first"}), 409
+    return jsonify(report)
+
+@main.route('/api/jobs', methods=['GET'])
+def show_jobs():
+    # The maintenance jobs with their schedules and last runs
+    return jsonify({'jobs': job_status(db_session)})
+
+@main.route('/api/jobs/<name>/run', methods=['POST'])
+def run_job(name):
+    # Makes a job due now; a worker's scheduler runs it on its next tick, outside this request
+    if name not in JOBS:
+        return jsonify({'error': f"Unknown job: {name}", 'jobs': list(JOBS)}), 404
+    updated = db_session.query(ScheduledJob).filter(ScheduledJob.name == name).update({'next_run_at': datetime.datetime.now()})
+    db_session.commit()
+    if not updated:
+        return jsonify({'error': f"Job {name} hasn't been scheduled yet; is the scheduler running?"}), 409
+    return jsonify({'job': name, 'queued': True}), 202
+
 
 if __name__ == '__main__':
+    app = create_app()
     # Create the upload folder if it doesn't exist
     if not os.path.exists(UPLOAD_FOLDER):
         os.makedirs(UPLOAD_FOLDER)
     with app.app_context():
         init_db() # Initialize the database within the app context
 
-app.run(debug=True)
+    app.run(debug=True)
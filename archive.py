@@ -0,0 +1,304 @@
+"""
+Hot/cold tiering of the balance and transaction history.
+
+Rows dated before a horizon are moved out of account_balances and mutual_fund_transactions into
+one Parquet file per table and year, with the table's columns:
+
+    <ARCHIVE_DIR>/<table>/<year>.parquet
+
+In their place each table keeps a carry-forward row (carried_forward = 1), dated just before the
+horizon, so everything computed from the hot table alone stays correct:
+  account_balances          per bank, the closing balance of its last archived row, with no
+                            deposit or withdrawal
+  mutual_fund_transactions  per fund still held, a Buy of the units held at the remaining average
+                            cost basis, so units, value and unrealized gains are unchanged. Gains
+                            realized before the horizon stay in the archive; XIRR reads the
+                            archived transactions in place of these rows.
+Archiving again with a later horizon folds the previous carry-forward rows into the new ones.
+
+The dashboards (the snapshot, the roll-up reports, the metrics) only ever read the hot tables,
+leaving the carry-forward rows out of cash flows. history() reads both tiers as one, for the
+views that show history from before the horizon; read_archive() reads the archived rows alone.
+
+The year files are renamed into place before the database commit and the manifest is written
+last. The horizon that counts is the one committed with the carry-forward rows, so a run that
+stops anywhere on the way neither loses rows nor counts them twice: archived rows are only read
+below that horizon and when no longer in the table, and rows a failed run left in the files are
+dropped by the next run. Temporary files left by a run are removed by the next.
+
+Parquet is read and written through pandas with pyarrow (pip install pyarrow; tested with
+pyarrow 26), which is only needed once rows are archived. pandas is imported on first use, so it
+isn't loaded at startup.
+
+Usage:
+    python archive.py --older-than-days 730     # archive rows dated before the month two years ago started
+    python archive.py --before 2023-04-01
+    python archive.py --status
+"""
+import argparse
+import datetime
+import glob
+import importlib.util
+import json
+import logging
+import os
+import sys
+from sqlalchemy import delete, func, insert, select
+from models import AccountBalance, MutualFundTransaction
+
+logger = logging.getLogger(__name__)
+
+PARQUET_INSTALLED = importlib.util.find_spec('pyarrow') is not None
+MANIFEST = 'manifest.json'
+# Archived table -> its date column
+DATE_COLUMNS = {AccountBalance.__tablename__: 'date', MutualFundTransaction.__tablename__: 'timestamp'}
+DELETE_BATCH = 500 # Ids per DELETE statement, under SQLite's bound parameter limit
+MIN_UNITS = 1e-6 # Funds with fewer units than this left at the horizon get no carry-forward row
+CARRY_FORWARD_NARRATION = 'Balance carried forward from the archive'
+
+def _carried_at(horizon):
+    # Dated just before the horizon, so they sort before every hot row and after every archived one
+    return datetime.datetime.combine(horizon, datetime.time()) - datetime.timedelta(seconds=1)
+
+def read_manifest(directory):
+    """The archive's manifest: the horizon of the last run and when it ran. Empty when nothing has been archived."""
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError, TypeError):
+        return {}
+
+def archive_horizon(db_session, directory):
+    """
+    Date before which rows have been archived, or None. The carry-forward rows are committed with
+    the deletion of the rows they stand in for, so they have the last word over the manifest, which
+    a run that stopped after its commit may not have written.
+    """
+    if not directory:
+        return None
+    manifest = read_manifest(directory).get('horizon')
+    horizons = [datetime.date.fromisoformat(manifest)] if manifest else []
+    for model in CARRY_FORWARD:
+        column = model.__table__.c[DATE_COLUMNS[model.__tablename__]]
+        carried_at = db_session.query(func.max(column)).filter(model.__table__.c.carried_forward == 1).scalar()
+        if carried_at:
+            horizons.append((carried_at + datetime.timedelta(seconds=1)).date())
+    return max(horizons) if horizons else None
+
+def _year_path(directory, table_name, year):
+    return os.path.join(directory, table_name, f"{year}.parquet")
+
+def _year_files(directory, table_name):
+    """{year: path} of the table's Parquet files."""
+    paths = glob.glob(os.path.join(directory, table_name, '*.parquet'))
+    return {int(os.path.basename(path).split('.')[0]): path for path in sorted(paths)}
+
+def _frame(rows, table):
+    import pandas as pd
+    frame = pd.DataFrame(rows, columns=table.columns.keys())
+    for column in table.columns:
+        if column.type.python_type is datetime.datetime:
+            frame[column.name] = pd.to_datetime(frame[column.name])
+    return frame
+
+def _balance_carry_forward(rows, carried_at):
+    import pandas as pd
+    # Per bank, the last row by date and id (the previous carry-forward row included)
+    last = rows.sort_values(['date', 'id'], kind='stable').groupby('bank', dropna=False, sort=True).tail(1)
+    return [{'bank': None if pd.isna(row.bank) else row.bank, 'date': carried_at, 'narration': CARRY_FORWARD_NARRATION,
+             'chq_ref_no': None, 'withdrawal_amt': 0.0, 'deposit_amt': 0.0, 'closing_balance': float(row.closing_balance),
+             'category': None, 'carried_forward': 1}
+            for row in last.itertuples()]
+
+def _transaction_carry_forward(rows, carried_at):
+    # Replays each fund's rows in (timestamp, id) order with the average cost basis, as the performance page does
+    holdings = {}
+    rows = rows.fillna({'amount': 0.0, 'units': 0.0})
+    for row in rows.sort_values(['timestamp', 'id'], kind='stable').itertuples():
+        units, cost = holdings.get(row.fund_name, (0.0, 0.0))
+        kind = str(row.transaction_type).lower()
+        if kind == 'buy':
+            units, cost = units + row.units, cost + row.amount
+        elif kind == 'sell':
+            average_cost = cost / units if units > 0 else 0.0
+            units, cost = units - row.units, cost - average_cost * row.units
+        holdings[row.fund_name] = (units, cost)
+    return [{'fund_name': fund_name, 'transaction_type': 'Buy', 'amount': cost, 'units': units, 'nav': cost / units,
+             'timestamp': carried_at, 'carried_forward': 1}
+            for fund_name, (units, cost) in sorted(holdings.items()) if units >= MIN_UNITS]
+
+CARRY_FORWARD = {AccountBalance: _balance_carry_forward, MutualFundTransaction: _transaction_carry_forward}
+
+def _remove_temporary_files(directory):
+    # Left behind by a run that stopped before renaming them; the rows in them are still in the database
+    for path in glob.glob(os.path.join(directory, '**', '*.tmp'), recursive=True):
+        os.remove(path)
+
+def _keys(frame, date_column):
+    import pandas as pd
+    return pd.MultiIndex.from_frame(frame[['id', date_column]].astype({'id': 'int64', date_column: 'datetime64[us]'}))
+
+def _hot_keys(db_session, table, before=None):
+    # (id, date) of the table's rows other than carry-forward ones, to tell them from archived rows
+    import pandas as pd
+    date_column = DATE_COLUMNS[table.name]
+    query = select(table.c.id, table.c[date_column]).where(table.c.carried_forward.is_(None))
+    if before:
+        query = query.where(table.c[date_column] < before)
+    return _keys(pd.DataFrame(db_session.execute(query).all(), columns=['id', date_column]), date_column)
+
+def _write_year(path, frame, date_column):
+    # Renamed into place so a reader never sees a partial file
+    if not len(frame):
+        os.remove(path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    frame.sort_values([date_column, 'id'], kind='stable').to_parquet(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+def archive(db_session, directory, horizon):
+    """
+    Moves the balance and transaction rows dated before `horizon` (a date) to the Parquet archive
+    in `directory`, leaving carry-forward rows in their place, in one database transaction.
+    Returns {'horizon', table name: {'rows', 'carried_forward', 'years'}}.
+    """
+    if not PARQUET_INSTALLED:
+        raise RuntimeError("Archiving to Parquet needs the pyarrow package")
+    import pandas as pd
+    os.makedirs(directory, exist_ok=True)
+    _remove_temporary_files(directory)
+    previous = archive_horizon(db_session, directory)
+    if previous and horizon <= previous:
+        return {'horizon': previous.isoformat(), 'unchanged': True}
+    cutoff = datetime.datetime.combine(horizon, datetime.time())
+    carried_at = _carried_at(horizon)
+    summary = {'horizon': horizon.isoformat()}
+    try:
+        for model, carry_forward in CARRY_FORWARD.items():
+            table = model.__table__
+            date_column = DATE_COLUMNS[table.name]
+            rows = _frame(db_session.execute(select(table).where(table.c[date_column] < cutoff)).all(), table)
+            archived = rows[rows['carried_forward'].isna()]
+            years = sorted(archived[date_column].dt.year.unique().tolist())
+            # Rows a failed run wrote to the files are still in the table: they are archived again or stay hot
+            hot = _hot_keys(db_session, table)
+            for year, path in _year_files(directory, table.name).items():
+                stale = _keys(pd.read_parquet(path, columns=['id', date_column]), date_column).isin(hot)
+                if stale.any() or year in years:
+                    frame = pd.concat([pd.read_parquet(path)[~stale], archived[archived[date_column].dt.year == year]], ignore_index=True)
+                    _write_year(path, frame, date_column)
+            for year in years:
+                path = _year_path(directory, table.name, year)
+                if not os.path.exists(path):
+                    _write_year(path, archived[archived[date_column].dt.year == year], date_column)
+
+            ids = rows['id'].tolist()
+            for start in range(0, len(ids), DELETE_BATCH):
+                db_session.execute(delete(table).where(table.c.id.in_(ids[start:start + DELETE_BATCH])))
+            carried = carry_forward(rows, carried_at) if len(rows) else []
+            if carried:
+                db_session.execute(insert(table), carried)
+            summary[table.name] = {'rows': len(archived), 'carried_forward': len(carried), 'years': years}
+        db_session.commit()
+    except Exception:
+        db_session.rollback()
+        raise
+
+    path = os.path.join(directory, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'horizon': horizon.isoformat(), 'archived_at': datetime.datetime.now().isoformat(timespec='seconds')}, f, indent=1)
+    os.replace(path + '.tmp', path)
+    logger.info(f"Archived rows before {horizon}: {summary}")
+    return summary
+
+def horizon_for(days, today=None):
+    """The horizon `days` ago, moved back to the start of its month so a daily run rewrites a year's file once a month."""
+    horizon = (today or datetime.date.today()) - datetime.timedelta(days=days)
+    return horizon.replace(day=1)
+
+def _bounds(start, end):
+    return (datetime.datetime.combine(start, datetime.time()) if start else None,
+            datetime.datetime.combine(end, datetime.time()) if end else None)
+
+def read_archive(db_session, directory, model, start=None, end=None):
+    """
+    The archived rows of model's table dated from start up to (not including) end, as a DataFrame of
+    the table's columns sorted by date and id. Only rows below the committed horizon, and not still
+    in the table, are read.
+    """
+    import pandas as pd
+    table = model.__table__
+    date_column = DATE_COLUMNS[table.name]
+    horizon = archive_horizon(db_session, directory)
+    start, end = _bounds(start, end)
+    cutoff = datetime.datetime.combine(horizon, datetime.time()) if horizon else None
+    end = min(end, cutoff) if end and cutoff else (end or cutoff)
+    frames = []
+    if horizon and (start is None or start < end):
+        for year, path in _year_files(directory, table.name).items():
+            if (start and year < start.year) or year > end.year:
+                continue
+            filters = ([(date_column, '>=', start)] if start else []) + [(date_column, '<', end)]
+            frames.append(pd.read_parquet(path, filters=filters))
+    frame = pd.concat(frames, ignore_index=True) if frames else _frame([], table)
+    # Rows imported late, dated before the horizon, may also be in the files if a later run failed
+    frame = frame[~_keys(frame, date_column).isin(_hot_keys(db_session, table, end))]
+    return frame.sort_values([date_column, 'id'], kind='stable', ignore_index=True)
+
+def history(db_session, directory, model, start=None, end=None):
+    """
+    Rows of model's table dated from start up to (not including) end, archived or hot, as one
+    DataFrame of the table's columns sorted by date and id. Carry-forward rows are left out: the
+    archived rows they summarise are read instead.
+    """
+    import pandas as pd
+    table = model.__table__
+    date_column = DATE_COLUMNS[table.name]
+    query = select(table).where(table.c.carried_forward.is_(None))
+    start_at, end_at = _bounds(start, end)
+    if start_at:
+        query = query.where(table.c[date_column] >= start_at)
+    if end_at:
+        query = query.where(table.c[date_column] < end_at)
+    frames = [read_archive(db_session, directory, model, start, end), _frame(db_session.execute(query).all(), table)]
+    frame = pd.concat([frame for frame in frames if len(frame)] or frames[-1:], ignore_index=True)
+    return frame.sort_values([date_column, 'id'], kind='stable', ignore_index=True)
+
+def archive_status(db_session, directory):
+    """The horizon, with the Parquet files on disk and the hot rows left per table."""
+    horizon = archive_horizon(db_session, directory)
+    status = {'horizon': horizon.isoformat() if horizon else None, 'archived_at': read_manifest(directory).get('archived_at'), 'tables': {}}
+    for model in CARRY_FORWARD:
+        files = _year_files(directory, model.__tablename__)
+        status['tables'][model.__tablename__] = {'years': list(files), 'bytes': sum(os.path.getsize(path) for path in files.values()),
+                                                 'archived_rows': len(read_archive(db_session, directory, model)) if PARQUET_INSTALLED else None,
+                                                 'hot_rows': db_session.query(func.count(model.id)).scalar()}
+    return status
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Archive old balance and transaction rows to Parquet.')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--older-than-days', type=int, help='archive rows older than this, from the start of that month')
+    group.add_argument('--before', type=datetime.date.fromisoformat, help='archive rows dated before this date (YYYY-MM-DD)')
+    group.add_argument('--status', action='store_true', help='show what has been archived')
+    args = parser.parse_args(argv)
+
+    from app import create_app, db_session, init_db
+    app = create_app()
+    directory = app.config['ARCHIVE_DIR']
+    with app.app_context():
+        init_db()
+        if args.status:
+            print(json.dumps(archive_status(db_session, directory), indent=1))
+            return 0
+        horizon = args.before or horizon_for(args.older_than_days)
+        try:
+            summary = archive(db_session, directory, horizon)
+        except RuntimeError as e:
+            print(e, file=sys.stderr)
+            return 1
+    print(json.dumps(summary, indent=1))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,304 @@
+"""
+Batch import of many statements at once, for back-filling years of history.
+
+    python batchimport.py --mutual-funds mf_2019.xlsx mf_2020.xlsx cams_*.pdf --balances hdfc_*.xlsx icici_*.pdf
+    python batchimport.py --balances icici_*.pdf --workers 4 --pages-per-task 10 --password secret
+
+Files are read in a process pool: each workbook is one task, and each PDF is split into ranges of
+--pages-per-task pages that tabula extracts in parallel. The rows are then merged per account (the
+bank, the CAMS fund, or the mutual fund workbook's sheet), each account's statements in date order,
+and de-duplicated against the watermarks as importing the files one at a time through
+process_excel_data would: overlapping statements don't import a row twice. Each account's new rows
+are written with one bulk INSERT, committed together with its watermark.
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import pandas as pd
+from sqlalchemy import func, insert
+from models import AccountBalance, MutualFundTransaction
+from fileparse import (MUTUAL_FUNDS_SHEET, MF_XLSX_FINGERPRINT_COLUMNS, BALANCE_XLSX_FINGERPRINT_COLUMNS, ICICI_PDF_FINGERPRINT_COLUMNS,
+                       CAMS_PDF_FINGERPRINT_COLUMNS, process_pdf, load_fund_codes, sync_funds, skip_unsynced_funds, fingerprint_row, load_watermarks,
+                       update_watermark, new_rows_after_watermark, mf_xlsx_transaction, cams_frame, cams_transaction,
+                       balance_xlsx_entry, icici_frame, icici_entry)
+from categorizer import load_categorizer
+from reconcile import check_new_balances, describe
+from tracing import span, start_trace, save_import_run
+
+PAGES_PER_TASK = 20
+
+# How each source format is read: its date column, the columns of its row fingerprint and the
+# column naming the account its watermark belongs to (None for one account per format)
+SOURCE_FORMATS = {
+    'mf_xlsx': {'kind': 'mutual_funds', 'date': 'Trade Date', 'fingerprint': MF_XLSX_FINGERPRINT_COLUMNS, 'account': None},
+    'cams_pdf': {'kind': 'mutual_funds', 'date': 'Date', 'fingerprint': CAMS_PDF_FINGERPRINT_COLUMNS, 'account': 'Description'},
+    'balance_xlsx': {'kind': 'balances', 'date': 'Date', 'fingerprint': BALANCE_XLSX_FINGERPRINT_COLUMNS, 'account': 'Bank'},
+    'icici_pdf': {'kind': 'balances', 'date': 'Date', 'fingerprint': ICICI_PDF_FINGERPRINT_COLUMNS, 'account': None},
+}
+SINGLE_ACCOUNTS = {'mf_xlsx': MUTUAL_FUNDS_SHEET, 'icici_pdf': 'ICICI'}
+
+def source_format(path, kind):
+    extension = path.rsplit('.', 1)[-1].lower()
+    formats = {('mutual_funds', 'xlsx'): 'mf_xlsx', ('mutual_funds', 'pdf'): 'cams_pdf',
+               ('balances', 'xlsx'): 'balance_xlsx', ('balances', 'pdf'): 'icici_pdf'}
+    if (kind, extension) not in formats:
+        raise ValueError(f"Unsupported statement: {path}")
+    return formats[(kind, extension)]
+
+def page_ranges(pages, pages_per_task):
+    """Splits pages 1..pages into tabula page specs of at most pages_per_task pages, e.g. ['1-20', '21-35']."""
+    return [f"{first}-{min(first + pages_per_task - 1, pages)}" for first in range(1, pages + 1, pages_per_task)]
+
+def extract(task):
+    """
+    Reads one task's tables; runs in a worker process. A task is (source format, path, pages):
+    pages is None for a workbook, a tabula page spec for a PDF, or 'header' for the column names
+    on the first page of an ICICI statement.
+    """
+    source, path, pages = task
+    if source == 'mf_xlsx':
+        return [pd.ExcelFile(path, engine='openpyxl').parse(MUTUAL_FUNDS_SHEET, skiprows=3)]
+    if source == 'balance_xlsx':
+        return [pd.read_excel(path, engine='openpyxl')]
+    import tabula
+    if pages == 'header':
+        return list(tabula.read_pdf(path, pages=[1], pandas_options={'header': 0})[0].columns)
+    return tabula.read_pdf(path, pages=pages, pandas_options={'header': None})
+
+def statement_frame(source, tables, header=None):
+    """Turns the tables read from one statement, in page order, into a frame sorted by date."""
+    if source == 'cams_pdf':
+        return cams_frame(tables)
+    if source == 'icici_pdf':
+        return icici_frame(tables, header)
+    df = pd.concat(tables, ignore_index=True)
+    date_column = SOURCE_FORMATS[source]['date']
+    df[date_column] = pd.to_datetime(df[date_column])
+    return df.sort_values(date_column, kind='stable')
+
+def _fallback(db_session, source, account):
+    """What process_excel_data resumes from when an account has no watermark: (latest date stored, closing balance)."""
+    if source == 'mf_xlsx':
+        return db_session.query(func.max(MutualFundTransaction.timestamp)).scalar(), None
+    if source == 'balance_xlsx':
+        return db_session.query(func.max(AccountBalance.date)).filter(AccountBalance.bank == account).scalar(), None
+    if source == 'icici_pdf':
+        latest = db_session.query(AccountBalance).filter(AccountBalance.bank == 'ICICI').order_by(AccountBalance.date.desc()).first()
+        return (latest.date, latest.closing_balance) if latest else (None, 0)
+    return None, None
+
+def merge_account(frames, date_column, fingerprint_columns, watermark, latest_date):
+    """
+    Returns the rows of one account's statements not imported yet, in date order. The statements
+    are taken in order of their first date, each cut after a running watermark, so overlapping
+    statements contribute each row once.
+    """
+    frames = sorted(frames, key=lambda frame: frame[date_column].iloc[0])
+    tails = []
+    for frame in frames:
+        tail = new_rows_after_watermark(frame, date_column, watermark, fingerprint_columns, latest_date)
+        if tail.empty:
+            continue
+        tails.append(tail)
+        last_row = tail.iloc[-1]
+        watermark = SimpleNamespace(last_date=last_row[date_column], row_fingerprint=fingerprint_row(last_row, fingerprint_columns))
+        latest_date = None
+    return pd.concat(tails, ignore_index=True) if tails else None
+
+def batch_import(db_session, mutual_funds_files=(), balance_files=(), password=None, workers=None, pages_per_task=PAGES_PER_TASK):
+    """
+    Imports many statements: extracted in parallel, merged per account and written in one bulk
+    transaction per account. Returns a summary with rows read and inserted, rows per account,
+    issues (statements that lost rows between extraction and reading, transactions of funds that
+    could not be added, and reconciliation issues in the new balances), errors, seconds per phase and rows per second.
+    workers=1 reads the files in this process.
+    """
+    files = [(path, source_format(path, 'mutual_funds')) for path in mutual_funds_files] + \
+            [(path, source_format(path, 'balances')) for path in balance_files]
+    summary = {'files': len(files), 'tasks': 0, 'workers': workers or os.cpu_count(), 'rows_read': 0, 'rows_inserted': 0,
+               'accounts': {}, 'issues': [], 'errors': [], 'seconds': {}}
+    started = time.perf_counter()
+    temp_files = []
+    with start_trace('batch_import', files=[os.path.basename(path) for path, source in files], mode='commit') as trace:
+        try:
+            # Decrypt PDFs here, so the workers only ever read plain copies
+            readable = {}
+            with span('decrypt') as record:
+                for path, source in files:
+                    if source.endswith('_pdf'):
+                        temp_path = process_pdf(path, password)
+                        if temp_path is None:
+                            summary['errors'].append(f"Could not open {path}")
+                            continue
+                        temp_files.append(temp_path)
+                        readable[path] = temp_path
+                    else:
+                        readable[path] = path
+                record['rows'] = len(temp_files)
+
+            tasks = []
+            for path, source in files:
+                if path not in readable:
+                    continue
+                if source.endswith('_pdf'):
+                    import PyPDF2
+                    pages = len(PyPDF2.PdfReader(readable[path]).pages)
+                    tasks += [(path, (source, readable[path], pages)) for pages in page_ranges(pages, pages_per_task)]
+                    if source == 'icici_pdf':
+                        tasks.append((path, (source, readable[path], 'header')))
+                else:
+                    tasks.append((path, (source, readable[path], None)))
+            summary['tasks'] = len(tasks)
+
+            phase = time.perf_counter()
+            with span('extract') as record:
+                if summary['workers'] == 1:
+                    results = [extract(task) for path, task in tasks]
+                else:
+                    with concurrent.futures.ProcessPoolExecutor(max_workers=summary['workers']) as executor:
+                        results = list(executor.map(extract, [task for path, task in tasks]))
+                record['rows'] = sum(len(table) for (path, task), tables in zip(tasks, results) if task[2] != 'header' for table in tables)
+            summary['seconds']['extract'] = time.perf_counter() - phase
+
+            phase = time.perf_counter()
+            with span('parse') as record:
+                # Tasks were queued in page order, so each statement's tables come back in page order
+                tables, headers = {}, {}
+                for (path, task), result in zip(tasks, results):
+                    if task[2] == 'header':
+                        headers[path] = result
+                    else:
+                        tables.setdefault(path, []).extend(result)
+                accounts = {} # (source format, account) -> [frame of each statement]
+                for path, source in files:
+                    if path not in tables:
+                        continue
+                    try:
+                        frame = statement_frame(source, tables[path], headers.get(path))
+                    except Exception as e:
+                        summary['errors'].append(f"Could not read {path}: {e}")
+                        continue
+                    summary['rows_read'] += len(frame)
+                    # Only a header row per table is expected to drop out; more means rows were lost on the way
+                    extracted = sum(len(table) for table in tables[path])
+                    if extracted - len(frame) > len(tables[path]):
+                        summary['issues'].append(f"{path}: {extracted - len(frame)} of the {extracted} rows extracted were not read")
+                    account_column = SOURCE_FORMATS[source]['account']
+                    groups = frame.groupby(account_column, sort=False) if account_column else [(SINGLE_ACCOUNTS[source], frame)]
+                    for account, group in groups:
+                        if not group.empty:
+                            accounts.setdefault((source, account), []).append(group)
+
+                merged = {}
+                for (source, account), frames in accounts.items():
+                    settings = SOURCE_FORMATS[source]
+                    watermark = load_watermarks(db_session, source).get(account)
+                    latest_date, closing_balance = _fallback(db_session, source, account) if watermark is None else (None, watermark.closing_balance)
+                    if settings['account'] == 'Description':
+                        latest_date = None # CAMS statements resume from their watermarks only
+                    rows = merge_account(frames, settings['date'], settings['fingerprint'], watermark, latest_date)
+                    if rows is not None:
+                        merged[(source, account)] = (rows, watermark, closing_balance)
+                record['rows'] = sum(len(rows) for rows, watermark, closing_balance in merged.values())
+            summary['seconds']['merge'] = time.perf_counter() - phase
+
+            phase = time.perf_counter()
+            fund_names = [name for (source, account), (rows, watermark, closing_balance) in merged.items()
+                          if SOURCE_FORMATS[source]['kind'] == 'mutual_funds'
+                          for name in rows['Investment name' if source == 'mf_xlsx' else 'Description'].unique()]
+            funds = {}
+            if fund_names:
+                funds = sync_funds(db_session, fund_names, load_fund_codes())
+                with span('commit', table='funds'):
+                    db_session.commit()
+            categorizer = load_categorizer(db_session)
+            for (source, account), (rows, watermark, closing_balance) in merged.items():
+                settings = SOURCE_FORMATS[source]
+                if settings['kind'] == 'mutual_funds':
+                    fund_rows, skipped = skip_unsynced_funds(rows, 'Investment name' if source == 'mf_xlsx' else 'Description', funds)
+                    summary['issues'] += [f"{fund_name}: {count} transactions were not imported, the fund could not be added"
+                                          for fund_name, count in skipped.items()]
+                    if fund_rows.empty:
+                        continue # Nothing to write; the watermark stays put so the rows are imported once the fund can be added
+                try:
+                    with span('insert', account=str(account)) as record:
+                        if source == 'mf_xlsx':
+                            model, entries = MutualFundTransaction, [mf_xlsx_transaction(row) for row in fund_rows.to_dict('records')]
+                        elif source == 'cams_pdf':
+                            model, entries = MutualFundTransaction, [cams_transaction(row) for row in fund_rows.to_dict('records')]
+                        elif source == 'balance_xlsx':
+                            categories = categorizer.classify_many(rows['Narration'].tolist())
+                            model, entries = AccountBalance, [balance_xlsx_entry(row, category) for row, category in zip(rows.to_dict('records'), categories)]
+                        else:
+                            rows['Balance'] = (closing_balance or 0) + rows['Amount'].where(rows['Type'] != 'DR', -rows['Amount']).cumsum()
+                            rows['Category'] = categorizer.classify_many(rows['Description'].tolist())
+                            model, entries = AccountBalance, [icici_entry(row) for row in rows.to_dict('records')]
+                        entries = [entry for entry in entries if entry]
+                        if model is AccountBalance:
+                            report = check_new_balances(db_session, [AccountBalance(**entry) for entry in entries])
+                            summary['issues'] += describe(report)
+                        if entries:
+                            db_session.execute(insert(model), entries)
+                        record['rows'] = len(entries)
+                    last_row = rows.iloc[-1]
+                    closing = last_row['Closing Balance'] if source == 'balance_xlsx' else last_row['Balance'] if source == 'icici_pdf' else None
+                    update_watermark(db_session, source, account, last_row, settings['date'], settings['fingerprint'],
+                                     closing_balance=closing, watermark=watermark)
+                    with span('commit', table=model.__tablename__):
+                        db_session.commit()
+                    summary['accounts'][f"{source}:{account}"] = len(entries)
+                    summary['rows_inserted'] += len(entries)
+                except Exception as e:
+                    db_session.rollback()
+                    summary['errors'].append(f"Could not import {account} ({source}): {e}")
+            summary['seconds']['write'] = time.perf_counter() - phase
+        finally:
+            for temp_path in temp_files:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        trace.finish('; '.join(summary['errors']) or None, rows=summary['rows_inserted'])
+    save_import_run(db_session.get_bind(), trace)
+    summary['seconds']['total'] = time.perf_counter() - started
+    summary['rows_per_sec'] = summary['rows_read'] / summary['seconds']['total'] if summary['seconds']['total'] else 0.0
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mutual-funds', nargs='*', default=[], metavar='FILE', help='mutual fund workbooks and CAMS PDFs')
+    parser.add_argument('--balances', nargs='*', default=[], metavar='FILE', help='account balance workbooks and ICICI PDFs')
+    parser.add_argument('--workers', type=int, default=None, help='processes reading the files (default: one per core)')
+    parser.add_argument('--pages-per-task', type=int, default=PAGES_PER_TASK)
+    parser.add_argument('--password', default=os.environ.get('STATEMENT_PASSWORD'), help='password of encrypted PDF statements')
+    parser.add_argument('--json', action='store_true', help='print the summary as JSON')
+    args = parser.parse_args(argv)
+    if not args.mutual_funds and not args.balances:
+        parser.error("no files given")
+
+    from app import create_app, db_session, init_db
+    app = create_app()
+    with app.app_context():
+        init_db()
+        summary = batch_import(db_session, args.mutual_funds, args.balances, args.password, args.workers, args.pages_per_task)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"{summary['files']} files in {summary['tasks']} tasks on {summary['workers']} workers: "
+              f"{summary['rows_read']} rows read, {summary['rows_inserted']} inserted in {summary['seconds']['total']:.1f} s "
+              f"({summary['rows_per_sec']:,.0f} rows/s)")
+        for phase, seconds in summary['seconds'].items():
+            print(f"  {phase}: {seconds:.2f} s")
+        for account, rows in summary['accounts'].items():
+            print(f"  {account}: {rows} rows")
+        for issue in summary['issues']:
+            print(f"  check: {issue}")
+        for error in summary['errors']:
+            print(f"  error: {error}")
+    return 1 if summary['errors'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
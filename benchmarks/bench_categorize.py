@@ -0,0 +1,125 @@
+"""
+Narration categorizer benchmarks.
+
+Generates bank narrations and a rule set of --rules keyword, UPI and merchant rules, then times
+classifying the narrations with the compiled automaton (categorizer.Categorizer.classify_many)
+against the straightforward approach of trying one regex per rule on every row, and checks both
+agree. Reports rows per second for each and writes the results as JSON.
+
+    python -m benchmarks.bench_categorize --rows 100000 --rules 200 --output bench_categorize.json
+    python -m benchmarks.bench_categorize --baseline bench_categorize.json --max-ratio 1.25
+"""
+import argparse
+import json
+import platform
+import random
+import re
+import sys
+import time
+
+from categorizer import Categorizer, normalize
+from models import CategoryRule
+
+CATEGORIES = ['Food', 'Shopping', 'Travel', 'Utilities', 'Rent', 'Salary', 'Investments', 'Health']
+
+def generate_rules(count, rng):
+    rules = []
+    for i in range(count):
+        merchant = f"MERCHANT{i:04d}"
+        kind = rng.choice(['keyword', 'keyword', 'upi', 'merchant'])
+        pattern = {'keyword': merchant, 'upi': f"{merchant.lower()}@ybl", 'merchant': f"{merchant}*PAY"}[kind]
+        rule = CategoryRule(category=rng.choice(CATEGORIES), pattern=pattern, kind=kind, priority=rng.randint(0, 3))
+        rule.id = i + 1
+        rules.append(rule)
+    return rules
+
+def generate_narrations(count, rules, rng):
+    narrations = []
+    for _ in range(count):
+        merchant = f"MERCHANT{rng.randrange(len(rules) * 2):04d}" # about half match no rule
+        narrations.append(rng.choice([
+            f"UPI/{rng.randint(10**11, 10**12 - 1)}/{merchant.lower()}@ybl/PAYMENT",
+            f"POS {rng.randint(10**5, 10**6 - 1)} {merchant} PAY INDIA",
+            f"NEFT CR-{rng.randint(10**9, 10**10 - 1)}-{merchant}",
+        ]))
+    return narrations
+
+def classify_with_regexes(rules, narrations):
+    """One regex per rule tried in priority order on every narration."""
+    compiled = []
+    for rule in sorted(rules, key=lambda rule: (-rule.priority, -len(normalize(rule.pattern)), rule.id)):
+        pattern = normalize(rule.pattern)
+        pieces = [piece for piece in pattern.split('*') if piece] if rule.kind == 'merchant' else [pattern]
+        compiled.append((re.compile('.*'.join(re.escape(piece) for piece in pieces)), rule.category))
+    categories = []
+    for narration in narrations:
+        text = normalize(narration)
+        categories.append(next((category for regex, category in compiled if regex.search(text)), None))
+    return categories
+
+def time_call(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+def run(rows, rule_count, repeat, seed):
+    rng = random.Random(seed)
+    rules = generate_rules(rule_count, rng)
+    narrations = generate_narrations(rows, rules, rng)
+    compile_seconds, categorizer = time_call(lambda: Categorizer(rules), repeat)
+    automaton_seconds, automaton_categories = time_call(lambda: categorizer.classify_many(narrations), repeat)
+    regex_seconds, regex_categories = time_call(lambda: classify_with_regexes(rules, narrations), repeat)
+    if automaton_categories != regex_categories:
+        raise RuntimeError("The automaton and the per-rule regexes disagree")
+    results = {
+        'rows': rows,
+        'rules': rule_count,
+        'matched': sum(category is not None for category in automaton_categories),
+        'compile_ms': compile_seconds * 1000,
+        'automaton_rows_per_sec': rows / automaton_seconds,
+        'regex_rows_per_sec': rows / regex_seconds,
+        'repeat': repeat,
+    }
+    print(f"{rows} narrations, {rule_count} rules, {results['matched']} matched")
+    print(f"  compile: {results['compile_ms']:.1f} ms")
+    print(f"  automaton: {results['automaton_rows_per_sec']:,.0f} rows/s")
+    print(f"  per-rule regex: {results['regex_rows_per_sec']:,.0f} rows/s")
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--rules', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_categorize.json')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    parser.add_argument('--max-ratio', type=float, default=1.25, help='allowed slowdown against the baseline')
+    args = parser.parse_args(argv)
+
+    results = run(args.rows, args.rules, args.repeat, args.seed)
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            previous = json.load(f).get('results', {})
+        if previous and results['automaton_rows_per_sec'] * args.max_ratio < previous['automaton_rows_per_sec']:
+            print(f"Regression: {previous['automaton_rows_per_sec']:,.0f} rows/s -> {results['automaton_rows_per_sec']:,.0f} rows/s")
+            return 1
+        print("No regressions.")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+Import pipeline benchmarks.
+
+Generates a statement corpus (see benchmarks/statements.py) at several sizes, imports every file
+into a fresh SQLite database through process_excel_data with mfapi.in served from local fixtures,
+and reports the time spent in each stage:
+
+    decrypt     process_pdf
+    extract     reading the workbook / tabula.read_pdf
+    match       building the scheme mapping and resolving fund codes
+    nav_fetch   fetching current NAVs
+    insert      flushing and committing rows
+    normalize   everything else (date parsing, filtering, building rows)
+
+    python -m benchmarks.bench_import --sizes 1,10,100 --output bench_import.json
+    python -m benchmarks.bench_import --baseline bench_import.json --max-ratio 1.25
+"""
+import argparse
+import collections
+import contextlib
+import functools
+import io
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from unittest import mock
+
+import pandas as pd
+import tabula
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+
+import fileparse
+from models import Base
+from benchmarks.statements import BASE_SIZES, PDF_PASSWORD, write_corpus
+from benchmarks.synthetic import stub_network
+
+STAGES = ['decrypt', 'extract', 'match', 'nav_fetch', 'insert', 'normalize']
+# Case -> the BASE_SIZES entry for the rows in its statement, all of which an import should read
+CASE_ROWS = {'mutual_funds_xlsx': 'mutual_fund_rows', 'balances_xlsx': 'balance_rows', 'icici_pdf': 'icici_rows',
+             'icici_pdf_encrypted': 'icici_rows', 'cams_pdf': 'cams_rows'}
+
+class StageTimer:
+    """Accumulates wall time per stage by wrapping the functions the import pipeline calls."""
+
+    def __init__(self):
+        self.seconds = collections.defaultdict(float)
+        self.active = False
+
+    def wrap(self, stage, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            # Only the outermost wrapped call is counted (pd.read_excel calls ExcelFile.parse, for one)
+            if self.active:
+                return func(*args, **kwargs)
+            self.active = True
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.seconds[stage] += time.perf_counter() - start
+                self.active = False
+        return timed
+
+    @contextlib.contextmanager
+    def patched(self):
+        targets = [
+            (fileparse, 'process_pdf', 'decrypt'),
+            (tabula, 'read_pdf', 'extract'),
+            (pd, 'read_excel', 'extract'),
+            (pd.ExcelFile, '__init__', 'extract'),
+            (pd.ExcelFile, 'parse', 'extract'),
+            (fileparse, 'load_fund_codes', 'match'),
+            (fileparse, 'resolve_fund_code', 'match'),
+            (fileparse, 'fetch_current_nav', 'nav_fetch'),
+            (Session, 'commit', 'insert'),
+        ]
+        with contextlib.ExitStack() as stack:
+            for owner, name, stage in targets:
+                stack.enter_context(mock.patch.object(owner, name, self.wrap(stage, getattr(owner, name))))
+            yield
+
+def import_cases(paths):
+    """Returns (name, mutual_funds_filepath, account_balances_filepath, password) for each file in a corpus size."""
+    return [
+        ('mutual_funds_xlsx', paths['mutual_funds_xlsx'], '', None),
+        ('balances_xlsx', '', paths['balances_xlsx'], None),
+        ('icici_pdf', '', paths['icici_pdf'], None),
+        ('icici_pdf_encrypted', '', paths['icici_pdf_encrypted'], PDF_PASSWORD),
+        ('cams_pdf', paths['cams_pdf'], '', None),
+    ]
+
+def run_case(mutual_funds_filepath, account_balances_filepath, password, fixtures_dir):
+    """Imports one statement into an empty database and returns its stage timings."""
+    with tempfile.TemporaryDirectory() as work_dir:
+        cwd = os.getcwd()
+        os.chdir(work_dir) # load_fund_codes keeps its cache file in the working directory
+        engine = create_engine(f"sqlite:///{os.path.join(work_dir, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        db_session = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
+        timer = StageTimer()
+        try:
+            with stub_network(fixtures_dir), timer.patched(), contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                result = fileparse.process_excel_data(db_session, mutual_funds_filepath, account_balances_filepath,
+                                                      password=password, commit_changes=True) or {}
+                total = time.perf_counter() - start
+        finally:
+            db_session.remove()
+            engine.dispose()
+            os.chdir(cwd)
+
+    rows = len(result.get('new_mutual_fund_transactions', [])) + len(result.get('new_account_balances', []))
+    stages = {stage: timer.seconds.get(stage, 0.0) * 1000 for stage in STAGES if stage != 'normalize'}
+    stages['normalize'] = max(total * 1000 - sum(stages.values()), 0.0)
+    return {
+        'error': result.get('error'),
+        'rows': rows,
+        'total_ms': total * 1000,
+        'rows_per_second': rows / total if total else 0.0,
+        'stages_ms': stages,
+    }
+
+def run(sizes, corpus_dir, seed):
+    corpus = write_corpus(corpus_dir, sizes, seed)
+    fixtures_dir = os.path.join(corpus_dir, 'mfapi')
+    results = {}
+    for size, paths in corpus.items():
+        results[f"{size}x"] = {}
+        for name, mutual_funds_filepath, account_balances_filepath, password in import_cases(paths):
+            case = run_case(mutual_funds_filepath, account_balances_filepath, password, fixtures_dir)
+            case['rows_expected'] = BASE_SIZES[CASE_ROWS[name]] * size
+            results[f"{size}x"][name] = case
+            if case['error']:
+                print(f"[{size}x] {name}: error: {case['error']}")
+            elif case['rows'] != case['rows_expected']:
+                print(f"[{size}x] {name}: {case['rows']} rows imported of the {case['rows_expected']} in the statement")
+            else:
+                stages = ', '.join(f"{stage} {ms:.0f}" for stage, ms in case['stages_ms'].items())
+                print(f"[{size}x] {name}: {case['rows']} rows in {case['total_ms']:.0f} ms ({stages})")
+    return results
+
+def compare(results, baseline, max_ratio):
+    """
+    Returns a list of regressions: cases whose total time is more than max_ratio times the baseline,
+    and cases importing another number of rows than the baseline did, whose timings don't compare
+    (a baseline recorded while CAMS imports kept only their first page, say); re-record those.
+    """
+    regressions = []
+    for size, cases in results.items():
+        for name, case in cases.items():
+            previous = baseline.get('sizes', {}).get(size, {}).get(name)
+            if previous and not previous['error'] and not case['error'] and case['rows'] != previous['rows']:
+                regressions.append(f"{size} {name}: {previous['rows']} rows in the baseline, {case['rows']} now; re-record the baseline")
+            elif previous and not previous['error'] and not case['error'] and case['total_ms'] > previous['total_ms'] * max_ratio:
+                regressions.append(f"{size} {name}: {previous['total_ms']:.0f} ms -> {case['total_ms']:.0f} ms")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1,10,100', help='comma separated size multipliers')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--corpus-dir', help='keep the generated corpus here instead of a temporary directory')
+    parser.add_argument('--output', default='bench_import.json')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    parser.add_argument('--max-ratio', type=float, default=1.25, help='allowed slowdown against the baseline')
+    args = parser.parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    # The per-stage JSON log lines of the import traces would drown out the results
+    logging.getLogger('finapp.import').setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = run(sizes, os.path.abspath(args.corpus_dir or tmp_dir), args.seed)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'sizes': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.max_ratio)
+        if regressions:
+            print("Regressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("No regressions.")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+Route-level benchmarks.
+
+Generates a synthetic portfolio at several scale points, times the dashboard routes through the
+Flask test client with mfapi.in stubbed out, and writes the results as JSON. Passing --baseline
+compares against an earlier results file and exits non-zero if any route got slower than the
+allowed ratio.
+
+    python -m benchmarks.bench_routes --scales small,medium --output bench_routes.json
+    python -m benchmarks.bench_routes --baseline bench_routes.json --max-ratio 1.25
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic import generate_portfolio, stub_network
+
+# Keyword arguments for generate_portfolio at each scale point
+SCALES = {
+    'small': {'funds': 5, 'years': 2, 'accounts': 2, 'fixed_deposits': 5},
+    'medium': {'funds': 20, 'years': 5, 'accounts': 3, 'fixed_deposits': 20},
+    'large': {'funds': 60, 'years': 10, 'accounts': 5, 'fixed_deposits': 50},
+}
+ROUTES = ['/', '/balances', '/transactions', '/performance', '/fixed_deposits', '/api/charts/portfolio', '/api/charts/balances',
+          '/api/analytics/monthly_cash_flows', '/api/search?q=payment']
+
+def time_route(client, route, repeat):
+    """Requests a route `repeat` times after one warm-up request and returns timings in milliseconds."""
+    response = client.get(route)
+    if response.status_code != 200:
+        raise RuntimeError(f"GET {route} returned {response.status_code}")
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        client.get(route)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'median_ms': statistics.median(timings),
+        'min_ms': min(timings),
+        'max_ms': max(timings),
+        'repeat': repeat,
+        'response_bytes': len(response.data),
+    }
+
+def run(scales, repeat, seed, analytics_backend='numpy'):
+    import app as finance_app
+
+    results = {}
+    for scale in scales:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            database_uri = f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+            rows = generate_portfolio(database_uri, seed=seed, **SCALES[scale])
+            flask_app = finance_app.create_app({'SQLALCHEMY_DATABASE_URI': database_uri,
+                                               'CACHE_PATH': os.path.join(tmp_dir, 'cache.db'),
+                                               'SNAPSHOT_DIR': os.path.join(tmp_dir, 'snapshot'),
+                                               'HTTP_CACHE_PATH': os.path.join(tmp_dir, 'http_cache.db'),
+                                               'ANALYTICS_BACKEND': analytics_backend})
+            finance_app.init_db() # Creates the search index over the generated rows
+            client = flask_app.test_client()
+            print(f"[{scale}] {rows}")
+            scale_results = {'rows': rows, 'routes': {}}
+            with stub_network():
+                for route in ROUTES:
+                    scale_results['routes'][route] = time_route(client, route, repeat)
+                    print(f"[{scale}] GET {route}: {scale_results['routes'][route]['median_ms']:.1f} ms")
+            finance_app.db_session.remove()
+            flask_app.extensions['engine'].dispose()
+            results[scale] = scale_results
+    return results
+
+def compare(results, baseline, max_ratio):
+    """Returns a list of regressions: routes whose median is more than max_ratio times the baseline."""
+    regressions = []
+    for scale, scale_results in results.items():
+        for route, timing in scale_results['routes'].items():
+            previous = baseline.get('scales', {}).get(scale, {}).get('routes', {}).get(route)
+            if previous and timing['median_ms'] > previous['median_ms'] * max_ratio:
+                regressions.append(f"{scale} {route}: {previous['median_ms']:.1f} ms -> {timing['median_ms']:.1f} ms")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', default='small,medium', help=f"comma separated scale points ({', '.join(SCALES)})")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--analytics-backend', default='numpy', choices=['numpy', 'duckdb', 'auto'])
+    parser.add_argument('--output', default='bench_routes.json')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    parser.add_argument('--max-ratio', type=float, default=1.25, help='allowed slowdown against the baseline')
+    args = parser.parse_args(argv)
+
+    scales = [scale.strip() for scale in args.scales.split(',') if scale.strip()]
+    unknown = [scale for scale in scales if scale not in SCALES]
+    if unknown:
+        parser.error(f"unknown scales: {', '.join(unknown)}")
+
+    results = run(scales, args.repeat, args.seed, args.analytics_backend)
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'analytics_backend': args.analytics_backend,
+        'scales': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.max_ratio)
+        if regressions:
+            print("Regressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("No regressions.")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""
+Throughput benchmarks for the production serving profile.
+
+Generates a synthetic portfolio, then for each worker count starts gunicorn with gunicorn.conf.py
+(or waitress through wsgi.py when gunicorn is not installed; waitress only has threads, so the worker
+count is ignored) and drives it with concurrent keep-alive HTTP clients over the dashboard routes
+for a fixed time. Reports requests per second, latency percentiles and the speed-up over the first
+worker count. Throughput should grow with the worker count up to the number of cores.
+
+    python -m benchmarks.bench_serving --workers 1,2,4 --threads 4 --clients 16 --duration 10
+    python -m benchmarks.bench_serving --baseline bench_serving.json --max-ratio 1.25
+"""
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.bench_routes import ROUTES, SCALES
+from benchmarks.synthetic import generate_portfolio
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(workers, threads, port, database_uri, work_dir):
+    """Starts gunicorn (or waitress) in work_dir and waits until it answers; returns the process and the server name."""
+    env = dict(os.environ, PYTHONPATH=ROOT_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''),
+               DATABASE_URI=database_uri, CACHE_PATH=os.path.join(work_dir, 'cache.db'),
+               BIND=f"127.0.0.1:{port}", WEB_CONCURRENCY=str(workers), THREADS=str(threads), ACCESS_LOG='')
+    if importlib.util.find_spec('gunicorn'):
+        server, command = 'gunicorn', [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT_DIR, 'gunicorn.conf.py'), 'wsgi:app']
+    else:
+        server, command = 'waitress', [sys.executable, os.path.join(ROOT_DIR, 'wsgi.py')]
+    process = subprocess.Popen(command, cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{server} exited:\n{process.stderr.read().decode()[-2000:]}")
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/')
+            if connection.getresponse().status == 200:
+                return process, server
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f"{server} did not start on port {port}")
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+def drive(port, clients, duration):
+    """Requests ROUTES round robin from `clients` threads for `duration` seconds; returns latencies (ms) and the error count."""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(index):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        own_latencies, own_errors, i = [], 0, index
+        while time.perf_counter() < deadline:
+            route = ROUTES[i % len(ROUTES)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                connection.request('GET', route)
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    own_errors += 1
+            except (OSError, http.client.HTTPException):
+                own_errors += 1
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                continue
+            own_latencies.append((time.perf_counter() - start) * 1000)
+        connection.close()
+        with lock:
+            latencies.extend(own_latencies)
+            errors[0] += own_errors
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+def run(scale, worker_counts, threads, clients, duration, seed):
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        database_uri = f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+        rows = generate_portfolio(database_uri, seed=seed, **SCALES[scale])
+        print(f"[{scale}] {rows}")
+        for workers in worker_counts:
+            port = free_port()
+            process, server = start_server(workers, threads, port, database_uri, work_dir)
+            try:
+                drive(port, clients, min(duration, 2)) # warm up every worker
+                latencies, errors = drive(port, clients, duration)
+            finally:
+                stop_server(process)
+            latencies.sort()
+            case = {
+                'server': server,
+                'workers': workers,
+                'threads': threads,
+                'clients': clients,
+                'requests': len(latencies),
+                'errors': errors,
+                'requests_per_second': len(latencies) / duration,
+                'p50_ms': statistics.median(latencies) if latencies else None,
+                'p95_ms': latencies[int(len(latencies) * 0.95)] if latencies else None,
+            }
+            first = next(iter(results.values()), case)
+            case['speedup'] = case['requests_per_second'] / first['requests_per_second'] if first['requests_per_second'] else 0.0
+            results[str(workers)] = case
+            print(f"[{scale}] {server} {workers} workers x {threads} threads: {case['requests_per_second']:.1f} req/s, "
+                  f"p50 {case['p50_ms'] or 0:.1f} ms, p95 {case['p95_ms'] or 0:.1f} ms, {errors} errors, x{case['speedup']:.2f}")
+    return results
+
+def compare(results, baseline, max_ratio):
+    """Returns a list of regressions: worker counts whose throughput dropped below the baseline divided by max_ratio."""
+    regressions = []
+    for workers, case in results.items():
+        previous = baseline.get('workers', {}).get(workers)
+        if previous and case['requests_per_second'] * max_ratio < previous['requests_per_second']:
+            regressions.append(f"{workers} workers: {previous['requests_per_second']:.1f} req/s -> {case['requests_per_second']:.1f} req/s")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', default='small', choices=list(SCALES))
+    parser.add_argument('--workers', default=f"1,{os.cpu_count() or 1}", help='comma separated worker counts')
+    parser.add_argument('--threads', type=int, default=4, help='threads per worker')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent HTTP clients')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of load per worker count')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_serving.json')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    parser.add_argument('--max-ratio', type=float, default=1.25, help='allowed slowdown against the baseline')
+    args = parser.parse_args(argv)
+    worker_counts = list(dict.fromkeys(int(workers) for workers in args.workers.split(',') if workers.strip()))
+
+    results = run(args.scale, worker_counts, args.threads, args.clients, args.duration, args.seed)
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'scale': args.scale,
+        'seed': args.seed,
+        'workers': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.max_ratio)
+        if regressions:
+            print("Regressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("No regressions.")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
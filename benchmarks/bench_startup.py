@@ -0,0 +1,144 @@
+"""
+Cold start benchmarks.
+
+Starts a fresh interpreter with `python -X importtime` for each case, parses the import time
+report and writes the results as JSON:
+
+    import_app      import app
+    create_app      import app and build the application, what a worker does at startup
+    import_pipeline import fileparse, the cost deferred until the first upload
+
+The report lists the slowest imports of each case (the module itself and what it imports directly,
+leaving out what a bare interpreter already loads) and which of the heavy modules
+(HEAVY_MODULES) were loaded. A heavy module loaded at startup fails the run, as does a case that
+got slower than --max-ratio times the --baseline.
+
+    python -m benchmarks.bench_startup --repeat 5 --output bench_startup.json
+    python -m benchmarks.bench_startup --baseline bench_startup.json --max-ratio 1.25
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = {
+    'import_app': 'import app',
+    'create_app': 'import app; app.create_app()',
+    'import_pipeline': 'import fileparse',
+}
+# Cases that must not load any of HEAVY_MODULES
+STARTUP_CASES = ['import_app', 'create_app']
+HEAVY_MODULES = ['pandas', 'tabula', 'PyPDF2', 'numpy_financial', 'fuzzywuzzy', 'requests', 'duckdb']
+
+def parse_importtime(stderr):
+    """
+    Parses `-X importtime` output into a list of (module, self_us, cumulative_us, depth),
+    depth 0 being a module imported directly by the code that ran.
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+def run_case(code, work_dir):
+    """Runs `code` in a new interpreter and returns its wall time in milliseconds and the parsed import times."""
+    env = dict(os.environ, PYTHONPATH=ROOT_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''),
+               DATABASE_URI=f"sqlite:///{os.path.join(work_dir, 'bench.db')}")
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=work_dir, env=env,
+                             capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    if process.returncode != 0:
+        raise RuntimeError(f"{code!r} failed:\n{process.stderr[-2000:]}")
+    return wall_ms, parse_importtime(process.stderr)
+
+def run(repeat, top):
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        interpreter_ms, interpreter_modules = run_case('pass', work_dir)
+        startup_modules = {module[0] for module in interpreter_modules}
+        print(f"interpreter: {interpreter_ms:.0f} ms wall")
+        for name, code in CASES.items():
+            runs = [run_case(code, work_dir) for _ in range(repeat)]
+            wall_times = [wall_ms for wall_ms, modules in runs]
+            import_times = [sum(self_us for _, self_us, _, _ in modules) / 1000 for _, modules in runs]
+            # Module lists are the same in every run; report the run with the median import time
+            modules = sorted(runs, key=lambda item: sum(self_us for _, self_us, _, _ in item[1]))[len(runs) // 2][1]
+            top_level = sorted((module for module in modules if module[3] <= 1 and module[0] not in startup_modules),
+                               key=lambda module: module[2], reverse=True)
+            loaded = {module[0] for module in modules}
+            results[name] = {
+                'code': code,
+                'wall_ms': statistics.median(wall_times),
+                'import_ms': statistics.median(import_times),
+                'modules': len(modules),
+                'heavy_modules': [module for module in HEAVY_MODULES if module in loaded],
+                'slowest_imports': [{'module': module, 'cumulative_ms': cumulative_us / 1000} for module, _, cumulative_us, _ in top_level[:top]],
+                'repeat': repeat,
+            }
+            case = results[name]
+            print(f"{name}: {case['wall_ms']:.0f} ms wall, {case['import_ms']:.0f} ms importing {case['modules']} modules"
+                  + (f", heavy: {', '.join(case['heavy_modules'])}" if case['heavy_modules'] else ''))
+            for item in case['slowest_imports']:
+                print(f"    {item['module']}: {item['cumulative_ms']:.1f} ms")
+    return results
+
+def compare(results, baseline, max_ratio):
+    """Returns a list of regressions: cases whose import time is more than max_ratio times the baseline."""
+    regressions = []
+    for name, case in results.items():
+        previous = baseline.get('cases', {}).get(name)
+        if previous and case['import_ms'] > previous['import_ms'] * max_ratio:
+            regressions.append(f"{name}: {previous['import_ms']:.0f} ms -> {case['import_ms']:.0f} ms")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=8, help='number of slowest imports to report per case')
+    parser.add_argument('--output', default='bench_startup.json')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    parser.add_argument('--max-ratio', type=float, default=1.25, help='allowed slowdown against the baseline')
+    args = parser.parse_args(argv)
+
+    results = run(args.repeat, args.top)
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cases': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+    status = 0
+    for name in STARTUP_CASES:
+        if results[name]['heavy_modules']:
+            print(f"{name} loads heavy modules at startup: {', '.join(results[name]['heavy_modules'])}")
+            status = 1
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.max_ratio)
+        if regressions:
+            print("Regressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            status = 1
+        else:
+            print("No regressions.")
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""
+Synthetic statement files in the formats process_excel_data reads.
+
+    python -m benchmarks.statements --output-dir corpus --sizes 1,10,100
+
+writes, per size multiplier:
+    mutual_funds_<n>x.xlsx       mutual fund transactions, 3 header rows then the table (skiprows=3)
+    balances_<n>x.xlsx           HDFC-style account balances with a Bank column
+    icici_<n>x.pdf               ICICI-style statement, header on the first page only
+    icici_<n>x_encrypted.pdf     the same statement protected with PDF_PASSWORD
+    cams_<n>x.pdf                CAMS-style mutual fund statement
+and mfapi.in fixtures for all the funds under <output-dir>/mfapi.
+"""
+import argparse
+import datetime
+import os
+import random
+
+import openpyxl
+import PyPDF2
+
+from benchmarks.synthetic import fund_name, fund_code, nav_series, write_mfapi_fixtures
+from fileparse import MUTUAL_FUNDS_SHEET
+
+PDF_PASSWORD = 'bench1234'
+END_DATE = datetime.date(2025, 3, 31)
+
+# Rows and funds per statement at size 1x
+BASE_SIZES = {'mutual_fund_rows': 120, 'funds': 5, 'balance_rows': 365, 'icici_rows': 60, 'cams_rows': 60}
+ROWS_PER_PAGE = 45
+
+def fund_names_for(funds):
+    """
+    Returns statement fund names. Most match an mfapi scheme name exactly; every fourth one
+    is abbreviated the way registrars print it, so it goes through fuzzy matching.
+    """
+    names = []
+    for i in range(funds):
+        name = fund_name(i)
+        if i % 4 == 3:
+            name = name.replace(' - Direct Plan - ', ' - Direct - ')
+        names.append(name)
+    return names
+
+def write_mutual_funds_xlsx(path, rows, funds, seed=0):
+    rng = random.Random(seed)
+    names = fund_names_for(funds)
+    navs = {name: nav_series(rng, rng.uniform(10, 200), rows + 1) for name in names}
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = MUTUAL_FUNDS_SHEET
+    sheet.append(['Transaction Report'])
+    sheet.append([f"Family Id: {MUTUAL_FUNDS_SHEET.rsplit('_', 1)[-1]}"])
+    sheet.append([f"Generated on {END_DATE.isoformat()}"])
+    sheet.append(['Trade Date', 'Investment name', 'Folio', 'Buy units', 'Sell units', 'Dividend reinvested units',
+                  'Cash inflow', 'Cash outflow', 'Dividend Amount'])
+    start = END_DATE - datetime.timedelta(days=rows)
+    for i in range(rows):
+        name = names[i % len(names)]
+        nav = navs[name][i]
+        trade_date = datetime.datetime.combine(start + datetime.timedelta(days=i), datetime.time())
+        amount = float(rng.choice([1000, 2000, 5000, 10000]))
+        units = round(amount / nav, 3)
+        kind = rng.random()
+        folio = f"{10000000 + names.index(name)}/{(names.index(name) * 7) % 100:02d}"
+        if kind < 0.9:
+            sheet.append([trade_date, name, folio, units, 0, 0, amount, 0, 0])
+        elif kind < 0.97:
+            sheet.append([trade_date, name, folio, 0, units, 0, 0, -amount, 0])
+        else:
+            sheet.append([trade_date, name, folio, 0, 0, units, 0, 0, amount])
+    workbook.save(path)
+
+def write_balances_xlsx(path, rows, banks=('HDFC',), seed=0):
+    rng = random.Random(seed)
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(['Bank', 'Date', 'Narration', 'Chq./Ref.No.', 'Value Dt', 'Withdrawal Amt.', 'Deposit Amt.', 'Closing Balance'])
+    start = END_DATE - datetime.timedelta(days=rows // len(banks))
+    for bank in banks:
+        balance = rng.uniform(50000, 500000)
+        for i in range(rows // len(banks)):
+            day = datetime.datetime.combine(start + datetime.timedelta(days=i), datetime.time())
+            if rng.random() < 0.6:
+                withdrawal, deposit = round(rng.expovariate(1 / 2000), 2), 0.0
+                narration = f"UPI-{rng.choice(['SWIGGY', 'ZOMATO', 'AMAZON', 'BIGBASKET', 'UBER'])}-{rng.randint(10**9, 10**10 - 1)}@ybl"
+            else:
+                withdrawal, deposit = 0.0, round(rng.expovariate(1 / 3500), 2)
+                narration = f"NEFT CR-{rng.randint(10**9, 10**10 - 1)}-SALARY"
+            balance += deposit - withdrawal
+            sheet.append([bank, day, narration, f"{rng.randint(10**15, 10**16 - 1)}", day, withdrawal, deposit, round(balance, 2)])
+    workbook.save(path)
+
+def _pdf_escape(text):
+    return str(text).replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def write_table_pdf(path, columns, rows, header_on_every_page=True, rows_per_page=ROWS_PER_PAGE):
+    """
+    Writes a plain text-positioned table to a PDF, one content stream per page.
+    columns is a list of (header, x position); tabula's stream mode reads it back as a table.
+    """
+    pages = []
+    for page_start in range(0, max(len(rows), 1), rows_per_page):
+        lines = []
+        page_rows = rows[page_start:page_start + rows_per_page]
+        if header_on_every_page or page_start == 0:
+            page_rows = [[header for header, x in columns]] + page_rows
+        y = 800
+        for row in page_rows:
+            for (header, x), value in zip(columns, row):
+                lines.append(f"BT /F1 8 Tf {x} {y} Td ({_pdf_escape(value)}) Tj ET")
+            y -= 16
+        pages.append('\n'.join(lines).encode('latin-1'))
+
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for content in pages:
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        page_ids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b' '.join(b"%d 0 R" % i for i in page_ids), len(page_ids))
+
+    with open(path, 'wb') as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+
+def encrypt_pdf(source_path, path, password=PDF_PASSWORD):
+    reader = PyPDF2.PdfReader(source_path)
+    writer = PyPDF2.PdfWriter()
+    for page in reader.pages:
+        writer.add_page(page)
+    writer.encrypt(password)
+    with open(path, 'wb') as f:
+        writer.write(f)
+
+def write_icici_pdf(path, rows, seed=0):
+    """ICICI-style statement: the header is only printed on the first page, dates are dd-mm-YYYY."""
+    rng = random.Random(seed)
+    columns = [('S No.', 40), ('Date', 80), ('Description', 150), ('Amount', 420), ('Type', 500)]
+    start = END_DATE - datetime.timedelta(days=rows)
+    table = []
+    for i in range(rows):
+        day = start + datetime.timedelta(days=i)
+        if rng.random() < 0.65:
+            description, kind, amount = f"UPI/{rng.randint(10**11, 10**12 - 1)}/{rng.choice(['PAYTM', 'GPAY', 'PHONEPE'])}", 'DR', rng.expovariate(1 / 1500)
+        else:
+            description, kind, amount = f"NEFT-{rng.choice(['ACME CORP', 'INTEREST', 'REFUND'])}", 'CR', rng.expovariate(1 / 4000)
+        table.append([i + 1, day.strftime('%d-%m-%Y'), description, f"{amount:,.2f}", kind])
+    write_table_pdf(path, columns, table, header_on_every_page=False)
+
+def write_cams_pdf(path, rows, funds, seed=0):
+    """CAMS-style statement: one transaction per line with the fund name in Description."""
+    rng = random.Random(seed)
+    names = fund_names_for(funds)
+    columns = [('Date', 30), ('Description', 90), ('Amount', 330), ('Units', 400), ('NAV', 460), ('Balance', 520)]
+    start = END_DATE - datetime.timedelta(days=rows)
+    balances = {name: 0.0 for name in names}
+    table = []
+    for i in range(rows):
+        name = names[i % len(names)]
+        nav = rng.uniform(10, 200)
+        amount = float(rng.choice([1000, 2000, 5000]))
+        units = round(amount / nav, 3)
+        balances[name] += units
+        table.append([(start + datetime.timedelta(days=i)).strftime('%d-%b-%Y'), name[:48], f"{amount:.2f}", f"{units:.3f}", f"{nav:.4f}", f"{balances[name]:.3f}"])
+    write_table_pdf(path, columns, table)
+
+def write_corpus(output_dir, sizes=(1, 10, 100), seed=0):
+    """Writes the statements for each size multiplier and the mfapi fixtures; returns {size: {kind: path}}."""
+    os.makedirs(output_dir, exist_ok=True)
+    corpus = {}
+    max_funds = 0
+    for size in sizes:
+        funds = BASE_SIZES['funds'] * size
+        max_funds = max(max_funds, funds)
+        paths = {
+            'mutual_funds_xlsx': os.path.join(output_dir, f"mutual_funds_{size}x.xlsx"),
+            'balances_xlsx': os.path.join(output_dir, f"balances_{size}x.xlsx"),
+            'icici_pdf': os.path.join(output_dir, f"icici_{size}x.pdf"),
+            'icici_pdf_encrypted': os.path.join(output_dir, f"icici_{size}x_encrypted.pdf"),
+            'cams_pdf': os.path.join(output_dir, f"cams_{size}x.pdf"),
+        }
+        write_mutual_funds_xlsx(paths['mutual_funds_xlsx'], BASE_SIZES['mutual_fund_rows'] * size, funds, seed)
+        write_balances_xlsx(paths['balances_xlsx'], BASE_SIZES['balance_rows'] * size, seed=seed)
+        write_icici_pdf(paths['icici_pdf'], BASE_SIZES['icici_rows'] * size, seed)
+        encrypt_pdf(paths['icici_pdf'], paths['icici_pdf_encrypted'])
+        write_cams_pdf(paths['cams_pdf'], BASE_SIZES['cams_rows'] * size, funds, seed)
+        corpus[size] = paths
+    # The scheme list is padded so fuzzy matching searches a realistically sized mapping
+    total_schemes = max(max_funds, 2000)
+    write_mfapi_fixtures(os.path.join(output_dir, 'mfapi'), total_schemes, [fund_code(i) for i in range(max_funds)])
+    return corpus
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output-dir', default='corpus')
+    parser.add_argument('--sizes', default='1,10,100', help='comma separated size multipliers')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    corpus = write_corpus(args.output_dir, [int(size) for size in args.sizes.split(',')], args.seed)
+    for size, paths in corpus.items():
+        for kind, path in paths.items():
+            print(f"{size}x {kind}: {path} ({os.path.getsize(path)} bytes)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""
+Deterministic synthetic portfolio generator for benchmarks.
+
+generate_portfolio() fills a SQLite database with N funds, M years of monthly SIP transactions,
+K bank accounts with daily balances and F fixed deposits. The same arguments always produce the
+same rows, so timings from different runs are comparable.
+"""
+import contextlib
+import datetime
+import json
+import os
+import random
+from unittest import mock
+
+import requests
+from sqlalchemy import create_engine, insert
+
+from models import Base, AccountBalance, Fund, MutualFundTransaction, FixedDeposit
+from mfapi import mfapi
+
+AMCS = ['Axis', 'HDFC', 'ICICI Prudential', 'Kotak', 'Mirae Asset', 'Nippon India', 'Parag Parikh', 'SBI', 'UTI', 'DSP']
+CATEGORIES = ['Bluechip', 'Flexi Cap', 'Midcap', 'Small Cap', 'ELSS Tax Saver', 'Nifty 50 Index', 'Balanced Advantage', 'Liquid']
+BANKS = ['HDFC', 'ICICI', 'SBI', 'Axis', 'Kotak', 'IDFC First', 'Yes Bank', 'IndusInd']
+FIRST_SCHEME_CODE = 100000
+NAV_HISTORY_YEARS = 6
+NAV_HISTORY_END = datetime.date(2025, 3, 31)
+
+def fund_name(i):
+    """Returns the name of the i-th synthetic fund, in the style of the mfapi.in scheme names."""
+    amc = AMCS[i % len(AMCS)]
+    category = CATEGORIES[(i // len(AMCS)) % len(CATEGORIES)]
+    series = i // (len(AMCS) * len(CATEGORIES))
+    suffix = f" {series + 1}" if series else ""
+    return f"{amc} {category} Fund{suffix} - Direct Plan - Growth"
+
+def fund_code(i):
+    return str(FIRST_SCHEME_CODE + i)
+
+def bank_name(k):
+    return BANKS[k % len(BANKS)] + (f" {k // len(BANKS) + 1}" if k >= len(BANKS) else "")
+
+def nav_series(rng, start_nav, days):
+    """Returns a daily NAV random walk with a positive drift."""
+    navs = [start_nav]
+    for _ in range(days - 1):
+        navs.append(max(1.0, navs[-1] * (1 + rng.gauss(0.0004, 0.01))))
+    return navs
+
+def generate_portfolio(database_uri, funds=10, years=3, accounts=2, fixed_deposits=5, seed=0, end_date=None):
+    """
+    Creates the schema in database_uri and fills it with a synthetic portfolio.
+    Returns a dict with the number of rows written per table.
+    """
+    rng = random.Random(seed)
+    end_date = end_date or datetime.date(2025, 3, 31)
+    start_date = end_date - datetime.timedelta(days=int(365 * years))
+    days = (end_date - start_date).days + 1
+
+    engine = create_engine(database_uri)
+    Base.metadata.create_all(bind=engine)
+
+    fund_rows = []
+    transaction_rows = []
+    for i in range(funds):
+        navs = nav_series(rng, rng.uniform(10, 200), days)
+        fund_rows.append({'fund_name': fund_name(i), 'fund_code': fund_code(i), 'current_nav': round(navs[-1], 4),
+                          'last_updated': datetime.datetime.combine(end_date, datetime.time())})
+        sip_amount = rng.choice([1000, 2000, 2500, 5000, 10000])
+        sip_day = rng.randint(1, 28)
+        units_held = 0.0
+        for offset in range(days):
+            day = start_date + datetime.timedelta(days=offset)
+            if day.day != sip_day:
+                continue
+            nav = navs[offset]
+            timestamp = datetime.datetime.combine(day, datetime.time())
+            units = round(sip_amount / nav, 3)
+            units_held += units
+            transaction_rows.append({'fund_name': fund_name(i), 'transaction_type': 'Buy', 'amount': float(sip_amount),
+                                     'units': units, 'nav': round(nav, 4), 'timestamp': timestamp})
+            # Occasional partial redemption
+            if rng.random() < 0.03 and units_held > units:
+                sell_units = round(units_held * rng.uniform(0.05, 0.3), 3)
+                units_held -= sell_units
+                transaction_rows.append({'fund_name': fund_name(i), 'transaction_type': 'Sell', 'amount': round(sell_units * nav, 2),
+                                         'units': sell_units, 'nav': round(nav, 4), 'timestamp': timestamp})
+
+    balance_rows = []
+    for k in range(accounts):
+        balance = rng.uniform(50000, 500000)
+        for offset in range(days):
+            day = start_date + datetime.timedelta(days=offset)
+            if rng.random() < 0.6:
+                withdrawal, deposit = round(rng.expovariate(1 / 2000), 2), 0.0
+            else:
+                withdrawal, deposit = 0.0, round(rng.expovariate(1 / 3500), 2)
+            balance += deposit - withdrawal
+            balance_rows.append({'bank': bank_name(k), 'date': datetime.datetime.combine(day, datetime.time()),
+                                 'narration': f"UPI/{rng.randint(10**11, 10**12 - 1)}/PAYMENT", 'chq_ref_no': str(rng.randint(10**9, 10**10 - 1)),
+                                 'withdrawal_amt': withdrawal, 'deposit_amt': deposit, 'closing_balance': round(balance, 2)})
+
+    fd_rows = []
+    for j in range(fixed_deposits):
+        fd_start = start_date + datetime.timedelta(days=rng.randint(0, days - 1))
+        fd_rows.append({'bank': rng.choice(BANKS), 'amount': float(rng.choice([50000, 100000, 200000, 500000])),
+                        'interest_rate': round(rng.uniform(5.5, 8.0), 2),
+                        'start_date': datetime.datetime.combine(fd_start, datetime.time()),
+                        'maturity_date': datetime.datetime.combine(fd_start + datetime.timedelta(days=365 * rng.choice([1, 2, 3, 5])), datetime.time()),
+                        'total_interest_earned': 0.0, 'status': 'open', 'compounding': 'quarterly'})
+
+    with engine.begin() as connection:
+        for model, rows in ((Fund, fund_rows), (MutualFundTransaction, transaction_rows), (AccountBalance, balance_rows), (FixedDeposit, fd_rows)):
+            if rows:
+                connection.execute(insert(model.__table__), rows)
+    engine.dispose()
+    return {'funds': len(fund_rows), 'mutual_fund_transactions': len(transaction_rows),
+            'account_balances': len(balance_rows), 'fixed_deposits': len(fd_rows)}
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self._payload = payload
+        self.status_code = status_code
+        self.content = json.dumps(payload).encode()
+        self.headers = {}
+
+    def json(self):
+        return self._payload
+
+def scheme_list(total_schemes=len(AMCS) * len(CATEGORIES) * 4):
+    """Returns the /mf scheme list covering the first total_schemes synthetic funds."""
+    return [{'schemeCode': int(fund_code(i)), 'schemeName': fund_name(i)} for i in range(total_schemes)]
+
+def scheme_nav(code, years=NAV_HISTORY_YEARS):
+    """
+    Returns the /mf/<code> payload for a synthetic scheme: `years` of business-day NAVs ending on
+    31-03-2025, newest first as mfapi.in lists them, each derived from the code.
+    """
+    rng = random.Random(code)
+    nav = rng.uniform(10, 200)
+    drift, volatility = rng.uniform(0.0001, 0.0006), rng.uniform(0.003, 0.015)
+    day = NAV_HISTORY_END
+    data = []
+    while day > NAV_HISTORY_END - datetime.timedelta(days=round(years * 365.25)):
+        if day.weekday() < 5:
+            data.append({'date': day.strftime('%d-%m-%Y'), 'nav': f"{nav:.4f}"})
+            nav /= 1 + rng.gauss(drift, volatility)
+        day -= datetime.timedelta(days=1)
+    return {'meta': {'scheme_code': code}, 'data': data}
+
+def write_mfapi_fixtures(directory, total_schemes, nav_codes=()):
+    """
+    Writes mfapi.in responses as fixture files: <directory>/mf.json for the scheme list
+    and <directory>/mf/<code>.json for each scheme in nav_codes.
+    """
+    os.makedirs(os.path.join(directory, 'mf'), exist_ok=True)
+    with open(os.path.join(directory, 'mf.json'), 'w') as f:
+        json.dump(scheme_list(total_schemes), f)
+    for code in nav_codes:
+        with open(os.path.join(directory, 'mf', f"{code}.json"), 'w') as f:
+            json.dump(scheme_nav(code), f)
+
+def fake_mfapi_get(url, *args, fixtures_dir=None, **kwargs):
+    """
+    Serves mfapi.in requests without touching the network: from fixture files when
+    fixtures_dir is given, otherwise generated on the fly for the synthetic funds.
+    """
+    path = url.split('api.mfapi.in', 1)[-1].strip('/')
+    if fixtures_dir:
+        fixture = os.path.join(fixtures_dir, f"{path}.json")
+        if not os.path.exists(fixture):
+            return FakeResponse({}, status_code=404)
+        with open(fixture) as f:
+            return FakeResponse(json.load(f))
+    if path == 'mf':
+        return FakeResponse(scheme_list())
+    if path.startswith('mf/'):
+        return FakeResponse(scheme_nav(path.rsplit('/', 1)[-1]))
+    return FakeResponse({}, status_code=404)
+
+@contextlib.contextmanager
+def stub_network(fixtures_dir=None):
+    """
+    Keeps mfapi.in calls off the network for the duration of the block: replayed from the fixture
+    files in fixtures_dir by the mfapi client, or without one, generated on the fly by fake_mfapi_get.
+    """
+    if fixtures_dir:
+        previous = (mfapi.mode, mfapi.cache_path, mfapi.fixtures_dir)
+        mfapi.configure('replay', fixtures_dir=fixtures_dir)
+        try:
+            yield
+        finally:
+            mfapi.configure(*previous)
+    else:
+        with mock.patch.object(requests, 'get', fake_mfapi_get):
+            yield
@@ -0,0 +1,171 @@
+import datetime
+import itertools
+from sqlalchemy import select, insert, update, delete
+from models import MutualFundTransaction, FixedDeposit
+from fdengine import COMPOUNDING_PERIODS, maturity_date
+
+OPERATIONS = ('create', 'update', 'delete')
+TRANSACTION_TYPES = ('Buy', 'Sell')
+FIXED_DEPOSIT_STATUSES = ('open', 'matured', 'closed')
+
+def _parse_datetime(value):
+    return datetime.datetime.fromisoformat(value) if value is not None else None
+
+def _parse_compounding(value):
+    if value not in COMPOUNDING_PERIODS:
+        raise ValueError(f"invalid compounding '{value}'")
+    return value
+
+def _parse_text(value):
+    # str() would store JSON null as 'None' and numbers as text
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"expected a non-empty string, got {value!r}")
+    return value
+
+def _parse_transaction_type(value):
+    if value not in TRANSACTION_TYPES:
+        raise ValueError(f"invalid transaction_type '{value}'")
+    return value
+
+def _parse_status(value):
+    if value not in FIXED_DEPOSIT_STATUSES:
+        raise ValueError(f"invalid status '{value}'")
+    return value
+
+# Field name -> parser, per model. Parsers raise ValueError/TypeError on invalid input.
+TRANSACTION_FIELDS = {
+    'fund_name': _parse_text,
+    'transaction_type': _parse_transaction_type,
+    'amount': float,
+    'units': float,
+    'nav': float,
+    'timestamp': datetime.datetime.fromisoformat,
+}
+TRANSACTION_REQUIRED = list(TRANSACTION_FIELDS)
+
+FIXED_DEPOSIT_FIELDS = {
+    'bank': _parse_text,
+    'amount': float,
+    'interest_rate': float,
+    'start_date': datetime.datetime.fromisoformat,
+    'maturity_date': datetime.datetime.fromisoformat,
+    'compounding': _parse_compounding,
+    'status': _parse_status,
+    'closure_date': _parse_datetime,
+    'total_interest_earned': float,
+}
+FIXED_DEPOSIT_REQUIRED = ['bank', 'amount', 'interest_rate', 'start_date', 'maturity_date']
+
+def _fixed_deposit_defaults(data, values):
+    """Derives maturity_date from duration/duration_unit, like the new fixed deposit form."""
+    if 'maturity_date' not in values and 'duration' in data and 'start_date' in values:
+        values['maturity_date'] = maturity_date(values['start_date'], int(data['duration']), data.get('duration_unit', 'years'))
+
+BULK_MODELS = {
+    MutualFundTransaction: (TRANSACTION_FIELDS, TRANSACTION_REQUIRED, None),
+    FixedDeposit: (FIXED_DEPOSIT_FIELDS, FIXED_DEPOSIT_REQUIRED, _fixed_deposit_defaults),
+}
+
+def parse_operations(model, payload):
+    """
+    Validates a bulk payload: a list of {'op': 'create'|'update'|'delete', 'id': ..., 'data': {...}},
+    optionally wrapped as {'operations': [...]}.
+    Returns (operations, results); results holds one dict per item and has 'error' set for invalid items.
+    """
+    fields, required, fill_defaults = BULK_MODELS[model]
+    if isinstance(payload, dict):
+        payload = payload.get('operations')
+    if not isinstance(payload, list):
+        raise ValueError("Expected a JSON array of operations")
+
+    operations = []
+    results = []
+    for index, item in enumerate(payload):
+        result = {'index': index, 'op': None, 'id': None, 'status': None, 'error': None}
+        results.append(result)
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("operation must be an object")
+            op = item.get('op')
+            result['op'] = op
+            if op not in OPERATIONS:
+                raise ValueError(f"unknown op '{op}'")
+
+            values = {}
+            if op in ('update', 'delete'):
+                values['id'] = int(item['id'])
+                result['id'] = values['id']
+            if op in ('create', 'update'):
+                data = item.get('data') or {}
+                unknown = [name for name in data if name not in fields and name not in ('duration', 'duration_unit')]
+                if unknown:
+                    raise ValueError(f"unknown fields: {', '.join(unknown)}")
+                for name, value in data.items():
+                    if name in fields:
+                        if value is None and name in required:
+                            raise ValueError(f"{name} must not be null")
+                        values[name] = fields[name](value)
+                if op == 'create':
+                    if fill_defaults:
+                        fill_defaults(data, values)
+                    missing = [name for name in required if name not in values]
+                    if missing:
+                        raise ValueError(f"missing fields: {', '.join(missing)}")
+                elif len(values) == 1:
+                    raise ValueError("no fields to update")
+            operations.append((index, op, values))
+        except KeyError as e:
+            result['status'] = 'error'
+            result['error'] = f"missing {e}"
+        except (ValueError, TypeError) as e:
+            result['status'] = 'error'
+            result['error'] = str(e)
+    return operations, results
+
+def apply_operations(db_session, model, operations, results):
+    """
+    Applies validated operations in payload order in a single transaction: one existence check
+    for all ids, then one executemany per run of consecutive operations of the same kind. Updates
+    and deletes of missing rows, or of rows deleted earlier in the batch, are reported as errors
+    and the whole batch is rolled back. Returns True if the batch was committed.
+    """
+    ids = {values['id'] for index, op, values in operations if op != 'create'}
+    existing_ids = set(db_session.scalars(select(model.id).where(model.id.in_(ids)))) if ids else set()
+    deleted_ids = set()
+    for index, op, values in operations:
+        if op == 'create':
+            continue
+        if values['id'] in deleted_ids:
+            results[index]['status'] = 'error'
+            results[index]['error'] = f"{model.__name__} {values['id']} is deleted earlier in the batch"
+        elif values['id'] not in existing_ids:
+            results[index]['status'] = 'error'
+            results[index]['error'] = f"{model.__name__} {values['id']} not found"
+        elif op == 'delete':
+            deleted_ids.add(values['id'])
+    if any(result['status'] == 'error' for result in results):
+        return False
+
+    try:
+        for op, run in itertools.groupby(operations, key=lambda operation: operation[1]):
+            run = [(index, values) for index, op, values in run]
+            if op == 'create':
+                # Rows that share the same keys are sent in one executemany; RETURNING keeps ids in input order
+                new_ids = db_session.scalars(insert(model).returning(model.id, sort_by_parameter_order=True),
+                                             [values for index, values in run]).all()
+                for (index, values), new_id in zip(run, new_ids):
+                    results[index]['id'] = new_id
+                    results[index]['status'] = 'created'
+            elif op == 'update':
+                db_session.execute(update(model), [values for index, values in run])
+                for index, values in run:
+                    results[index]['status'] = 'updated'
+            else:
+                db_session.execute(delete(model).where(model.id.in_([values['id'] for index, values in run])))
+                for index, values in run:
+                    results[index]['status'] = 'deleted'
+        db_session.commit()
+        return True
+    except Exception:
+        db_session.rollback()
+        raise
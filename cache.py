@@ -0,0 +1,74 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+class SharedCache:
+    """
+    Key/value cache kept in a SQLite file, so every worker process and thread sees the same entries.
+    Values are stored as JSON. Until configure() is called the cache is disabled: get() returns the
+    default and set() does nothing, so code outside the web app (CLI imports, benchmarks) is unaffected.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._local = threading.local()
+
+    def configure(self, path):
+        self.path = os.path.abspath(path) if path else None
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads, nor carried over a fork
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key, default=None):
+        if not self.path:
+            return default
+        row = self._connection().execute('SELECT value, expires_at FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return default
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        """Stores value under key; with ttl (seconds) the entry expires after that long."""
+        if not self.path:
+            return
+        expires_at = time.time() + ttl if ttl else None
+        self._connection().execute('INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+                                   (key, json.dumps(value), expires_at))
+
+    def get_or_set(self, key, compute, ttl=None):
+        """Returns the cached value for key, calling compute() and caching its result on a miss. None is not cached."""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.set(key, value, ttl)
+        return value
+
+    def delete(self, key):
+        if self.path:
+            self._connection().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def clear(self, prefix=''):
+        """Removes every entry whose key starts with prefix."""
+        if self.path:
+            self._connection().execute("DELETE FROM cache WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+
+    def prune(self):
+        """Removes expired entries and returns how many there were."""
+        if not self.path:
+            return 0
+        return self._connection().execute('DELETE FROM cache WHERE expires_at < ?', (time.time(),)).rowcount
+
+shared_cache = SharedCache()
@@ -0,0 +1,167 @@
+import re
+import threading
+from collections import deque
+from sqlalchemy import select, update, func
+from models import AccountBalance, CategoryRule
+from dataversion import data_versions
+
+RULE_KINDS = ('keyword', 'upi', 'merchant')
+UNCATEGORIZED = 'Uncategorized'
+BACKFILL_BATCH_SIZE = 5000
+
+def normalize(text):
+    """Upper-cases a narration or pattern and collapses runs of whitespace."""
+    return ' '.join(str(text).upper().split())
+
+class Automaton:
+    """
+    Aho-Corasick automaton over a set of literal patterns: one pass over a text finds every
+    occurrence of all of them, however many patterns there are.
+    """
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.outputs = [[]] # pattern indexes ending at each state
+        for index, pattern in enumerate(patterns):
+            state = 0
+            for char in pattern:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.outputs.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.outputs[state].append(index)
+        # Breadth-first, so a state's failure state (always shallower) is complete before the state.
+        # The failure links are folded into the transitions: a DFA taking one lookup per character.
+        fail = [0] * len(self.goto)
+        self.delta = [dict(self.goto[0])] + [None] * (len(self.goto) - 1)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            self.delta[state] = dict(self.delta[fail[state]])
+            self.delta[state].update(self.goto[state])
+            for char, child in self.goto[state].items():
+                fail[child] = self.delta[fail[state]].get(char, 0)
+                self.outputs[child] = self.outputs[child] + self.outputs[fail[child]]
+                queue.append(child)
+
+    def find(self, text):
+        """Returns the set of indexes of the patterns occurring in text."""
+        delta, outputs = self.delta, self.outputs
+        found = set()
+        state = 0
+        for char in text:
+            state = delta[state].get(char, 0)
+            if outputs[state]:
+                found.update(outputs[state])
+        return found
+
+class Categorizer:
+    """
+    Classifies narrations with the category rules. Every rule's literal text goes into one automaton;
+    merchant patterns with * wildcards contribute each literal piece and are confirmed with a regex
+    only when all of their pieces occur. When several rules match, the highest priority wins, then
+    the longest pattern, then the oldest rule.
+    """
+
+    def __init__(self, rules):
+        pieces = {} # literal -> index into the automaton's patterns
+        compiled = []
+        for rule in rules:
+            pattern = normalize(rule.pattern)
+            literals = [piece for piece in pattern.split('*') if piece] if rule.kind == 'merchant' else [pattern]
+            if not literals:
+                continue
+            regex = None
+            if rule.kind == 'merchant' and len(literals) > 1:
+                regex = re.compile('.*'.join(re.escape(piece) for piece in literals))
+            indexes = [pieces.setdefault(piece, len(pieces)) for piece in literals]
+            compiled.append(((-(rule.priority or 0), -len(pattern), rule.id or 0), rule.category, indexes, regex))
+        compiled.sort(key=lambda item: item[0])
+        self.rules = [(category, indexes, regex) for _, category, indexes, regex in compiled]
+        # Each rule is looked at only when its longest piece occurs, so common short pieces
+        # (like the PAY of many merchant patterns) don't make every rule a candidate
+        literals = list(pieces)
+        self.triggers = {}
+        for position, (category, indexes, regex) in enumerate(self.rules):
+            longest = max(indexes, key=lambda index: len(literals[index]))
+            self.triggers.setdefault(longest, []).append(position)
+        self.automaton = Automaton(literals)
+
+    def classify(self, narration):
+        """Returns the category of one narration, or None when no rule matches."""
+        if not isinstance(narration, str) or not self.rules:
+            return None
+        text = normalize(narration)
+        found = self.automaton.find(text)
+        candidates = sorted(position for index in found for position in self.triggers.get(index, ()))
+        for position in candidates:
+            category, indexes, regex = self.rules[position]
+            if all(index in found for index in indexes) and (regex is None or regex.search(text)):
+                return category
+        return None
+
+    def classify_many(self, narrations):
+        """Classifies a column of narrations; repeated narrations are only matched once."""
+        categories = {}
+        result = []
+        for narration in narrations:
+            if narration not in categories:
+                categories[narration] = self.classify(narration)
+            result.append(categories[narration])
+        return result
+
+_compiled = {} # bind URL -> (rule table version, Categorizer)
+_lock = threading.Lock()
+
+def load_categorizer(db_session):
+    """Returns a Categorizer for the current rules, compiled again only after they change."""
+    key = str(db_session.get_bind().url)
+    version = data_versions(db_session, {CategoryRule.__tablename__})[CategoryRule.__tablename__]
+    compiled = _compiled.get(key)
+    if compiled is None or compiled[0] != version:
+        categorizer = Categorizer(db_session.query(CategoryRule).order_by(CategoryRule.id).all())
+        with _lock:
+            _compiled[key] = compiled = (version, categorizer)
+    return compiled[1]
+
+def backfill_categories(db_session, recategorize=False, batch_size=BACKFILL_BATCH_SIZE):
+    """
+    Categorizes stored balance entries in batches of batch_size, committing after each batch.
+    Only entries without a category are looked at unless recategorize is set, in which case every
+    entry is classified again. Returns the number of entries looked at and of entries changed.
+    """
+    categorizer = load_categorizer(db_session)
+    last_id = 0
+    scanned = changed = 0
+    while True:
+        query = select(AccountBalance.id, AccountBalance.narration, AccountBalance.category) \
+            .where(AccountBalance.id > last_id).order_by(AccountBalance.id).limit(batch_size)
+        if not recategorize:
+            query = query.where(AccountBalance.category.is_(None))
+        rows = db_session.execute(query).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        scanned += len(rows)
+        categories = categorizer.classify_many([row.narration for row in rows])
+        updates = [{'id': row.id, 'category': category} for row, category in zip(rows, categories) if category != row.category]
+        if updates:
+            db_session.execute(update(AccountBalance), updates)
+            db_session.commit()
+            changed += len(updates)
+    return {'scanned': scanned, 'changed': changed}
+
+def spend_by_category(db_session, start=None, end=None):
+    """Monthly withdrawals and deposits per category, as [{'month', 'category', 'spent', 'received'}] ordered by month."""
+    month = func.strftime('%Y-%m', AccountBalance.date)
+    category = func.coalesce(AccountBalance.category, UNCATEGORIZED)
+    query = select(month.label('month'), category.label('category'),
+                   func.sum(func.coalesce(AccountBalance.withdrawal_amt, 0)).label('spent'),
+                   func.sum(func.coalesce(AccountBalance.deposit_amt, 0)).label('received')) \
+        .group_by(month, category).order_by(month, category)
+    if start:
+        query = query.where(AccountBalance.date >= start)
+    if end:
+        query = query.where(AccountBalance.date < end)
+    return [dict(row._mapping) for row in db_session.execute(query)]
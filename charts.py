@@ -0,0 +1,133 @@
+import datetime
+import gzip
+import hashlib
+import json
+import numpy as np
+from flask import request, Response
+
+try:
+    import brotli
+except ImportError: # brotli is optional; gzip is used without it
+    brotli = None
+
+DEFAULT_POINTS = 800 # Roughly the width of a chart in pixels
+MAX_POINTS = 5000
+MIN_COMPRESS_SIZE = 1024
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling. Returns the indices of the `threshold` points of
+    (x, y) that best keep the visual shape of the line; x must be sorted.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    bucket_size = (n - 2) / (threshold - 2)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    selected = 0
+    for i in range(threshold - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        # The point of this bucket forming the largest triangle with the last selected point and the next bucket's average
+        average_x = x[end:next_end].mean()
+        average_y = y[end:next_end].mean()
+        area = np.abs((x[selected] - average_x) * (y[start:end] - y[selected]) - (x[selected] - x[start:end]) * (average_y - y[selected]))
+        selected = start + int(area.argmax())
+        indices[i + 1] = selected
+    return indices
+
+def _to_day(value):
+    return np.datetime64(value, 'D') if value else None
+
+def window(days, values, start=None, end=None, points=DEFAULT_POINTS):
+    """
+    Cuts a series (datetime64[D] days, float values) to [start, end] and downsamples it to `points`.
+    Returns [[ISO date, value], ...] and the number of points in the window before downsampling.
+    """
+    lo = np.searchsorted(days, _to_day(start), 'left') if start else 0
+    hi = np.searchsorted(days, _to_day(end), 'right') if end else len(days)
+    days, values = days[lo:hi], values[lo:hi]
+    keep = lttb(days.astype(np.int64), values, points)
+    return [[str(day), round(float(value), 2)] for day, value in zip(days[keep], values[keep])], len(days)
+
+def holdings_history(timestamps, funds, signed_units, navs, today=None):
+    """
+    Value history of mutual fund holdings at current NAVs, from transaction columns: timestamps,
+    fund indexes and units bought (positive) or sold (negative). navs[i] is the current NAV of fund i;
+    funds without a positive NAV are left out.
+    Returns (days, portfolio values, {fund index: values}), with a point for every transaction date and today.
+    """
+    today = np.datetime64(today or datetime.date.today(), 'D')
+    days_of = np.asarray(timestamps).astype('datetime64[D]')
+    days = np.unique(np.append(days_of, today))
+    navs = np.nan_to_num(np.asarray(navs, dtype=float))
+    valued = np.flatnonzero(navs > 0)
+    changes = np.zeros((len(days), len(navs)))
+    np.add.at(changes, (np.searchsorted(days, days_of), np.asarray(funds)), np.asarray(signed_units, dtype=float))
+    values = np.cumsum(changes[:, valued], axis=0) * navs[valued]
+    return days, values.sum(axis=1), {int(fund): values[:, i] for i, fund in enumerate(valued)}
+
+def closing_balance_history(dates, banks, balances):
+    """
+    Daily closing balance per bank from balance columns sorted by date and id; the last row of each
+    day wins. Returns {bank index: (days, balances)}.
+    """
+    days = np.asarray(dates).astype('datetime64[D]')
+    banks = np.asarray(banks)
+    series = {}
+    for bank in np.unique(banks):
+        rows = np.flatnonzero(banks == bank)
+        bank_days = days[rows]
+        last_of_day = np.append(bank_days[1:] != bank_days[:-1], True)
+        series[int(bank)] = (bank_days[last_of_day], np.asarray(balances, dtype=float)[rows][last_of_day])
+    return series
+
+def chart_args():
+    """Reads the start, end (ISO dates) and points query arguments of a chart request."""
+    points = request.args.get('points', DEFAULT_POINTS, type=int)
+    start = request.args.get('start') or None
+    end = request.args.get('end') or None
+    for value in (start, end):
+        if value:
+            datetime.date.fromisoformat(value[:10]) # raises ValueError for malformed dates
+    return (start[:10] if start else None), (end[:10] if end else None), max(3, min(points, MAX_POINTS))
+
+def _accepted_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+def cached_json_response(etag_parts, build):
+    """
+    Serves build()'s JSON payload with a strong ETag derived from etag_parts (data versions and
+    request arguments). Answers 304 without calling build() when the client already has it, and
+    compresses the body with brotli or gzip when the client accepts them.
+    """
+    encoding = _accepted_encoding()
+    digest = hashlib.sha1(json.dumps(etag_parts, sort_keys=True, default=str).encode()).hexdigest()[:24]
+    # Each encoding is a different representation, so it gets its own strong ETag
+    etag = f"{digest}-{encoding}" if encoding else digest
+    headers = {'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache'}
+    # A small body is sent uncompressed under the bare digest
+    matched = next((candidate for candidate in (etag, digest) if request.if_none_match.contains(candidate)), None)
+    if matched:
+        response = Response(status=304, headers=headers)
+        response.set_etag(matched)
+        return response
+
+    body = json.dumps(build(), separators=(',', ':')).encode()
+    if encoding and len(body) >= MIN_COMPRESS_SIZE:
+        body = brotli.compress(body, quality=5) if encoding == 'br' else gzip.compress(body, compresslevel=6)
+        headers['Content-Encoding'] = encoding
+    else:
+        etag = digest
+    response = Response(body, mimetype='application/json', headers=headers)
+    response.set_etag(etag)
+    return response
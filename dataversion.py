@@ -0,0 +1,70 @@
+import datetime
+import itertools
+from sqlalchemy import event, select, insert, update
+from sqlalchemy.orm import Session
+from models import AccountBalance, Fund, MutualFundTransaction, FixedDeposit, CategoryRule, NavHistory, DataVersion
+
+# Tables whose changes invalidate derived data (chart series, analytics snapshots, compiled category rules, fund metrics)
+TRACKED_TABLES = {model.__tablename__ for model in (AccountBalance, Fund, MutualFundTransaction, FixedDeposit, CategoryRule, NavHistory)}
+
+def _record_change(session, table_name, rewrite):
+    # changed_tables maps table name -> whether existing rows were updated or deleted
+    if table_name in TRACKED_TABLES:
+        changed = session.info.setdefault('changed_tables', {})
+        changed[table_name] = changed.get(table_name, False) or rewrite
+
+def _record_flush(session, flush_context):
+    # new/dirty/deleted still hold the pre-flush state here
+    for instance in session.new:
+        _record_change(session, getattr(type(instance), '__tablename__', None), False)
+    for instance in itertools.chain(session.dirty, session.deleted):
+        _record_change(session, getattr(type(instance), '__tablename__', None), True)
+
+def _record_execute(orm_execute_state):
+    # Bulk insert/update/delete statements (bulkops, the fund upsert) bypass the flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table_name = getattr(getattr(orm_execute_state.statement, 'table', None), 'name', None)
+        _record_change(orm_execute_state.session, table_name, not orm_execute_state.is_insert)
+
+def _bump_versions(session):
+    session.flush() # Collects what the commit is about to flush
+    changed = session.info.pop('changed_tables', None)
+    if not changed:
+        return
+    connection = session.connection()
+    now = datetime.datetime.now()
+    for table_name, rewrite in sorted(changed.items()):
+        bumped = connection.execute(update(DataVersion.__table__).where(DataVersion.table_name == table_name)
+                                    .values(version=DataVersion.version + 1, rewritten=DataVersion.rewritten + int(rewrite), updated_at=now))
+        if not bumped.rowcount:
+            connection.execute(insert(DataVersion.__table__).values(table_name=table_name, version=1, rewritten=int(rewrite), updated_at=now))
+
+def _forget_changes(session):
+    session.info.pop('changed_tables', None)
+
+def track_data_versions():
+    """
+    Counts commits per tracked table in the data_version table, in the same transaction as the
+    change itself. Listens on the Session class, so every session is covered.
+    """
+    if event.contains(Session, 'before_commit', _bump_versions):
+        return
+    event.listen(Session, 'after_flush', _record_flush)
+    event.listen(Session, 'do_orm_execute', _record_execute)
+    event.listen(Session, 'before_commit', _bump_versions)
+    event.listen(Session, 'after_rollback', _forget_changes)
+
+def data_version_state(db_session, tables=TRACKED_TABLES):
+    """Returns {table name: {'version': n, 'rewritten': n}}; while 'rewritten' is unchanged the table only had rows appended."""
+    rows = db_session.execute(select(DataVersion.table_name, DataVersion.version, DataVersion.rewritten)
+                              .where(DataVersion.table_name.in_(sorted(tables)))).all()
+    state = {table_name: {'version': 0, 'rewritten': 0} for table_name in tables}
+    state.update({table_name: {'version': version, 'rewritten': rewritten} for table_name, version, rewritten in rows})
+    return state
+
+def data_versions(db_session, tables=TRACKED_TABLES):
+    """Returns {table name: version} for the given tables; tables never changed through a session are at 0."""
+    rows = db_session.execute(select(DataVersion.table_name, DataVersion.version).where(DataVersion.table_name.in_(sorted(tables)))).all()
+    versions = {table_name: 0 for table_name in tables}
+    versions.update({table_name: version for table_name, version in rows})
+    return versions
@@ -0,0 +1,200 @@
+"""
+How pages and static files reach the browser.
+
+  - Templates are compiled once and their bytecode kept in TEMPLATE_CACHE_DIR, so a new worker
+    loads base.html and the pages extending it without parsing and compiling them again.
+  - url_for('static', ...) adds ?v=<hash of the file's content>. A request carrying the current
+    hash is answered with a year-long immutable Cache-Control: the browser doesn't ask again until
+    the file changes, and its URL with it.
+  - HTML, CSS, JavaScript, JSON and SVG responses are compressed with brotli (when installed) or
+    gzip. Static files are compressed once per content hash and kept in memory.
+  - jQuery, DataTables and echarts are served from static/vendor once downloaded there by this
+    script. The bundles aren't in the repository: until this script has run, the pages load them
+    from their CDNs (a warning is logged at startup) and need a network connection.
+
+Setup, once per checkout (exits non-zero and names the file if any download fails):
+    python delivery.py             # download the missing VENDOR_ASSETS into static/vendor
+    python delivery.py --force     # download all of them again
+"""
+import argparse
+import gzip
+import hashlib
+import logging
+import os
+import sys
+import threading
+from flask import request, url_for
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.security import safe_join
+from charts import MIN_COMPRESS_SIZE, _accepted_encoding, brotli
+
+logger = logging.getLogger(__name__)
+
+VENDOR_DIR = 'vendor' # Under the static folder
+# Path under VENDOR_DIR -> where it is downloaded from (and served from until it is)
+VENDOR_ASSETS = {
+    'jquery-3.6.0.min.js': 'https://code.jquery.com/jquery-3.6.0.min.js',
+    'datatables-1.11.5/css/jquery.dataTables.css': 'https://cdn.datatables.net/1.11.5/css/jquery.dataTables.css',
+    'datatables-1.11.5/js/jquery.dataTables.js': 'https://cdn.datatables.net/1.11.5/js/jquery.dataTables.js',
+    # Sort arrows referenced by the stylesheet as ../images/
+    'datatables-1.11.5/images/sort_both.png': 'https://cdn.datatables.net/1.11.5/images/sort_both.png',
+    'datatables-1.11.5/images/sort_asc.png': 'https://cdn.datatables.net/1.11.5/images/sort_asc.png',
+    'datatables-1.11.5/images/sort_desc.png': 'https://cdn.datatables.net/1.11.5/images/sort_desc.png',
+    'datatables-1.11.5/images/sort_asc_disabled.png': 'https://cdn.datatables.net/1.11.5/images/sort_asc_disabled.png',
+    'datatables-1.11.5/images/sort_desc_disabled.png': 'https://cdn.datatables.net/1.11.5/images/sort_desc_disabled.png',
+    'echarts-5.4.3.min.js': 'https://cdn.jsdelivr.net/npm/echarts@5.4.3/dist/echarts.min.js',
+}
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+COMPRESSIBLE_TYPES = {'text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript',
+                      'application/json', 'image/svg+xml'}
+MAX_STATIC_COMPRESS_SIZE = 10 * 1024 * 1024
+DOWNLOAD_TIMEOUT = 60
+
+_digests = {} # path -> (mtime_ns, size, content hash)
+_compressed = {} # (path, content hash, encoding) -> compressed bytes
+_lock = threading.Lock()
+
+def static_digest(static_folder, filename):
+    """Short hash of a static file's content, recomputed only when its size or mtime changes; None if it doesn't exist."""
+    path = safe_join(static_folder, filename)
+    try:
+        stat = os.stat(path) if path else None
+    except OSError:
+        return None
+    if stat is None:
+        return None
+    cached = _digests.get(path)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    _digests[path] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+def compress(body, encoding, level=6):
+    """Compresses body with 'br' or 'gzip'; level runs from 1 (fastest) to 9 (smallest)."""
+    return brotli.compress(body, quality=level) if encoding == 'br' else gzip.compress(body, compresslevel=level)
+
+def _compressed_static(path, digest, encoding):
+    # Static files are compressed once, at the highest level, per content hash
+    key = (path, digest, encoding)
+    if key not in _compressed:
+        with open(path, 'rb') as f:
+            body = compress(f.read(), encoding, 9)
+        with _lock:
+            for stale in [k for k in _compressed if k[0] == path and k[1] != digest]:
+                del _compressed[stale]
+            _compressed[key] = body
+    return _compressed[key]
+
+def _set_body(response, body, encoding):
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    # The same validator now stands for a different byte sequence, so it can only be a weak one
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+def vendor_path(static_folder, name):
+    return os.path.join(static_folder, VENDOR_DIR, *name.split('/'))
+
+def init_delivery(app):
+    """Installs the template bytecode cache, static URL hashing, caching headers and compression on the app."""
+    missing = [name for name in VENDOR_ASSETS if not os.path.isfile(vendor_path(app.static_folder, name))]
+    if missing:
+        logger.warning(f"{len(missing)} vendored assets missing, so pages load them from their CDNs; "
+                       f"run python delivery.py to serve them locally")
+    if app.config.get('TEMPLATE_CACHE_DIR'):
+        os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+
+    @app.url_defaults
+    def add_static_digest(endpoint, values):
+        if endpoint == 'static' and 'v' not in values:
+            digest = static_digest(app.static_folder, values.get('filename', ''))
+            if digest:
+                values['v'] = digest
+
+    @app.template_global()
+    def vendor_url(name):
+        """URL of a VENDOR_ASSETS file: the local copy when it has been downloaded, the CDN otherwise."""
+        if os.path.isfile(vendor_path(app.static_folder, name)):
+            return url_for('static', filename=f"{VENDOR_DIR}/{name}")
+        return VENDOR_ASSETS[name]
+
+    @app.after_request
+    def deliver(response):
+        if response.status_code not in (200, 304) or 'Content-Encoding' in response.headers:
+            return response
+        static = request.endpoint == 'static'
+        if static:
+            # A 304 for ?v=<hash> carries the immutable headers too, or the browser falls back to no-cache
+            filename = request.view_args.get('filename', '')
+            digest = static_digest(app.static_folder, filename)
+            if digest and request.args.get('v') == digest:
+                response.cache_control.no_cache = False
+                response.cache_control.public = True
+                response.cache_control.max_age = IMMUTABLE_MAX_AGE
+                response.cache_control.immutable = True
+        if response.mimetype not in COMPRESSIBLE_TYPES:
+            return response
+        response.vary.add('Accept-Encoding')
+        if response.status_code != 200:
+            return response
+        encoding = _accepted_encoding()
+        if encoding is None:
+            return response
+        if static:
+            size = response.content_length
+            if digest and size and MIN_COMPRESS_SIZE <= size <= MAX_STATIC_COMPRESS_SIZE and 'Range' not in request.headers:
+                body = _compressed_static(safe_join(app.static_folder, filename), digest, encoding)
+                response.close()
+                response.direct_passthrough = False
+                _set_body(response, body, encoding)
+        elif not response.is_streamed and not response.direct_passthrough:
+            body = response.get_data()
+            if len(body) >= MIN_COMPRESS_SIZE:
+                _set_body(response, compress(body, encoding), encoding)
+        return response
+
+def download_vendor_assets(static_folder, force=False):
+    """Downloads VENDOR_ASSETS into static_folder/VENDOR_DIR. Returns the names downloaded."""
+    import requests
+    downloaded = []
+    for name, url in VENDOR_ASSETS.items():
+        path = vendor_path(static_folder, name)
+        if os.path.isfile(path) and not force:
+            continue
+        try:
+            response = requests.get(url, timeout=DOWNLOAD_TIMEOUT)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise RuntimeError(f"Could not download {VENDOR_DIR}/{name} from {url}: {e}") from e
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written to a temporary file and renamed so a running server never serves a partial file
+        with open(path + '.tmp', 'wb') as f:
+            f.write(response.content)
+        os.replace(path + '.tmp', path)
+        downloaded.append(name)
+    return downloaded
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Download the JavaScript and CSS libraries the pages use, to serve them locally.')
+    parser.add_argument('--force', action='store_true', help='download files that are already there again')
+    args = parser.parse_args(argv)
+
+    from app import create_app
+    app = create_app()
+    try:
+        downloaded = download_vendor_assets(app.static_folder, args.force)
+    except RuntimeError as e:
+        missing = [name for name in VENDOR_ASSETS if not os.path.isfile(vendor_path(app.static_folder, name))]
+        print(f"{e}\n{len(missing)} of {len(VENDOR_ASSETS)} files are still missing; pages load them from their CDNs", file=sys.stderr)
+        return 1
+    for name in downloaded:
+        print(f"{VENDOR_DIR}/{name}")
+    print(f"{len(downloaded)} of {len(VENDOR_ASSETS)} files downloaded into {os.path.join(app.static_folder, VENDOR_DIR)}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import datetime
+import numpy as np
+
+# Interest is compounded this many times a year; 0 means simple interest
+COMPOUNDING_PERIODS = {'simple': 0, 'monthly': 12, 'quarterly': 4, 'half-yearly': 2, 'yearly': 1}
+DEFAULT_COMPOUNDING = 'quarterly'
+DAYS_IN_YEAR = 365
+FINANCIAL_YEAR_START_MONTH = 4 # Indian financial year runs April to March
+
+def _to_days(values):
+    """Converts a date, datetime or sequence of them to a datetime64[D] array (None becomes NaT)."""
+    if isinstance(values, (datetime.date, datetime.datetime)) or values is None:
+        values = [values]
+    return np.array([v.date() if isinstance(v, datetime.datetime) else v for v in values], dtype='datetime64[D]')
+
+def add_months(dates, months):
+    """
+    Adds whole calendar months to datetime64[D] dates, clamping to the end of shorter months
+    (31 Jan + 1 month = 28/29 Feb). Both arguments broadcast against each other.
+    """
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    month_start = dates.astype('datetime64[M]')
+    day_offset = dates - month_start.astype('datetime64[D]')
+    target_month = month_start + np.asarray(months).astype('timedelta64[M]')
+    target_start = target_month.astype('datetime64[D]')
+    month_length = (target_month + np.timedelta64(1, 'M')).astype('datetime64[D]') - target_start
+    return target_start + np.minimum(day_offset, month_length - np.timedelta64(1, 'D'))
+
+def months_between(start, end):
+    """Returns the number of completed calendar months from start to end."""
+    start = np.asarray(start, dtype='datetime64[D]')
+    end = np.asarray(end, dtype='datetime64[D]')
+    months = end.astype('datetime64[M]').astype(np.int64) - start.astype('datetime64[M]').astype(np.int64)
+    return months - (add_months(start, months) > end)
+
+def maturity_date(start_date, duration, duration_unit):
+    """Returns the maturity date for a deposit of the given duration, using exact calendar months."""
+    if duration_unit == 'years':
+        months = duration * 12
+    elif duration_unit == 'months':
+        months = duration
+    elif duration_unit == 'days':
+        return start_date + datetime.timedelta(days=duration)
+    else:
+        raise ValueError(f"Invalid duration unit: {duration_unit}")
+    maturity = add_months(_to_days(start_date), months)[0].astype(datetime.date)
+    return datetime.datetime.combine(maturity, datetime.time())
+
+def value_at(principal, rate, start, end, periods_per_year, at):
+    """
+    Returns the value of deposits on date `at`, with all arguments as broadcastable arrays.
+    Interest is compounded on whole calendar periods from the start date; the running partial period
+    earns simple interest, as banks do. Dates outside [start, end] are clamped to it.
+    """
+    at = np.minimum(np.maximum(at, start), end)
+    rate = np.asarray(rate, dtype=float) / 100
+    simple = periods_per_year == 0
+    periods = np.where(simple, 1, periods_per_year)
+    months_per_period = 12 // periods
+    completed = np.where(simple, 0, months_between(start, at) // months_per_period)
+    period_start = add_months(start, completed * months_per_period)
+    remaining_days = (at - period_start).astype(np.int64)
+    compounded = np.where(simple, 1.0, (1 + rate / periods) ** completed)
+    return principal * compounded * (1 + rate * remaining_days / DAYS_IN_YEAR)
+
+def financial_year_label(year):
+    """Returns the label of the financial year starting in April of `year`, e.g. FY2024-25."""
+    return f"FY{year}-{(year + 1) % 100:02d}"
+
+def compute_fixed_deposits(fixed_deposits, as_of=None):
+    """
+    Computes accrued value, maturity value and interest per financial year for all deposits at once.
+    A deposit stops accruing on its closure date, or on its maturity date if it has not been closed.
+    Returns a dict of arrays aligned with `fixed_deposits`:
+        'current_value': value on as_of (defaults to today),
+        'accrued_interest': current_value minus principal,
+        'maturity_value': value on the maturity (or closure) date,
+        'interest_by_fy': dict of financial year label -> array of interest earned in that year
+    """
+    as_of = _to_days(as_of or datetime.date.today())[0]
+    if not fixed_deposits:
+        empty = np.zeros(0)
+        return {'current_value': empty, 'accrued_interest': empty, 'maturity_value': empty, 'interest_by_fy': {}}
+
+    principal = np.array([fd.amount for fd in fixed_deposits], dtype=float)
+    rate = np.array([fd.interest_rate for fd in fixed_deposits], dtype=float)
+    periods_per_year = np.array([COMPOUNDING_PERIODS.get(fd.compounding or DEFAULT_COMPOUNDING, COMPOUNDING_PERIODS[DEFAULT_COMPOUNDING])
+                                 for fd in fixed_deposits])
+    start = _to_days([fd.start_date for fd in fixed_deposits])
+    maturity = _to_days([fd.maturity_date for fd in fixed_deposits])
+    closure = _to_days([fd.closure_date for fd in fixed_deposits])
+    end = np.where(np.isnat(closure), maturity, closure)
+
+    current_value = value_at(principal, rate, start, end, periods_per_year, as_of)
+    maturity_value = value_at(principal, rate, start, end, periods_per_year, end)
+
+    # Value at every financial year boundary, as an (deposits x boundaries) matrix
+    first_year = start.min().astype('datetime64[Y]').astype(int) + 1970 - 1
+    last_year = end.max().astype('datetime64[Y]').astype(int) + 1970 + 1
+    boundaries = np.array([f"{year}-{FINANCIAL_YEAR_START_MONTH:02d}-01" for year in range(first_year, last_year + 1)], dtype='datetime64[D]')
+    boundary_values = value_at(principal[:, None], rate[:, None], start[:, None], end[:, None], periods_per_year[:, None], boundaries[None, :])
+    yearly_interest = np.diff(boundary_values, axis=1)
+    interest_by_fy = {financial_year_label(year): yearly_interest[:, i]
+                      for i, year in enumerate(range(first_year, last_year)) if yearly_interest[:, i].any()}
+
+    return {
+        'current_value': current_value,
+        'accrued_interest': current_value - principal,
+        'maturity_value': maturity_value,
+        'interest_by_fy': interest_by_fy,
+    }
+
+def maturity_ladder(fixed_deposits, maturity_values):
+    """
+    Groups deposits that are still open by maturity month.
+    Returns a list of dicts with 'month', 'count', 'principal' and 'maturity_value', sorted by month.
+    """
+    open_mask = np.array([fd.status != 'closed' for fd in fixed_deposits], dtype=bool)
+    if not open_mask.any():
+        return []
+    months = _to_days([fd.maturity_date for fd in fixed_deposits])[open_mask].astype('datetime64[M]')
+    principal = np.array([fd.amount for fd in fixed_deposits], dtype=float)[open_mask]
+    unique_months, inverse = np.unique(months, return_inverse=True)
+    counts = np.bincount(inverse)
+    principal_sums = np.bincount(inverse, weights=principal)
+    maturity_sums = np.bincount(inverse, weights=np.asarray(maturity_values, dtype=float)[open_mask])
+    return [{'month': str(month), 'count': int(count), 'principal': float(p), 'maturity_value': float(m)}
+            for month, count, p, m in zip(unique_months, counts, principal_sums, maturity_sums)]
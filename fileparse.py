@@ -1,132 +1,423 @@
 import pandas as pd
-import tabula
-import PyPDF2
-from models import AccountBalance, Fund, MutualFundTransaction
+# tabula (which starts a JVM) and PyPDF2 are only imported once a PDF is processed
+from models import AccountBalance, Fund, MutualFundTransaction, IngestionWatermark
 import datetime
+import hashlib
 from fuzzywuzzy import process
 import json
-import requests
 import io
+import logging
 import tempfile
 import os
 from sqlalchemy.orm import scoped_session, sessionmaker, declarative_base
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, func, or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from tracing import span, start_trace, save_import_run
+from cache import shared_cache
+from categorizer import load_categorizer
+from reconcile import check_new_balances, describe
+from mfapi import mfapi
+
+logger = logging.getLogger(__name__)
 
 # Assuming DATABASE_URI and engine/db_session setup might be needed here if not passed
 # or if these functions are called independently. For now, keeping minimal imports.
 
+MUTUAL_FUNDS_SHEET = 'SWASTIK_9469790'
+
+# Columns hashed into the row fingerprint stored in the ingestion watermark, per source format
+MF_XLSX_FINGERPRINT_COLUMNS = ['Trade Date', 'Investment name', 'Buy units', 'Sell units', 'Dividend reinvested units']
+BALANCE_XLSX_FINGERPRINT_COLUMNS = ['Date', 'Narration', 'Chq./Ref.No.', 'Withdrawal Amt.', 'Deposit Amt.', 'Closing Balance']
+ICICI_PDF_FINGERPRINT_COLUMNS = ['Date', 'Description', 'Amount', 'Type']
+CAMS_PDF_FINGERPRINT_COLUMNS = ['Date', 'Description', 'Amount', 'Units', 'NAV']
+# mfapi.in publishes NAVs once a day, so fetched NAVs are shared between workers for a few hours
+NAV_CACHE_TTL = 6 * 60 * 60
+# Decrypted copies of uploaded PDFs are written to the temp directory with this prefix, so the
+# maintenance scheduler can remove the ones an interrupted import left behind
+TEMP_PREFIX = 'finapp-'
+
 def process_pdf(filepath, password=None):
     """
     Opens and decrypts a PDF file if password protected.
     Saves the decrypted content to a temporary file and returns its path, or None if an error occurs.
     """
-    try:
-        pdf_file = open(filepath, 'rb')
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-
-        if pdf_reader.is_encrypted:
-            if password:
-                if pdf_reader.decrypt(password):
-                    print(f"PDF '{filepath}' decrypted successfully.")
+    import PyPDF2
+    with span('decrypt', file=os.path.basename(filepath)) as record:
+        try:
+            pdf_file = open(filepath, 'rb')
+            pdf_reader = PyPDF2.PdfReader(pdf_file)
+
+            if pdf_reader.is_encrypted:
+                if password:
+                    if pdf_reader.decrypt(password):
+                        logger.info(f"PDF '{filepath}' decrypted successfully.")
+                    else:
+                        logger.warning(f"Incorrect password for PDF '{filepath}'.")
+                        pdf_file.close()
+                        return None
                 else:
-                    print(f"Incorrect password for PDF '{filepath}'.")
+                    logger.warning(f"PDF '{filepath}' is password protected. No password provided.")
                     pdf_file.close()
                     return None
-            else:
-                print(f"PDF '{filepath}' is password protected. No password provided.")
-                pdf_file.close()
-                return None
-
-        # If decrypted or not encrypted, save to a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-            output_pdf = PyPDF2.PdfWriter()
-            for page_num in range(len(pdf_reader.pages)):
-                output_pdf.add_page(pdf_reader.pages[page_num])
-            output_pdf.write(tmp_file)
-            temp_filepath = tmp_file.name
-
-        pdf_file.close()
-        return temp_filepath
-
-    except FileNotFoundError:
-        print(f"Error: File not found at {filepath}")
-        return None
-    except Exception as e:
-        print(f"Error processing PDF file {filepath}: {e}")
-        return None
+
+            # If decrypted or not encrypted, save to a temporary file
+            with tempfile.NamedTemporaryFile(delete=False, prefix=TEMP_PREFIX, suffix=".pdf") as tmp_file:
+                output_pdf = PyPDF2.PdfWriter()
+                for page_num in range(len(pdf_reader.pages)):
+                    output_pdf.add_page(pdf_reader.pages[page_num])
+                output_pdf.write(tmp_file)
+                temp_filepath = tmp_file.name
+            record['pages'] = len(pdf_reader.pages)
+
+            pdf_file.close()
+            return temp_filepath
+
+        except FileNotFoundError:
+            logger.error(f"Error: File not found at {filepath}")
+            return None
+        except Exception as e:
+            logger.error(f"Error processing PDF file {filepath}: {e}")
+            return None
 
 def load_fund_codes(cache_file='fund_mapping_cache.json'):
     fund_code_mapping = {}
 
-    try:
-        with open(cache_file, 'r') as f:
-            fund_code_mapping = json.load(f)
-            print(f"Loaded {len(fund_code_mapping)} fund mappings from cache.")
-            return fund_code_mapping
-    except (FileNotFoundError, json.JSONDecodeError):
-        print("No valid cache found. Fetching from API...")
-
-    try:
-        # Fetch the list of all mutual funds
-        response = requests.get("https://api.mfapi.in/mf")
-
-        if response.status_code == 200:
-            funds_data = response.json()
-            total_funds = len(funds_data)
-            print(f"Found {total_funds} funds. Processing...")
-
-            # Process each fund - get scheme code and name
-            for i, fund in enumerate(funds_data):
-                if i % 100 == 0:
-                    print(f"Processed {i}/{total_funds} funds...")
-
-                scheme_code = fund.get("schemeCode")
-                scheme_name = fund.get("schemeName", "").strip().lower()
-
-                if scheme_code and scheme_name:
-                    fund_code_mapping[scheme_name] = str(scheme_code)
-
-                    # Also add a version without the dash format to improve matching
-                    if " - " in scheme_name:
-                        no_dash_name = scheme_name.replace(" - ", " ")
-                        fund_code_mapping[no_dash_name] = str(scheme_code)
-
-            # Cache the results
-            try:
-                with open(cache_file, 'w') as f:
-                    json.dump(fund_code_mapping, f)
-                print(f"Cached {len(fund_code_mapping)} fund mappings.")
-            except Exception as e:
-                print(f"Warning: Could not save cache: {e}")
+    with span('match', step='load_fund_codes') as record:
+        try:
+            with open(cache_file, 'r') as f:
+                fund_code_mapping = json.load(f)
+                record['rows'] = len(fund_code_mapping)
+                record['source'] = 'cache'
+                return fund_code_mapping
+        except (FileNotFoundError, json.JSONDecodeError):
+            logger.info("No valid cache found. Fetching from API...")
+
+        record['source'] = 'api'
+        try:
+            # Fetch the list of all mutual funds
+            response = mfapi.get("mf")
+
+            if response.status_code == 200:
+                funds_data = response.json()
+
+                # Process each fund - get scheme code and name
+                for fund in funds_data:
+                    scheme_code = fund.get("schemeCode")
+                    scheme_name = fund.get("schemeName", "").strip().lower()
+
+                    if scheme_code and scheme_name:
+                        fund_code_mapping[scheme_name] = str(scheme_code)
+
+                        # Also add a version without the dash format to improve matching
+                        if " - " in scheme_name:
+                            no_dash_name = scheme_name.replace(" - ", " ")
+                            fund_code_mapping[no_dash_name] = str(scheme_code)
+
+                # Cache the results; written to a temporary file and renamed so other workers never read a partial file
+                try:
+                    with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(os.path.abspath(cache_file)), suffix='.tmp', delete=False) as f:
+                        json.dump(fund_code_mapping, f)
+                    os.replace(f.name, cache_file)
+                except Exception as e:
+                    logger.warning(f"Could not save cache: {e}")
 
-        else:
-            print(f"API request failed with status code: {response.status_code}")
+            else:
+                logger.error(f"API request failed with status code: {response.status_code}")
 
-    except Exception as e:
-        print(f"Error fetching fund codes from API: {e}")
+        except Exception as e:
+            logger.error(f"Error fetching fund codes from API: {e}")
 
+        record['rows'] = len(fund_code_mapping)
     return fund_code_mapping
 
 def fetch_current_nav(fund_code):
-    """Fetches the current NAV for a given fund code."""
+    """Fetches the current NAV for a given fund code, using the shared cache when the web app has configured one."""
     if not fund_code:
         return None
 
+    cached_nav = shared_cache.get(f"nav:{fund_code}")
+    if cached_nav is not None:
+        return cached_nav
     try:
-        response = requests.get(f"https://api.mfapi.in/mf/{fund_code}")
+        response = mfapi.get(f"mf/{fund_code}")
         if response.status_code == 200:
             data = response.json()
             if 'data' in data and data['data']:
                 # The latest NAV is the first entry in the 'data' list
                 latest_data = data['data'][0]
-                return float(latest_data.get('nav'))
+                nav = float(latest_data.get('nav'))
+                shared_cache.set(f"nav:{fund_code}", nav, ttl=NAV_CACHE_TTL)
+                return nav
         else:
-            print(f"Error fetching NAV for fund code {fund_code}: Status code {response.status_code}")
+            logger.warning(f"Error fetching NAV for fund code {fund_code}: Status code {response.status_code}")
     except Exception as e:
-        print(f"Error fetching NAV for fund code {fund_code}: {e}")
+        logger.warning(f"Error fetching NAV for fund code {fund_code}: {e}")
 
     return None
 
+def resolve_fund_code(fund_name, fund_code_mapping):
+    """Returns the scheme code for a fund name, trying an exact (case-insensitive) match before fuzzy matching."""
+    fund_code = fund_code_mapping.get(fund_name.lower())
+    if not fund_code and fund_code_mapping:
+        best_match, score = process.extractOne(fund_name.lower(), fund_code_mapping.keys())
+        if score > 80:  # Use a threshold, e.g., 80
+            fund_code = fund_code_mapping.get(best_match)
+            logger.debug(f"Fuzzy matched '{fund_name}' to '{best_match}' with score {score}. Using code {fund_code}")
+        else:
+            logger.warning(f"Fund code not found for '{fund_name}' and no good fuzzy match found (best match: '{best_match}', score: {score})")
+    return fund_code
+
+def sync_funds(db_session, fund_names, fund_code_mapping, commit_changes=True):
+    """
+    Brings the Fund table up to date for the funds in an import.
+    Existing funds are prefetched in one IN query, codes and NAVs are resolved once per fund,
+    and all inserts/updates are applied as a single bulk upsert on fund_name.
+    Returns a dict of fund name -> Fund; when commit_changes is False nothing is written: new funds,
+    and existing ones with a fresh NAV, are returned as transient objects carrying it.
+    """
+    fund_names = list(dict.fromkeys(name for name in fund_names if isinstance(name, str) and name))
+    with span('match', step='resolve_fund_codes') as record:
+        fund_codes = {name: resolve_fund_code(name, fund_code_mapping) for name in fund_names}
+        existing_funds = db_session.query(Fund).filter(or_(Fund.fund_name.in_(fund_names),
+                                                           Fund.fund_code.in_([code for code in fund_codes.values() if code]))).all()
+        funds_by_name = {fund.fund_name: fund for fund in existing_funds}
+        claimed_codes = {fund.fund_code: fund.fund_name for fund in existing_funds}
+
+        matched = {}
+        for fund_name in fund_names:
+            fund_entry = funds_by_name.get(fund_name)
+            fund_code = fund_entry.fund_code if fund_entry and fund_entry.fund_code else fund_codes[fund_name]
+            if not fund_code:
+                logger.warning(f"Skipping fund '{fund_name}': no fund code")
+                continue
+            if fund_entry is None and claimed_codes.get(fund_code, fund_name) != fund_name:
+                logger.warning(f"Skipping fund '{fund_name}': code {fund_code} already belongs to '{claimed_codes[fund_code]}'")
+                continue
+            claimed_codes[fund_code] = fund_name
+            matched[fund_name] = fund_code
+        record['rows'] = len(matched)
+
+    # Fetch each scheme's NAV once, even if several fund names map to it
+    with span('nav_fetch') as record:
+        navs = {code: fetch_current_nav(code) for code in dict.fromkeys(matched.values())}
+        record['rows'] = len(navs)
+        record['failed'] = sum(1 for nav in navs.values() if nav is None)
+
+    upsert_rows = []
+    now = datetime.datetime.now()
+    for fund_name, fund_code in matched.items():
+        current_nav = navs[fund_code]
+        fund_entry = funds_by_name.get(fund_name)
+        if fund_entry is None:
+            fund_entry = Fund(fund_name=fund_name, fund_code=fund_code)
+            funds_by_name[fund_name] = fund_entry
+        elif current_nav is not None and not commit_changes:
+            # A copy carries the previewed NAV: a dirtied stored row would be written by a later commit() in this session
+            fund_entry = Fund(fund_name=fund_name, fund_code=fund_entry.fund_code, current_nav=fund_entry.current_nav,
+                              last_updated=fund_entry.last_updated)
+            funds_by_name[fund_name] = fund_entry
+        if current_nav is not None and not commit_changes:
+            fund_entry.current_nav = current_nav
+            fund_entry.last_updated = now
+        upsert_rows.append({'fund_name': fund_name, 'fund_code': fund_code, 'current_nav': current_nav,
+                            'last_updated': now if current_nav is not None else None})
+
+    if commit_changes and upsert_rows:
+        with span('insert', table='funds') as record:
+            stmt = sqlite_insert(Fund)
+            stmt = stmt.on_conflict_do_update(index_elements=[Fund.fund_name], set_={
+                'current_nav': func.coalesce(stmt.excluded.current_nav, Fund.current_nav),
+                'last_updated': func.coalesce(stmt.excluded.last_updated, Fund.last_updated),
+            })
+            db_session.execute(stmt, upsert_rows)
+            funds_by_name = {fund.fund_name: fund for fund in
+                             db_session.query(Fund).filter(Fund.fund_name.in_(fund_names)).populate_existing().all()}
+            record['rows'] = len(upsert_rows)
+    return funds_by_name
+
+def skip_unsynced_funds(df, column, funds):
+    """
+    Drops the rows of funds missing from the sync_funds map (no fund code, or a code owned by another fund).
+    Returns the kept rows and a dict of fund name -> rows dropped.
+    """
+    synced = df[column].isin(list(funds))
+    skipped = df.loc[~synced, column].value_counts(sort=False).to_dict()
+    for fund_name, count in skipped.items():
+        logger.warning(f"Skipping {count} transactions of '{fund_name}': the fund could not be added")
+    return df[synced], skipped
+
+def fingerprint_row(row, columns):
+    """Returns a stable hash of the given columns of a statement row, used to find the row again on the next import."""
+    values = []
+    for column in columns:
+        value = row.get(column)
+        values.append('' if value is None or pd.isna(value) else str(value))
+    return hashlib.sha1('|'.join(values).encode('utf-8')).hexdigest()
+
+def load_watermarks(db_session, source_format):
+    """Returns a dict of account -> IngestionWatermark for a source format, fetched in a single query."""
+    watermarks = db_session.query(IngestionWatermark).filter_by(source_format=source_format).all()
+    return {watermark.account: watermark for watermark in watermarks}
+
+def update_watermark(db_session, source_format, account, last_row, date_column, fingerprint_columns, closing_balance=None, watermark=None):
+    """
+    Moves the watermark of a source/account pair to last_row.
+    The watermark is only added to the session, so it is committed atomically with the imported rows.
+    """
+    if watermark is None:
+        watermark = IngestionWatermark(source_format=source_format, account=account)
+        db_session.add(watermark)
+    watermark.last_date = pd.Timestamp(last_row[date_column]).to_pydatetime()
+    watermark.row_fingerprint = fingerprint_row(last_row, fingerprint_columns)
+    watermark.closing_balance = float(closing_balance) if closing_balance is not None else None
+    watermark.updated_at = datetime.datetime.now()
+    return watermark
+
+def new_rows_after_watermark(df, date_column, watermark, fingerprint_columns, latest_date=None):
+    """
+    Returns the tail of df that has not been imported yet. df must be sorted by date_column.
+    The tail is located with a binary search on the date column; rows on the watermark date itself
+    are kept only if they come after the fingerprinted row. Without a watermark, rows strictly after
+    latest_date (the last date already in the database) are returned.
+    """
+    dates = df[date_column]
+    if watermark is None:
+        if latest_date is None:
+            return df
+        return df.iloc[dates.searchsorted(pd.Timestamp(latest_date), side='right'):]
+
+    last_date = pd.Timestamp(watermark.last_date)
+    start = dates.searchsorted(last_date, side='left')
+    end = dates.searchsorted(last_date, side='right')
+    if watermark.row_fingerprint:
+        for offset, (index, row) in enumerate(df.iloc[start:end].iterrows()):
+            if fingerprint_row(row, fingerprint_columns) == watermark.row_fingerprint:
+                return df.iloc[start + offset + 1:]
+    return df.iloc[end:]
+
+
+def mf_xlsx_transaction(row):
+    """
+    Turns a row of the mutual fund workbook into MutualFundTransaction fields, or None when it
+    records no buy, sell or dividend reinvestment. The NAV is derived from the amount and units.
+    """
+    transaction_type = None
+    amount = 0.0
+    units = 0.0
+
+    if row.get('Buy units', 0) > 0:
+        transaction_type = 'Buy'
+        units = row['Buy units']
+        amount = row.get('Cash inflow', 0)
+    elif row.get('Sell units', 0) > 0:
+        transaction_type = 'Sell'
+        units = row['Sell units']
+        amount = row.get('Cash outflow', 0)
+    elif row.get('Dividend reinvested units', 0) > 0:
+        transaction_type = 'Buy'  # Reinvestment is a form of buying units
+        units = row['Dividend reinvested units']
+        amount = row.get('Dividend Amount', 0)
+
+    if not transaction_type:
+        return None
+    calculated_nav = 0.0
+    if units != 0:
+        # Use absolute value of amount for NAV calculation for sell transactions
+        nav_amount = abs(amount) if transaction_type == 'Sell' else amount
+        calculated_nav = nav_amount / units
+    return {'fund_name': row['Investment name'], 'transaction_type': transaction_type, 'amount': amount,
+            'units': units, 'nav': calculated_nav, 'timestamp': row['Trade Date']}
+
+def cams_frame(tables):
+    """
+    Joins the transaction tables among the tables tabula read from a CAMS statement, one per page
+    with the header repeated on each, and returns them with parsed dates and amounts, sorted by
+    date. Raises ValueError when there is none.
+    """
+    frames = []
+    for df in tables:
+        # Look for DataFrames that contain columns indicative of transactions
+        # This is a heuristic and might need adjustment
+        # Tables are read without a header, so the column names show up in the first row
+        header_values = set(df.columns.astype(str)) | (set(df.iloc[0].astype(str)) if not df.empty else set())
+        if any(col in header_values for col in ['Date', 'Description', 'Amount', 'Units', 'NAV']):
+            df = df.copy()
+            # Assuming column mapping based on common CAMS formats
+            # This will likely need to be adjusted based on actual file examples
+            df.columns = ['Date', 'Description', 'Amount', 'Units', 'NAV', 'Balance'] # Example columns
+            frames.append(df)
+
+    if not frames:
+        raise ValueError("Could not find transaction data in CAMS PDF.")
+    # The header rows of the pages are dropped with the other rows without a date below
+    mutual_funds_df = pd.concat(frames, ignore_index=True)
+
+    # Convert Date column to datetime objects
+    mutual_funds_df['Date'] = pd.to_datetime(mutual_funds_df['Date'], errors='coerce')
+
+    # Filter out rows with invalid dates or headers
+    mutual_funds_df.dropna(subset=['Date'], inplace=True)
+    for column in ['Amount', 'Units', 'NAV']:
+        mutual_funds_df[column] = pd.to_numeric(mutual_funds_df[column].astype(str).str.replace(',', ''), errors='coerce').fillna(0)
+    return mutual_funds_df.sort_values('Date', kind='stable')
+
+def cams_transaction(row):
+    """Turns a row of a CAMS statement (see cams_frame) into MutualFundTransaction fields."""
+    fund_name = row['Description'] # Assuming Description contains fund name
+    amount = row['Amount']
+    units = row['Units']
+
+    # Determine transaction type (Buy, Sell, Dividend, etc.)
+    # This is a simplification and might need more sophisticated logic
+    transaction_type = 'Unknown'
+    if amount > 0 and units > 0:
+        transaction_type = 'Buy'
+    elif amount < 0 and units < 0:
+         transaction_type = 'Sell'
+    elif "dividend" in str(fund_name).lower():
+         transaction_type = 'Dividend'
+    return {'fund_name': fund_name, 'transaction_type': transaction_type, 'amount': amount,
+            'units': units, 'nav': row['NAV'], 'timestamp': row['Date']}
+
+def balance_xlsx_entry(row, category):
+    """Turns a row of an account balances workbook into AccountBalance fields."""
+    return {'bank': row['Bank'], 'closing_balance': row['Closing Balance'], 'date': row['Date'], 'narration': row['Narration'],
+            'chq_ref_no': row['Chq./Ref.No.'], 'withdrawal_amt': row['Withdrawal Amt.'], 'deposit_amt': row['Deposit Amt.'],
+            'category': category}
+
+def icici_frame(tables, columns):
+    """
+    Joins the tables tabula read from an ICICI statement, every page read without a header, under
+    the column names of the first page's header (which shows up as the first row), and returns
+    them with parsed dates and amounts, sorted by date.
+    """
+    df1 = pd.DataFrame()
+    for sdf in tables:
+        sdf.columns = columns
+        df1 = pd.concat([df1, sdf], ignore_index=True)
+    df1 = df1[1:]
+    df1['Date'] = pd.to_datetime(df1['Date'], format='%d-%m-%Y')
+    # Clean 'Amount' column: remove commas, currency symbols, etc., keep only digits, decimal point, and leading minus
+    df1['Amount'] = df1['Amount'].astype(str).str.replace(r'[^\d.-]', '', regex=True)
+    # Convert to numeric, coercing errors to NaN, then fill NaN with 0 for safety before arithmetic
+    df1['Amount'] = pd.to_numeric(df1['Amount'], errors='coerce').fillna(0)
+    return df1.sort_values('Date', ascending=True, kind='stable')
+
+def icici_entry(row):
+    """Turns a row of an ICICI statement (see icici_frame, with its running Balance and Category) into AccountBalance fields."""
+    credit = row['Type'] == 'CR'
+    return {'bank': 'ICICI', 'date': row['Date'], 'narration': row['Description'],
+            'withdrawal_amt': 0 if credit else row['Amount'], 'deposit_amt': row['Amount'] if credit else 0,
+            'closing_balance': row['Balance'], 'category': row['Category']}
+
+def reconcile_new_balances(db_session, new_account_balances):
+    """Checks that the account balances about to be imported follow on from the stored ones, logging what doesn't."""
+    with span('reconcile', table='account_balances') as record:
+        report = check_new_balances(db_session, new_account_balances)
+        record['rows'] = report['rows']
+    for line in describe(report):
+        logger.warning(line)
+    return report
 
 def process_excel_data(db_session, mutual_funds_filepath, account_balances_filepath, password=None, commit_changes=True):
     """
@@ -137,14 +428,29 @@ def process_excel_data(db_session, mutual_funds_filepath, account_balances_filep
         'new_mutual_fund_transactions': list of new MutualFundTransaction entries to be added,
         'last_account_balances': list of last few AccountBalance entries,
         'new_account_balances': list of new AccountBalance entries to be added,
+        'funds': dict of fund name -> Fund for the funds in the mutual funds file,
         'error': error message if any,
         'success': boolean indicating success
+    Every run is traced stage by stage (decrypt, extract, parse, match, nav_fetch, insert, commit)
+    and recorded in the import_run table.
     """
+    files = [os.path.basename(path) for path in (mutual_funds_filepath, account_balances_filepath) if path]
+    with start_trace('process_excel_data', files=files, mode='commit' if commit_changes else 'preview') as trace:
+        result = _process_excel_data(db_session, mutual_funds_filepath, account_balances_filepath, password, commit_changes)
+        rows = len(result.get('new_mutual_fund_transactions', [])) + len(result.get('new_account_balances', []))
+        trace.finish(result.get('error'), rows=rows)
+    save_import_run(db_session.get_bind(), trace)
+    return result
+
+def _process_excel_data(db_session, mutual_funds_filepath, account_balances_filepath, password, commit_changes):
+    """Implementation of process_excel_data, run inside its import trace."""
     result = {
         'last_mutual_fund_transactions': [],
         'new_mutual_fund_transactions': [],
         'last_account_balances': [],
         'new_account_balances': [],
+        'funds': {},
+        'skipped_funds': {},
         'error': None,
         'success': False
     }
@@ -159,102 +465,60 @@ def process_excel_data(db_session, mutual_funds_filepath, account_balances_filep
             if file_extension == 'xlsx':
                 try:
                     # Read Mutual Fund Transactions from Excel
-                    mutual_funds_xls = pd.ExcelFile(mutual_funds_filepath, engine='openpyxl')
-                    mutual_funds_df = mutual_funds_xls.parse('SWASTIK_9469790', skiprows=3)  # Read from the specified sheet name and skip header rows
-                    mutual_funds_df['Trade Date'] = pd.to_datetime(mutual_funds_df['Trade Date'])
+                    with span('extract', file=os.path.basename(mutual_funds_filepath)) as record:
+                        mutual_funds_xls = pd.ExcelFile(mutual_funds_filepath, engine='openpyxl')
+                        mutual_funds_df = mutual_funds_xls.parse(MUTUAL_FUNDS_SHEET, skiprows=3)  # Read from the specified sheet name and skip header rows
+                        record['rows'] = len(mutual_funds_df)
+                    with span('parse') as record:
+                        mutual_funds_df['Trade Date'] = pd.to_datetime(mutual_funds_df['Trade Date'])
+                        mutual_funds_df = mutual_funds_df.sort_values('Trade Date', kind='stable')
+                        record['rows'] = len(mutual_funds_df)
                     fund_code_mapping = load_fund_codes()
-                    unique_fund_names = mutual_funds_df['Investment name'].unique()
-
-                    for fund_name in unique_fund_names:
-                        fund_code = fund_code_mapping.get(fund_name.lower())  # Get fund code from mapping (case-insensitive)
-
-                        if not fund_code:
-                            # If direct match not found, try fuzzy matching
-                            best_match, score = process.extractOne(fund_name.lower(), fund_code_mapping.keys())
-                            if score > 80:  # Use a threshold, e.g., 80
-                                fund_code = fund_code_mapping.get(best_match)
-                                print(f"Fuzzy matched '{fund_name}' to '{best_match}' with score {score}. Using code {fund_code}")
-                            else:
-                                print(f"Fund code not found for '{fund_name}' and no good fuzzy match found (best match: '{best_match}', score: {score})")
-
-                        # Add or update the Fund table
-                        fund_entry = db_session.query(Fund).filter_by(fund_name=fund_name).first()
-                        if fund_entry:
-                            if fund_code and not fund_entry.fund_code:  # Update fund_code if it was missing
-                                fund_entry.fund_code = fund_code
-                        else:
-                            fund_entry = Fund(fund_name=fund_name, fund_code=fund_code)
-                            db_session.add(fund_entry)
-
-                        # Fetch and update current_nav if fund_code is available
-                        if fund_entry.fund_code:
-                            current_nav = fetch_current_nav(fund_entry.fund_code)
-                            if current_nav is not None:
-                                fund_entry.current_nav = current_nav
-                                fund_entry.last_updated = datetime.datetime.now()
-                                print(f"Updated NAV for {fund_name} ({fund_entry.fund_code}): {current_nav}")
-                            else:
-                                print(f"Could not fetch NAV for {fund_name} ({fund_entry.fund_code})")
 
+                    # Add or update the Fund table in one batch
+                    result['funds'] = sync_funds(db_session, mutual_funds_df['Investment name'].unique(), fund_code_mapping, commit_changes)
                     if commit_changes:
-                        db_session.commit()  # Commit fund updates
-
-                    # Get latest transaction date from database
-                    latest_transaction = db_session.query(MutualFundTransaction).order_by(MutualFundTransaction.timestamp.desc()).first()
-                    latest_date = latest_transaction.timestamp if latest_transaction else None
-
-                    # Filter transactions to only those after latest_date
-                    if latest_date:
-                        filtered_mutual_funds_df = mutual_funds_df[mutual_funds_df['Trade Date'] > latest_date]
-                    else:
-                        filtered_mutual_funds_df = mutual_funds_df
-
-                    # Prepare Mutual Fund Transactions
-                    for index, row in filtered_mutual_funds_df.iterrows():
-                        fund_name = row['Investment name']
-
-                        transaction_type = None
-                        amount = 0.0
-                        units = 0.0
-                        nav = 0.0  # NAV is missing, setting to 0 for now
-
-                        if row.get('Buy units', 0) > 0:
-                            transaction_type = 'Buy'
-                            units = row['Buy units']
-                            amount = row.get('Cash inflow', 0)
-                        elif row.get('Sell units', 0) > 0:
-                            transaction_type = 'Sell'
-                            units = row['Sell units']
-                            amount = row.get('Cash outflow', 0)
-                        elif row.get('Dividend reinvested units', 0) > 0:
-                            transaction_type = 'Buy'  # Reinvestment is a form of buying units
-                            units = row['Dividend reinvested units']
-                            amount = row.get('Dividend Amount', 0)
-
-                        calculated_nav = 0.0
-                        if units != 0:
-                            # Use absolute value of amount for NAV calculation for sell transactions
-                            nav_amount = abs(amount) if transaction_type == 'Sell' else amount
-                            calculated_nav = nav_amount / units
-
-                        if transaction_type:  # Only process if a transaction type is determined
-                            transaction_entry = MutualFundTransaction(
-                                fund_name=fund_name,
-                                transaction_type=transaction_type,
-                                amount=amount,
-                                units=units,
-                                nav=calculated_nav,  # Use calculated NAV
-                                timestamp=row['Trade Date'])
-                            new_mutual_fund_transactions.append(transaction_entry)
-                            if commit_changes:
-                                db_session.add(transaction_entry)
+                        with span('commit', table='funds'):
+                            db_session.commit()  # Commit fund updates
+
+                    with span('parse', step='watermark') as record:
+                        # Start from the watermark of the last import; fall back to the latest transaction date in the database
+                        watermark = load_watermarks(db_session, 'mf_xlsx').get(MUTUAL_FUNDS_SHEET)
+                        latest_date = None
+                        if watermark is None:
+                            latest_transaction = db_session.query(MutualFundTransaction).order_by(MutualFundTransaction.timestamp.desc()).first()
+                            latest_date = latest_transaction.timestamp if latest_transaction else None
+
+                        # Filter transactions to only those after the watermark
+                        filtered_mutual_funds_df = new_rows_after_watermark(mutual_funds_df, 'Trade Date', watermark, MF_XLSX_FINGERPRINT_COLUMNS, latest_date)
+                        record['rows'] = len(filtered_mutual_funds_df)
+
+                    with span('insert', table='mutual_fund_transactions') as record:
+                        # Prepare Mutual Fund Transactions, leaving out funds that could not be added
+                        synced_df, result['skipped_funds'] = skip_unsynced_funds(filtered_mutual_funds_df, 'Investment name', result['funds'])
+                        for index, row in synced_df.iterrows():
+                            fields = mf_xlsx_transaction(row)
+                            if fields:  # Only process if a transaction type is determined
+                                transaction_entry = MutualFundTransaction(**fields)
+                                new_mutual_fund_transactions.append(transaction_entry)
+                                if commit_changes:
+                                    db_session.add(transaction_entry)
+                        record['rows'] = len(new_mutual_fund_transactions)
 
                     # Get last few mutual fund transactions for display
                     last_mutual_fund_transactions = db_session.query(MutualFundTransaction).order_by(MutualFundTransaction.timestamp.desc()).limit(10).all()
                     result['last_mutual_fund_transactions'] = last_mutual_fund_transactions
                     result['new_mutual_fund_transactions'] = new_mutual_fund_transactions
 
+                    if commit_changes:
+                        if not filtered_mutual_funds_df.empty:
+                            update_watermark(db_session, 'mf_xlsx', MUTUAL_FUNDS_SHEET, filtered_mutual_funds_df.iloc[-1], 'Trade Date',
+                                             MF_XLSX_FINGERPRINT_COLUMNS, watermark=watermark)
+                        with span('commit', table='mutual_fund_transactions'):
+                            db_session.commit()  # Commit transactions together with the watermark
+
                 except Exception as e:
+                    db_session.rollback()
                     result['error'] = f"Error reading Mutual Funds file: {e}"
                     return result
             elif file_extension == 'pdf':
@@ -267,100 +531,56 @@ def process_excel_data(db_session, mutual_funds_filepath, account_balances_filep
                 # Implement CAMS parsing logic here
                 try:
                     # Use tabula to read tables from the temporary PDF
+                    import tabula
                     # CAMS statements often have multiple tables, need to identify and process the relevant ones
                     # This is a basic attempt and might need refinement based on actual CAMS formats
-                    cams_dfs = tabula.read_pdf(temp_pdf_path, pages='all', pandas_options={'header': None})
-
-                    # Assuming the relevant transactions are in a table with specific columns
-                    # Need to identify the correct DataFrame and columns
-                    mutual_funds_df = pd.DataFrame()
-                    for df in cams_dfs:
-                        # Look for a DataFrame that contains columns indicative of transactions
-                        # This is a heuristic and might need adjustment
-                        if any(col in df.columns for col in ['Date', 'Description', 'Amount', 'Units', 'NAV']):
-                             # Assuming the first such table is the transactions table
-                            mutual_funds_df = df
-                            break
-
-                    if mutual_funds_df.empty:
-                        result['error'] = "Could not find transaction data in CAMS PDF."
-                        return result
-
-                    # Assuming column mapping based on common CAMS formats
-                    # This will likely need to be adjusted based on actual file examples
-                    mutual_funds_df.columns = ['Date', 'Description', 'Amount', 'Units', 'NAV', 'Balance'] # Example columns
-
-                    # Convert Date column to datetime objects
-                    mutual_funds_df['Date'] = pd.to_datetime(mutual_funds_df['Date'], errors='coerce')
-
-                    # Filter out rows with invalid dates or headers
-                    mutual_funds_df.dropna(subset=['Date'], inplace=True)
-
-                    # Process transactions
+                    with span('extract', file=os.path.basename(mutual_funds_filepath)) as record:
+                        cams_dfs = tabula.read_pdf(temp_pdf_path, pages='all', pandas_options={'header': None})
+                        record['rows'] = sum(len(df) for df in cams_dfs)
+
+                    with span('parse') as record:
+                        try:
+                            mutual_funds_df = cams_frame(cams_dfs)
+                        except ValueError as e:
+                            result['error'] = str(e)
+                            return result
+
+                        # Keep only the rows after each fund's watermark
+                        watermarks = load_watermarks(db_session, 'cams_pdf')
+                        fund_tails = []
+                        for fund_name, fund_df in mutual_funds_df.groupby('Description', sort=False):
+                            fund_tail = new_rows_after_watermark(fund_df, 'Date', watermarks.get(fund_name), CAMS_PDF_FINGERPRINT_COLUMNS)
+                            if not fund_tail.empty:
+                                fund_tails.append((fund_name, fund_tail))
+                        if fund_tails:
+                            mutual_funds_df = pd.concat([fund_tail for fund_name, fund_tail in fund_tails]).sort_values('Date', kind='stable')
+                        else:
+                            mutual_funds_df = mutual_funds_df.iloc[0:0]
+                        record['rows'] = len(mutual_funds_df)
+
+                    # Add or update the Fund table in one batch, before creating the transactions
                     fund_code_mapping = load_fund_codes()
+                    result['funds'] = sync_funds(db_session, mutual_funds_df['Description'].unique(), fund_code_mapping, commit_changes)
 
-                    for index, row in mutual_funds_df.iterrows():
-                        fund_name = row['Description'] # Assuming Description contains fund name
-                        transaction_date = row['Date']
-                        amount = row['Amount']
-                        units = row['Units']
-                        nav = row['NAV']
-
-                        # Determine transaction type (Buy, Sell, Dividend, etc.)
-                        # This is a simplification and might need more sophisticated logic
-                        transaction_type = 'Unknown'
-                        if amount > 0 and units > 0:
-                            transaction_type = 'Buy'
-                        elif amount < 0 and units < 0:
-                             transaction_type = 'Sell'
-                        elif "dividend" in str(fund_name).lower():
-                             transaction_type = 'Dividend'
-
-
-                        # Get fund code (using fuzzy matching as implemented for Excel)
-                        fund_code = fund_code_mapping.get(fund_name.lower())
-                        if not fund_code:
-                            best_match, score = process.extractOne(fund_name.lower(), fund_code_mapping.keys())
-                            if score > 80:
-                                fund_code = fund_code_mapping.get(best_match)
-                                print(f"Fuzzy matched '{fund_name}' to '{best_match}' with score {score}. Using code {fund_code}")
-                            else:
-                                print(f"Fund code not found for '{fund_name}' and no good fuzzy match found (best match: '{best_match}', score: {score})")
-
-                        # Add or update the Fund table (similar to Excel processing)
-                        fund_entry = db_session.query(Fund).filter_by(fund_name=fund_name).first()
-                        if fund_entry:
-                            if fund_code and not fund_entry.fund_code:
-                                fund_entry.fund_code = fund_code
-                        else:
-                            fund_entry = Fund(fund_name=fund_name, fund_code=fund_code)
-                            db_session.add(fund_entry)
-
-                        # Fetch and update current_nav if fund_code is available
-                        if fund_entry.fund_code:
-                            current_nav = fetch_current_nav(fund_entry.fund_code)
-                            if current_nav is not None:
-                                fund_entry.current_nav = current_nav
-                                fund_entry.last_updated = datetime.datetime.now()
-                                print(f"Updated NAV for {fund_name} ({fund_entry.fund_code}): {current_nav}")
-                            else:
-                                print(f"Could not fetch NAV for {fund_name} ({fund_entry.fund_code})")
-
-                        if commit_changes:
-                            db_session.commit() # Commit fund updates
-
-                        # Create MutualFundTransaction entry
-                        transaction_entry = MutualFundTransaction(
-                            fund_name=fund_name,
-                            transaction_type=transaction_type,
-                            amount=amount,
-                            units=units,
-                            nav=nav,
-                            timestamp=transaction_date
-                        )
-                        new_mutual_fund_transactions.append(transaction_entry)
-                        if commit_changes:
-                            db_session.add(transaction_entry)
+                    with span('insert', table='mutual_fund_transactions') as record:
+                        # Process transactions, leaving out funds that could not be added
+                        mutual_funds_df, result['skipped_funds'] = skip_unsynced_funds(mutual_funds_df, 'Description', result['funds'])
+                        for index, row in mutual_funds_df.iterrows():
+                            transaction_entry = MutualFundTransaction(**cams_transaction(row))
+                            new_mutual_fund_transactions.append(transaction_entry)
+                            if commit_changes:
+                                db_session.add(transaction_entry)
+                        record['rows'] = len(new_mutual_fund_transactions)
+
+                    if commit_changes:
+                        # Skipped funds keep their watermark, so their rows are imported once they can be added
+                        for fund_name, fund_tail in fund_tails:
+                            if fund_name in result['skipped_funds']:
+                                continue
+                            update_watermark(db_session, 'cams_pdf', fund_name, fund_tail.iloc[-1], 'Date',
+                                             CAMS_PDF_FINGERPRINT_COLUMNS, watermark=watermarks.get(fund_name))
+                        with span('commit', table='mutual_fund_transactions'):
+                            db_session.commit()  # Commit transactions together with the watermarks
 
                     # Get last few mutual fund transactions for display
                     last_mutual_fund_transactions = db_session.query(MutualFundTransaction).order_by(MutualFundTransaction.timestamp.desc()).limit(10).all()
@@ -370,6 +590,7 @@ def process_excel_data(db_session, mutual_funds_filepath, account_balances_filep
                     return result
 
                 except Exception as e:
+                    db_session.rollback()
                     result['error'] = f"Error processing CAMS PDF: {e}"
                     return result
 
@@ -380,30 +601,41 @@ def process_excel_data(db_session, mutual_funds_filepath, account_balances_filep
 
             if file_extension == 'xlsx':
                 try:
-                    account_balances_df = pd.read_excel(account_balances_filepath, engine='openpyxl')
-                    account_balances_df['Date'] = pd.to_datetime(account_balances_df['Date'])
-                    # Get latest date from database for account balances
-                    latest_balance_entry = db_session.query(AccountBalance).order_by(AccountBalance.date.desc()).first()
-                    latest_date = latest_balance_entry.date if latest_balance_entry else None
-                    # Filter to only new entries after latest_date
-                    if latest_date:
-                        filtered_account_balances_df = account_balances_df[account_balances_df['Date'] > latest_date]
-                    else:
-                        filtered_account_balances_df = account_balances_df
-                    new_account_balances = []
-                    for index, row in filtered_account_balances_df.iterrows():
-                        balance_entry = AccountBalance(
-                            bank=row['Bank'],
-                            closing_balance=row['Closing Balance'],
-                            date=row['Date'],
-                            narration=row['Narration'],
-                            chq_ref_no=row['Chq./Ref.No.'],
-                            withdrawal_amt=row['Withdrawal Amt.'],
-                            deposit_amt=row['Deposit Amt.'],
-                        )
-                        new_account_balances.append(balance_entry)
-                        if commit_changes:
-                            db_session.add(balance_entry)
+                    with span('extract', file=os.path.basename(account_balances_filepath)) as record:
+                        account_balances_df = pd.read_excel(account_balances_filepath, engine='openpyxl')
+                        record['rows'] = len(account_balances_df)
+                    with span('parse') as record:
+                        account_balances_df['Date'] = pd.to_datetime(account_balances_df['Date'])
+                        account_balances_df = account_balances_df.sort_values('Date', kind='stable')
+                        # Filter each bank to only the entries after its watermark, falling back to
+                        # the latest date stored for that bank when it has not been imported before
+                        watermarks = load_watermarks(db_session, 'balance_xlsx')
+                        bank_tails = []
+                        for bank, bank_df in account_balances_df.groupby('Bank', sort=False):
+                            watermark = watermarks.get(bank)
+                            latest_date = None
+                            if watermark is None:
+                                latest_date = db_session.query(func.max(AccountBalance.date)).filter(AccountBalance.bank == bank).scalar()
+                            bank_tail = new_rows_after_watermark(bank_df, 'Date', watermark, BALANCE_XLSX_FINGERPRINT_COLUMNS, latest_date)
+                            if not bank_tail.empty:
+                                bank_tails.append((bank, bank_tail))
+                        if bank_tails:
+                            filtered_account_balances_df = pd.concat([bank_tail for bank, bank_tail in bank_tails]).sort_values('Date', kind='stable')
+                        else:
+                            filtered_account_balances_df = account_balances_df.iloc[0:0]
+                        record['rows'] = len(filtered_account_balances_df)
+
+                    with span('insert', table='account_balances') as record:
+                        new_account_balances = []
+                        # Categorize the whole narration column in one pass
+                        categories = load_categorizer(db_session).classify_many(filtered_account_balances_df['Narration'].tolist())
+                        for (index, row), category in zip(filtered_account_balances_df.iterrows(), categories):
+                            balance_entry = AccountBalance(**balance_xlsx_entry(row, category))
+                            new_account_balances.append(balance_entry)
+                            if commit_changes:
+                                db_session.add(balance_entry)
+                        record['rows'] = len(new_account_balances)
+                    result['reconciliation'] = reconcile_new_balances(db_session, new_account_balances)
 
                     # Get last few account balances for display
                     last_account_balances = db_session.query(AccountBalance).order_by(AccountBalance.date.desc()).limit(10).all()
@@ -411,10 +643,16 @@ def process_excel_data(db_session, mutual_funds_filepath, account_balances_filep
                     result['new_account_balances'] = new_account_balances
 
                     if commit_changes:
-                        db_session.commit()
+                        for bank, bank_tail in bank_tails:
+                            last_row = bank_tail.iloc[-1]
+                            update_watermark(db_session, 'balance_xlsx', bank, last_row, 'Date', BALANCE_XLSX_FINGERPRINT_COLUMNS,
+                                             closing_balance=last_row['Closing Balance'], watermark=watermarks.get(bank))
+                        with span('commit', table='account_balances'):
+                            db_session.commit()
                     result['success'] = True
                     return result
                 except Exception as e:
+                    db_session.rollback()
                     result['error'] = f"Error processing Account Balances file: {e}"
                     return result
             elif file_extension == 'pdf':
@@ -426,68 +664,59 @@ def process_excel_data(db_session, mutual_funds_filepath, account_balances_filep
 
                 try:
                     # Assume it's an account balance PDF and use tabula
-                    print("Processing Account Balance PDF.")
-                    df = tabula.read_pdf(temp_pdf_path, pages=[1], pandas_options={'header': 0})
-                    df2 = tabula.read_pdf(temp_pdf_path, pages='all', pandas_options={'header': None})
-                    df1 = pd.DataFrame()
-                    for sdf in df2:
-                        sdf.columns = df[0].columns
-                        df1 = pd.concat([df1, sdf], ignore_index=True)
-                    df1 = df1[1:]
-                    df1['Date'] = pd.to_datetime(df1['Date'], format='%d-%m-%Y')
-                    # Clean 'Amount' column: remove commas, currency symbols, etc., keep only digits, decimal point, and leading minus
-                    df1['Amount'] = df1['Amount'].astype(str).str.replace(r'[^\d.-]', '', regex=True)
-                    # Convert to numeric, coercing errors to NaN, then fill NaN with 0 for safety before arithmetic
-                    df1['Amount'] = pd.to_numeric(df1['Amount'], errors='coerce').fillna(0)
-                    df1 = df1.sort_values('Date', ascending=True)
-                    latest_balance_entry = db_session.query(AccountBalance).filter(AccountBalance.bank == 'ICICI').order_by(AccountBalance.date.desc()).first()
-                    latest_date = latest_balance_entry.date if latest_balance_entry else None
-                    latest_balance = latest_balance_entry.closing_balance if latest_balance_entry else 0
-                    # Filter to only new entries after latest_date
-                    if latest_date:
-                        df1 = df1[df1['Date'] > latest_date]
-                    df1['net'] = df1.apply(lambda row: row['Amount'] * -1 if row['Type'] == 'DR' else row['Amount'], axis=1)
-                    print(latest_balance, df1)
-                    df1['Balance'] = latest_balance + df1['net'].cumsum()
-                    new_account_balances = []
-                    df2 = df1[df1['Type'] == 'CR']
-                    for index, row in df2.iterrows():
-                        balance_entry = AccountBalance(
-                            bank='ICICI',
-                            date=row['Date'],
-                            narration=row['Description'],
-                            withdrawal_amt=0,
-                            deposit_amt=row['Amount'],
-                            closing_balance=row['Balance'],
-                        )
-                        new_account_balances.append(balance_entry)
-                        if commit_changes:
-                            db_session.add(balance_entry)
-                    df2 = df1[df1['Type'] == 'DR']
-                    for index, row in df2.iterrows():
-                        balance_entry = AccountBalance(
-                            bank='ICICI',
-                            date=row['Date'],
-                            narration=row['Description'],
-                            withdrawal_amt=row['Amount'],
-                            deposit_amt=0,
-                            closing_balance=row['Balance']
-                        )
-                        new_account_balances.append(balance_entry)
-                        if commit_changes:
-                            db_session.add(balance_entry)
-                    print(df2)
+                    import tabula
+                    logger.info("Processing Account Balance PDF.")
+                    with span('extract', file=os.path.basename(account_balances_filepath)) as record:
+                        df = tabula.read_pdf(temp_pdf_path, pages=[1], pandas_options={'header': 0})
+                        df2 = tabula.read_pdf(temp_pdf_path, pages='all', pandas_options={'header': None})
+                        record['rows'] = sum(len(sdf) for sdf in df2)
+                    with span('parse') as record:
+                        df1 = icici_frame(df2, df[0].columns)
+                        # Resume from the watermark's closing balance; fall back to the latest ICICI row in the database
+                        watermark = load_watermarks(db_session, 'icici_pdf').get('ICICI')
+                        latest_date = None
+                        if watermark is not None:
+                            latest_balance = watermark.closing_balance or 0
+                        else:
+                            latest_balance_entry = db_session.query(AccountBalance).filter(AccountBalance.bank == 'ICICI').order_by(AccountBalance.date.desc()).first()
+                            latest_date = latest_balance_entry.date if latest_balance_entry else None
+                            latest_balance = latest_balance_entry.closing_balance if latest_balance_entry else 0
+                        # Filter to only new entries after the watermark
+                        df1 = new_rows_after_watermark(df1, 'Date', watermark, ICICI_PDF_FINGERPRINT_COLUMNS, latest_date).copy()
+                        df1['net'] = df1['Amount'].where(df1['Type'] != 'DR', -df1['Amount'])
+                        df1['Balance'] = latest_balance + df1['net'].cumsum()
+                        record['rows'] = len(df1)
+
+                    with span('insert', table='account_balances') as record:
+                        new_account_balances = []
+                        # Categorize the whole description column in one pass
+                        df1['Category'] = load_categorizer(db_session).classify_many(df1['Description'].tolist())
+                        # Credits first, then debits
+                        for index, row in pd.concat([df1[df1['Type'] == 'CR'], df1[df1['Type'] == 'DR']]).iterrows():
+                            balance_entry = AccountBalance(**icici_entry(row))
+                            new_account_balances.append(balance_entry)
+                            if commit_changes:
+                                db_session.add(balance_entry)
+                        record['rows'] = len(new_account_balances)
+                    result['reconciliation'] = reconcile_new_balances(db_session, new_account_balances)
+
                     # Get last few account balances for display
                     last_account_balances = db_session.query(AccountBalance).order_by(AccountBalance.date.desc()).limit(10).all()
                     result['last_account_balances'] = last_account_balances
                     result['new_account_balances'] = new_account_balances
 
                     if commit_changes:
-                        db_session.commit()
+                        if not df1.empty:
+                            last_row = df1.iloc[-1]
+                            update_watermark(db_session, 'icici_pdf', 'ICICI', last_row, 'Date', ICICI_PDF_FINGERPRINT_COLUMNS,
+                                             closing_balance=last_row['Balance'], watermark=watermark)
+                        with span('commit', table='account_balances'):
+                            db_session.commit()
                     result['success'] = True
                     return result
 
                 except Exception as e:
+                    db_session.rollback()
                     result['error'] = f"Error processing Account Balances file: {e}"
                     return result
 
@@ -498,6 +727,7 @@ def process_excel_data(db_session, mutual_funds_filepath, account_balances_filep
     except Exception as e:
         db_session.rollback()
         result['error'] = f"Error processing file: {e}"
+        return result
     finally:
         # Clean up the temporary file if it was created
         if temp_pdf_path and os.path.exists(temp_pdf_path):
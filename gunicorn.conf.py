@@ -0,0 +1,28 @@
+# gunicorn settings for the production serving profile: gunicorn -c gunicorn.conf.py wsgi:app
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '127.0.0.1:8000')
+# One worker process per core; each serves several requests at once on its own threads, so a slow
+# upload only ties up one thread instead of every dashboard viewer
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.environ.get('THREADS', 4))
+worker_class = 'gthread'
+# Large PDF statements are parsed inside the upload request
+timeout = 300
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then to bound memory growth from pandas/tabula imports
+max_requests = 1000
+max_requests_jitter = 100
+accesslog = os.environ.get('ACCESS_LOG', '-') or None # ACCESS_LOG= (empty) turns it off
+
+def on_starting(server):
+    # Runs once in the master process, before any worker is forked
+    import wsgi
+    wsgi.prepare()
+
+def post_worker_init(worker):
+    # The scheduler thread must start in each worker, after the fork
+    import wsgi
+    wsgi.start_maintenance()
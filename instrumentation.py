@@ -0,0 +1,110 @@
+import logging
+import threading
+import time
+from flask import g, request, has_request_context, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the request duration histogram buckets
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+# A statement executed this many times in one request is reported as a likely N+1 query
+N_PLUS_ONE_THRESHOLD = 10
+
+class RequestMetrics:
+    """Thread-safe per-endpoint aggregates of request durations and SQL query counts."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, endpoint, duration, query_count, query_duration, n_plus_one):
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {
+                'count': 0, 'duration': 0.0, 'buckets': [0] * len(DURATION_BUCKETS),
+                'queries': 0, 'query_duration': 0.0, 'n_plus_one': 0,
+            })
+            stats['count'] += 1
+            stats['duration'] += duration
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    stats['buckets'][i] += 1
+            stats['queries'] += query_count
+            stats['query_duration'] += query_duration
+            stats['n_plus_one'] += n_plus_one
+
+    def prometheus(self):
+        """Renders the aggregates in the Prometheus text exposition format."""
+        with self.lock:
+            endpoints = {name: dict(stats, buckets=list(stats['buckets'])) for name, stats in self.endpoints.items()}
+        lines = [
+            '# HELP finapp_request_duration_seconds Request duration per endpoint.',
+            '# TYPE finapp_request_duration_seconds histogram',
+        ]
+        for name, stats in sorted(endpoints.items()):
+            for bound, count in zip(DURATION_BUCKETS, stats['buckets']):
+                lines.append(f'finapp_request_duration_seconds_bucket{{endpoint="{name}",le="{bound}"}} {count}')
+            lines.append(f'finapp_request_duration_seconds_bucket{{endpoint="{name}",le="+Inf"}} {stats["count"]}')
+            lines.append(f'finapp_request_duration_seconds_sum{{endpoint="{name}"}} {stats["duration"]:.6f}')
+            lines.append(f'finapp_request_duration_seconds_count{{endpoint="{name}"}} {stats["count"]}')
+        for metric, key, kind, help_text in [
+            ('finapp_db_queries_total', 'queries', 'counter', 'SQL statements executed per endpoint.'),
+            ('finapp_db_query_duration_seconds_total', 'query_duration', 'counter', 'Time spent executing SQL per endpoint.'),
+            ('finapp_n_plus_one_warnings_total', 'n_plus_one', 'counter', 'Statements repeated often enough in one request to look like N+1 queries.'),
+        ]:
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} {kind}')
+            for name, stats in sorted(endpoints.items()):
+                value = f"{stats[key]:.6f}" if isinstance(stats[key], float) else stats[key]
+                lines.append(f'{metric}{{endpoint="{name}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+metrics = RequestMetrics()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'query_start' in g:
+        g.query_start.append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'query_start' in g and g.query_start:
+        g.query_duration += time.perf_counter() - g.query_start.pop()
+        g.query_count += 1
+        g.statements[statement] = g.statements.get(statement, 0) + 1
+
+def init_instrumentation(app):
+    """
+    Times every request and the SQL it runs, and serves the aggregates at /metrics.
+    Set app.config['SERVER_TIMING'] to also return a Server-Timing header with each response.
+    """
+    # Listening on the Engine class covers every engine, including ones bound after startup
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+        g.query_start = []
+        g.query_count = 0
+        g.query_duration = 0.0
+        g.statements = {}
+
+    @app.after_request
+    def record_request_metrics(response):
+        if 'request_start' not in g:
+            return response
+        duration = time.perf_counter() - g.request_start
+        endpoint = request.endpoint or 'unknown'
+        repeated = {statement: count for statement, count in g.statements.items() if count >= N_PLUS_ONE_THRESHOLD}
+        for statement, count in repeated.items():
+            logger.warning("Possible N+1 query in %s: executed %d times: %s", endpoint, count, statement.splitlines()[0][:200])
+        metrics.record(endpoint, duration, g.query_count, g.query_duration, len(repeated))
+        if app.config.get('SERVER_TIMING'):
+            response.headers['Server-Timing'] = (f'db;dur={g.query_duration * 1000:.1f};desc="{g.query_count} queries", '
+                                                 f'total;dur={duration * 1000:.1f}')
+        return response
+
+    @app.route('/metrics')
+    def show_metrics():
+        return Response(metrics.prometheus(), mimetype='text/plain; version=0.0.4')
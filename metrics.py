@@ -0,0 +1,310 @@
+"""
+Return and risk metrics per fund, from the daily NAV history stored in nav_history.
+
+For each fund, as of a date:
+  rolling_returns  the return over every 1, 3 and 5 year window ending on a NAV date, annualised:
+                   the latest such window and the mean, median, worst and best of all of them,
+                   and how often they were positive
+  volatility       annualised standard deviation of daily returns over the last RISK_YEARS
+  max_drawdown     the largest fall from a peak, with the peak, trough and recovery dates
+  sharpe, sortino  return over the last RISK_YEARS above the risk-free rate, per unit of
+                   volatility (Sharpe) or of downside deviation (Sortino)
+The portfolio gets the same metrics, for the funds held weighted by their current value.
+
+Every metric is computed with array operations over the fund's whole series at once (the rolling
+windows by a binary search for each window's start), and the results are cached per fund and as-of
+date in the shared cache until the NAV history changes.
+
+correlation() gives the pairwise correlation matrix of the funds held, from three matrix products
+over their aligned daily returns, and how diversified the holdings are.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import numpy as np
+from sqlalchemy import insert, func
+from models import Fund, NavHistory
+from cache import shared_cache
+from dataversion import data_versions
+from mfapi import mfapi
+
+logger = logging.getLogger(__name__)
+
+WINDOWS = (1, 3, 5) # Years of the rolling returns
+RISK_YEARS = 3 # Years of history volatility, Sharpe and Sortino are measured over
+RISK_FREE_RATE = 0.065 # Annual; roughly the 91-day T-bill yield
+DAYS_PER_YEAR = 365.25
+METRICS_CACHE_TTL = 7 * 24 * 60 * 60
+MIN_OVERLAP_DAYS = 60 # Fewer shared days than this and a pair's correlation isn't reported
+REDUNDANT_CORRELATION = 0.9 # Pairs at least this correlated are listed as redundant
+
+def parse_nav_history(payload):
+    """Turns an mfapi.in /mf/<code> payload into (datetime64[D] dates, NAVs), oldest first."""
+    rows = [(entry['date'], entry['nav']) for entry in payload.get('data', []) if entry.get('date') and entry.get('nav')]
+    if not rows:
+        return np.array([], dtype='datetime64[D]'), np.array([], dtype=np.float64)
+    dates = np.array(['-'.join(reversed(date.split('-'))) for date, nav in rows], dtype='datetime64[D]') # dd-mm-yyyy
+    navs = np.array([nav for date, nav in rows], dtype=np.float64)
+    order = np.argsort(dates, kind='stable')
+    order = order[navs[order] > 0] # Suspended schemes report a NAV of 0
+    return dates[order], navs[order]
+
+def sync_nav_history(db_session, fund_codes=None):
+    """
+    Stores the NAVs published since the last sync for each fund (all funds by default), from
+    mfapi.in through its response cache. Returns {'funds', 'rows', 'failed'}.
+    """
+    if fund_codes is None:
+        fund_codes = [code for (code,) in db_session.query(Fund.fund_code).filter(Fund.fund_code.isnot(None))]
+    latest = dict(db_session.query(NavHistory.fund_code, func.max(NavHistory.date)).group_by(NavHistory.fund_code))
+    result = {'funds': len(fund_codes), 'rows': 0, 'failed': 0}
+    for code in fund_codes:
+        try:
+            response = mfapi.get(f"mf/{code}")
+            if response.status_code != 200:
+                raise ValueError(f"status code {response.status_code}")
+            dates, navs = parse_nav_history(response.json())
+        except Exception as e:
+            logger.warning(f"Could not fetch the NAV history of {code}: {e}")
+            result['failed'] += 1
+            continue
+        if code in latest:
+            new = dates > np.datetime64(latest[code]).astype('datetime64[D]')
+            dates, navs = dates[new], navs[new]
+        if len(dates):
+            db_session.execute(insert(NavHistory), [{'fund_code': code, 'date': date, 'nav': nav}
+                                                    for date, nav in zip(dates.astype('datetime64[s]').tolist(), navs.tolist())])
+            result['rows'] += len(dates)
+    db_session.commit()
+    return result
+
+def load_nav_series(db_session, fund_codes, as_of):
+    """Returns {fund code: (datetime64[D] dates, NAVs)} of the NAVs up to as_of, oldest first."""
+    end = datetime.datetime.combine(as_of + datetime.timedelta(days=1), datetime.time())
+    rows = (db_session.query(NavHistory.fund_code, NavHistory.date, NavHistory.nav)
+            .filter(NavHistory.fund_code.in_(sorted(fund_codes)), NavHistory.date < end)
+            .order_by(NavHistory.fund_code, NavHistory.date).all())
+    if not rows:
+        return {}
+    codes, dates, navs = zip(*rows)
+    codes = np.array(codes)
+    dates = np.array(dates, dtype='datetime64[s]').astype('datetime64[D]')
+    navs = np.array(navs, dtype=np.float64)
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    ends = np.r_[starts[1:], len(codes)]
+    return {str(codes[start]): (dates[start:end], navs[start:end]) for start, end in zip(starts, ends)}
+
+def _date(day):
+    return str(day) if day is not None else None
+
+def rolling_returns(dates, navs, years):
+    """
+    Annualised return of every window of `years` ending on a NAV date (starting at the last NAV on
+    or before the window's start), as (end dates, returns); empty when the history is shorter.
+    """
+    days = dates.astype(np.int64)
+    span = int(round(years * DAYS_PER_YEAR))
+    if not len(days) or days[-1] - days[0] < span:
+        return dates[:0], navs[:0]
+    ends = np.flatnonzero(days - days[0] >= span)
+    starts = np.searchsorted(days, days[ends] - span, 'right') - 1
+    elapsed = (days[ends] - days[starts]) / DAYS_PER_YEAR
+    return dates[ends], (navs[ends] / navs[starts]) ** (1 / elapsed) - 1
+
+def drawdown(dates, navs):
+    """The largest fall from a peak: {'max_drawdown', 'peak', 'trough', 'recovered', 'current'}."""
+    peaks = np.maximum.accumulate(navs)
+    falls = navs / peaks - 1
+    trough = int(np.argmin(falls))
+    peak = int(np.argmax(navs[:trough + 1]))
+    recovered = np.flatnonzero(navs[trough:] >= navs[peak])
+    return {'max_drawdown': float(falls[trough]), 'peak': _date(dates[peak]), 'trough': _date(dates[trough]),
+            'recovered': _date(dates[trough + recovered[0]]) if len(recovered) and falls[trough] < 0 else None,
+            'current': float(falls[-1])}
+
+def risk(dates, navs, risk_free=RISK_FREE_RATE, years=RISK_YEARS):
+    """Annualised return, volatility, downside deviation, Sharpe and Sortino ratios over the last `years`."""
+    start = np.searchsorted(dates, dates[-1] - np.timedelta64(int(round(years * DAYS_PER_YEAR)), 'D'))
+    dates, navs = dates[start:], navs[start:]
+    elapsed = (dates[-1] - dates[0]).astype(np.int64) / DAYS_PER_YEAR
+    if len(navs) < 3 or elapsed <= 0:
+        return {'annual_return': None, 'volatility': None, 'downside_deviation': None, 'sharpe': None, 'sortino': None}
+    returns = navs[1:] / navs[:-1] - 1
+    # NAVs are published on business days only; annualise by how many there are in a year
+    periods_per_year = len(returns) / elapsed
+    annual_return = (navs[-1] / navs[0]) ** (1 / elapsed) - 1
+    volatility = float(np.std(returns, ddof=1) * np.sqrt(periods_per_year))
+    period_risk_free = (1 + risk_free) ** (1 / periods_per_year) - 1
+    downside = float(np.sqrt(np.mean(np.minimum(returns - period_risk_free, 0) ** 2)) * np.sqrt(periods_per_year))
+    excess = annual_return - risk_free
+    return {'annual_return': float(annual_return), 'volatility': volatility, 'downside_deviation': downside,
+            'sharpe': excess / volatility if volatility else None, 'sortino': excess / downside if downside else None}
+
+def series_metrics(dates, navs, risk_free=RISK_FREE_RATE, windows=WINDOWS):
+    """All the metrics of one NAV series (see the module docstring), or None without at least two NAVs."""
+    if len(navs) < 2:
+        return None
+    rolling = {}
+    for years in windows:
+        ends, returns = rolling_returns(dates, navs, years)
+        rolling[f"{years}y"] = None if not len(returns) else {
+            'latest': float(returns[-1]), 'as_of': _date(ends[-1]), 'mean': float(returns.mean()), 'median': float(np.median(returns)),
+            'min': float(returns.min()), 'max': float(returns.max()), 'positive': float((returns > 0).mean()), 'windows': len(returns)}
+    return {'first_date': _date(dates[0]), 'last_date': _date(dates[-1]), 'nav': float(navs[-1]), 'rolling_returns': rolling,
+            **drawdown(dates, navs), **risk(dates, navs, risk_free)}
+
+def aligned_navs(series, codes):
+    """
+    The NAVs of the funds on one grid of every date any of them has a NAV: (dates, funds x dates
+    matrix). A fund's NAV is carried forward over days it has none, and is NaN before its first.
+    """
+    grid = np.unique(np.concatenate([series[code][0] for code in codes]))
+    navs = np.full((len(codes), len(grid)), np.nan)
+    for row, code in enumerate(codes):
+        dates, values = series[code]
+        navs[row, np.searchsorted(grid, dates)] = values
+    # Forward fill each row: index of the last NAV at or before each date
+    known = np.where(np.isnan(navs), 0, np.arange(len(grid)))
+    np.maximum.accumulate(known, axis=1, out=known)
+    return grid, np.take_along_axis(navs, known, axis=1)
+
+def portfolio_index(series, weights):
+    """
+    Value of a portfolio holding the funds in `weights` (fund code -> share of its value), rebalanced
+    daily, as an index starting at 1 on the first date any of them has a NAV. A fund adds nothing
+    before its first NAV.
+    """
+    codes = [code for code in weights if code in series and len(series[code][0]) > 1]
+    if not codes:
+        return None
+    grid, navs = aligned_navs(series, codes)
+    returns = np.nan_to_num(navs[:, 1:] / navs[:, :-1] - 1)
+    live = ~np.isnan(navs[:, :-1])
+    shares = np.array([weights[code] for code in codes], dtype=np.float64)[:, None] * live
+    totals = shares.sum(axis=0)
+    daily = np.divide((shares * returns).sum(axis=0), totals, out=np.zeros(len(grid) - 1), where=totals > 0)
+    return grid, np.r_[1.0, np.cumprod(1 + daily)]
+
+def _matrix(values, digits=4):
+    # NaN (too little overlap) as None, for JSON
+    return [[None if np.isnan(value) else round(value, digits) for value in row] for row in values.tolist()]
+
+def correlation(series, weights, years=RISK_YEARS, min_overlap=MIN_OVERLAP_DAYS):
+    """
+    Pairwise correlation of the daily returns of the funds in `weights` (fund code -> current value)
+    over the last `years`, and how diversified holding them in those proportions is. Returns None
+    with fewer than two funds with NAVs.
+
+    Each pair is correlated over the days both funds have NAVs, all pairs at once: with X the
+    funds x days matrix of returns less each fund's mean (0 where a fund has no NAV) and M the 0/1
+    matrix of days each fund has, X @ X.T sums the co-movements of every pair and (X * X) @ M.T
+    each fund's variation over the days shared with every other. Pairs sharing fewer than
+    min_overlap days are None.
+    """
+    codes = [code for code in weights if code in series and len(series[code][0]) > 2]
+    if len(codes) < 2:
+        return None
+    grid, navs = aligned_navs(series, codes)
+    start = np.searchsorted(grid, grid[-1] - np.timedelta64(int(round(years * DAYS_PER_YEAR)), 'D'))
+    grid, navs = grid[start:], navs[:, start:]
+    returns = navs[:, 1:] / navs[:, :-1] - 1
+    live = ~np.isnan(returns)
+    days = live.sum(axis=1)
+    means = np.divide(np.where(live, returns, 0).sum(axis=1), days, out=np.zeros(len(codes)), where=days > 0)
+    deviations = np.where(live, returns - means[:, None], 0)
+    shared = live.astype(np.float64)
+
+    co_movement = deviations @ deviations.T
+    variation = (deviations * deviations) @ shared.T
+    overlap = shared @ shared.T
+    with np.errstate(invalid='ignore', divide='ignore'):
+        correlations = co_movement / np.sqrt(variation * variation.T)
+        covariance = co_movement / (overlap - 1)
+    correlations[overlap < min_overlap] = np.nan
+    np.fill_diagonal(correlations, 1.0)
+
+    # Annualise by the business days in a year, as for volatility
+    elapsed = (grid[-1] - grid[0]).astype(np.int64) / DAYS_PER_YEAR
+    periods_per_year = (len(grid) - 1) / elapsed if elapsed > 0 else 0
+    covariance = np.nan_to_num(covariance) * periods_per_year
+    volatility = np.sqrt(np.diag(covariance))
+    shares = np.array([weights[code] for code in codes], dtype=np.float64)
+    shares /= shares.sum()
+    portfolio_volatility = float(np.sqrt(max(shares @ covariance @ shares, 0)))
+    pair_shares = np.outer(shares, shares)
+    np.fill_diagonal(pair_shares, 0)
+    known = ~np.isnan(correlations)
+    average_correlation = float((pair_shares * np.nan_to_num(correlations)).sum() / (pair_shares * known).sum()) \
+        if (pair_shares * known).sum() else None
+    diversification_ratio = float(shares @ volatility / portfolio_volatility) if portfolio_volatility else None
+
+    first, second = np.triu_indices(len(codes), 1)
+    pair_correlations = correlations[first, second]
+    redundant = np.flatnonzero(np.nan_to_num(pair_correlations) >= REDUNDANT_CORRELATION)
+    redundant = redundant[np.argsort(-pair_correlations[redundant], kind='stable')]
+    return {
+        'from': str(grid[0]), 'to': str(grid[-1]), 'funds': codes, 'weights': shares.tolist(), 'volatility': volatility.tolist(),
+        'correlations': _matrix(correlations), 'overlap_days': overlap.astype(np.int64).tolist(),
+        'statistics': {
+            'average_correlation': average_correlation, # Weighted by the pair's share of the portfolio
+            'diversification_ratio': diversification_ratio, # Weighted fund volatility over portfolio volatility
+            'effective_bets': diversification_ratio ** 2 if diversification_ratio else None, # Independent funds it is worth
+            'effective_funds': float(1 / (shares ** 2).sum()), # Equal-weight funds its concentration is worth
+            'portfolio_volatility': portfolio_volatility,
+        },
+        'redundant_pairs': [{'funds': [codes[first[i]], codes[second[i]]], 'correlation': round(float(pair_correlations[i]), 4),
+                             'weight': float(shares[first[i]] + shares[second[i]])} for i in redundant],
+    }
+
+def _digest(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()[:16]
+
+def fund_metrics(db_session, fund_codes, as_of=None, weights=None, risk_free=RISK_FREE_RATE):
+    """
+    Returns {'as_of', 'risk_free_rate', 'funds': {code: metrics or None}, 'portfolio': metrics or None}
+    for the funds as of a date (today by default). weights (fund code -> current value) gives the
+    portfolio's composition. Results are cached per fund and as-of date; only the funds missing
+    from the cache have their NAV history read.
+    """
+    as_of = as_of or datetime.date.today()
+    version = data_versions(db_session, {NavHistory.__tablename__})[NavHistory.__tablename__]
+    key = f"metrics:{as_of.isoformat()}:{version}:{risk_free}"
+    funds = {code: shared_cache.get(f"{key}:{code}") for code in fund_codes}
+    weights = {code: value for code, value in (weights or {}).items() if value and value > 0}
+    portfolio_key = f"{key}:portfolio:{_digest({code: round(value, 2) for code, value in weights.items()})}"
+    portfolio = shared_cache.get(portfolio_key) if weights else None
+
+    missing = [code for code, metrics in funds.items() if metrics is None]
+    if missing or (weights and portfolio is None):
+        series = load_nav_series(db_session, set(missing) | (set(weights) if portfolio is None else set()), as_of)
+        for code in missing:
+            # Funds without NAVs are cached too, as {} rather than None
+            funds[code] = series_metrics(*series[code], risk_free) if code in series else None
+            shared_cache.set(f"{key}:{code}", funds[code] or {}, ttl=METRICS_CACHE_TTL)
+        if weights and portfolio is None:
+            index = portfolio_index(series, weights)
+            portfolio = series_metrics(*index, risk_free) if index is not None else None
+            if portfolio is not None:
+                total = sum(weights.values())
+                portfolio['weights'] = {code: value / total for code, value in weights.items()}
+            shared_cache.set(portfolio_key, portfolio or {}, ttl=METRICS_CACHE_TTL)
+    return {'as_of': as_of.isoformat(), 'risk_free_rate': risk_free,
+            'funds': {code: metrics or None for code, metrics in funds.items()}, 'portfolio': portfolio or None}
+
+def correlation_report(db_session, weights, as_of=None, years=RISK_YEARS):
+    """
+    correlation() of the funds held (fund code -> current value) as of a date (today by default),
+    with the as-of date and window added. Memoized per date, window and holdings in the shared
+    cache until the NAV history changes.
+    """
+    as_of = as_of or datetime.date.today()
+    weights = {code: value for code, value in weights.items() if value and value > 0}
+    version = data_versions(db_session, {NavHistory.__tablename__})[NavHistory.__tablename__]
+    key = f"correlation:{as_of.isoformat()}:{version}:{years}:{_digest({code: round(value, 2) for code, value in weights.items()})}"
+
+    def compute():
+        report = correlation(load_nav_series(db_session, weights, as_of), weights, years)
+        return dict(report or {'funds': []}, as_of=as_of.isoformat(), years=years)
+
+    return shared_cache.get_or_set(key, compute, ttl=METRICS_CACHE_TTL)
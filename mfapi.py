@@ -0,0 +1,185 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+BASE_URL = 'https://api.mfapi.in'
+MODES = ('live', 'record', 'replay')
+REQUEST_TIMEOUT = 30 # seconds
+# How long a response is used without asking mfapi.in again, when it doesn't say itself (Cache-Control max-age).
+# The scheme list changes rarely; NAVs are published once a day.
+DEFAULT_TTL = {'mf': 24 * 60 * 60}
+NAV_TTL = 6 * 60 * 60
+STALE_ENTRY_AGE = 30 * 24 * 60 * 60 # prune() drops entries not fetched for this long
+
+class Response:
+    """What get() returns: the parts of a requests.Response the callers use, and where it came from."""
+
+    def __init__(self, status_code, content=b'', headers=None, source='network'):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.source = source # network, cache, revalidated, stale or fixture
+
+    def json(self):
+        return json.loads(self.content)
+
+    def __repr__(self):
+        return '<Response %r %r>' % (self.status_code, self.source)
+
+def _path(url_or_path):
+    # 'https://api.mfapi.in/mf/100' and '/mf/100' both become 'mf/100'
+    return url_or_path.split('api.mfapi.in', 1)[-1].strip('/')
+
+def _max_age(headers):
+    # Seconds a response may be served without revalidating (0 for no-cache/no-store), None when Cache-Control doesn't say
+    cache_control = headers.get('Cache-Control', '')
+    if re.search(r'\bno-(cache|store)\b(?!=)', cache_control):
+        return 0
+    match = re.search(r'\bmax-age=(\d+)', cache_control)
+    return int(match[1]) if match else None
+
+class MfapiClient:
+    """
+    Transport for the mfapi.in calls, in one of three modes:
+      live    fetches from mfapi.in through a response cache kept in an SQLite file (shared by
+              every worker): fresh entries are served without a request, expired ones are
+              revalidated with If-None-Match / If-Modified-Since, and when mfapi.in can't be reached
+              an expired entry is served rather than nothing. Bodies are stored zlib-compressed.
+      record  as live, and also writes each successful response to the fixtures directory
+      replay  serves only the fixtures directory and never touches the network; a request without
+              a fixture gets a 404
+    Fixtures are laid out by URL path: <fixtures_dir>/mf.json, <fixtures_dir>/mf/<code>.json (the
+    layout benchmarks.synthetic.write_mfapi_fixtures writes). Without a cache path (until
+    configure() is called, e.g. in CLI imports) live mode goes straight to the network.
+    """
+
+    def __init__(self):
+        self.configure()
+
+    def configure(self, mode='live', cache_path=None, fixtures_dir=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown mfapi mode: {mode}")
+        if mode != 'live' and not fixtures_dir:
+            raise ValueError(f"The {mode} mfapi mode needs a fixtures directory")
+        self.mode = mode
+        self.cache_path = os.path.abspath(cache_path) if cache_path else None
+        self.fixtures_dir = os.path.abspath(fixtures_dir) if fixtures_dir else None
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads, nor carried over a fork
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.cache_path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS responses (path TEXT PRIMARY KEY, status INTEGER NOT NULL, '
+                               'body BLOB NOT NULL, etag TEXT, last_modified TEXT, fetched_at REAL NOT NULL, expires_at REAL NOT NULL)')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _fixture_file(self, path):
+        return os.path.join(self.fixtures_dir, *path.split('/')) + '.json'
+
+    def _replay(self, path):
+        try:
+            with open(self._fixture_file(path), 'rb') as f:
+                return Response(200, f.read(), source='fixture')
+        except FileNotFoundError:
+            return Response(404, b'{}', source='fixture')
+
+    def _record(self, path, content):
+        fixture = self._fixture_file(path)
+        os.makedirs(os.path.dirname(fixture), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(fixture), suffix='.tmp', delete=False) as f:
+            f.write(content)
+        os.replace(f.name, fixture)
+
+    def _cached(self, path):
+        row = self._connection().execute('SELECT status, body, etag, last_modified, expires_at FROM responses WHERE path = ?',
+                                         (path,)).fetchone()
+        if row is None:
+            return None
+        status, body, etag, last_modified, expires_at = row
+        return {'response': Response(status, zlib.decompress(body), {'ETag': etag, 'Last-Modified': last_modified}, 'cache'),
+                'etag': etag, 'last_modified': last_modified, 'expires_at': expires_at}
+
+    def _store(self, path, response, ttl):
+        now = time.time()
+        self._connection().execute(
+            'INSERT OR REPLACE INTO responses (path, status, body, etag, last_modified, fetched_at, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (path, response.status_code, zlib.compress(response.content, 6), response.headers.get('ETag'),
+             response.headers.get('Last-Modified'), now, now + ttl))
+
+    def _refresh(self, path, ttl):
+        self._connection().execute('UPDATE responses SET fetched_at = ?, expires_at = ? WHERE path = ?',
+                                   (time.time(), time.time() + ttl, path))
+
+    def ttl(self, path):
+        return DEFAULT_TTL.get(path, NAV_TTL)
+
+    def get(self, url_or_path):
+        """GETs an mfapi.in URL (or its path, e.g. 'mf/100027') and returns a Response."""
+        path = _path(url_or_path)
+        if self.mode == 'replay':
+            return self._replay(path)
+
+        cached = self._cached(path) if self.cache_path else None
+        if cached and cached['expires_at'] > time.time():
+            return cached['response']
+        headers = {}
+        if cached and cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+
+        import requests
+        try:
+            network_response = requests.get(f"{BASE_URL}/{path}", headers=headers, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            if cached:
+                logger.warning(f"mfapi.in unreachable ({e}); serving the expired cached {path}")
+                cached['response'].source = 'stale'
+                return cached['response']
+            raise
+        response_headers = network_response.headers
+        max_age = _max_age(response_headers)
+        ttl = max_age if max_age is not None else self.ttl(path)
+        if network_response.status_code == 304 and cached:
+            self._refresh(path, ttl)
+            cached['response'].source = 'revalidated'
+            return cached['response']
+        content = network_response.content
+        response = Response(network_response.status_code, content,
+                            {name: response_headers[name] for name in ('ETag', 'Last-Modified') if name in response_headers})
+        if response.status_code == 200:
+            if self.cache_path:
+                self._store(path, response, ttl)
+            if self.mode == 'record':
+                self._record(path, content)
+        elif cached and response.status_code >= 500:
+            logger.warning(f"mfapi.in returned {response.status_code}; serving the cached {path}")
+            cached['response'].source = 'stale'
+            return cached['response']
+        return response
+
+    def clear(self):
+        if self.cache_path:
+            self._connection().execute('DELETE FROM responses')
+
+    def prune(self, max_age=STALE_ENTRY_AGE):
+        """Removes responses not fetched for max_age seconds and returns how many there were."""
+        if not self.cache_path:
+            return 0
+        return self._connection().execute('DELETE FROM responses WHERE fetched_at < ?', (time.time() - max_age,)).rowcount
+
+mfapi = MfapiClient()
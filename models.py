@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime
+from sqlalchemy import Column, Integer, String, Float, DateTime, Text, UniqueConstraint
 #from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import declarative_base
 
@@ -8,14 +8,16 @@ class AccountBalance(Base):
     __tablename__ = 'account_balances'
     id = Column(Integer, primary_key=True)
     bank = Column(String(120), unique=False, nullable=True)
-    date = Column(DateTime, nullable=False) # Corresponds to 'Date'
+    date = Column(DateTime, nullable=False, index=True) # Corresponds to 'Date'
     narration = Column(String(255), unique=False, nullable=True)
     chq_ref_no = Column(String(120), unique=False, nullable=True)
     withdrawal_amt = Column(Float, nullable=True)
     deposit_amt = Column(Float, nullable=True)
     closing_balance = Column(Float, nullable=False) # Corresponds to 'Closing Balance'
+    category = Column(String(60), nullable=True, index=True) # Set from the narration by the category rules
+    carried_forward = Column(Integer, nullable=True) # 1 on the row standing in for the rows archived to Parquet, see archive.py
 
-    def __init__(self, bank=None, date=None, narration=None, chq_ref_no=None, withdrawal_amt=None, deposit_amt=None, closing_balance=None):
+    def __init__(self, bank=None, date=None, narration=None, chq_ref_no=None, withdrawal_amt=None, deposit_amt=None, closing_balance=None, category=None, carried_forward=None):
         self.bank = bank
         self.date = date
         self.narration = narration
@@ -23,6 +25,8 @@ class AccountBalance(Base):
         self.withdrawal_amt = withdrawal_amt
         self.deposit_amt = deposit_amt
         self.closing_balance = closing_balance
+        self.category = category
+        self.carried_forward = carried_forward
 
     def __repr__(self):
         return '<AccountBalance %r>' % (self.bank)
@@ -33,7 +37,7 @@ class Fund(Base):
     fund_name = Column(String(120), unique=True, nullable=False)
     fund_code = Column(String(20), unique=True, nullable=False)
     current_nav = Column(Float, nullable=True) # Store current NAV here
-    last_updated = Column(DateTime, nullable=True) # Add last updated timestamp
+    last_updated = Column(DateTime, nullable=True, index=True) # Add last updated timestamp
 
     def __init__(self, fund_name=None, fund_code=None, current_nav=None, last_updated=None):
         self.fund_name = fund_name
@@ -52,15 +56,17 @@ class MutualFundTransaction(Base):
     amount = Column(Float, nullable=False)
     units = Column(Float, nullable=False)
     nav = Column(Float, nullable=False)
-    timestamp = Column(DateTime, nullable=False)
+    timestamp = Column(DateTime, nullable=False, index=True)
+    carried_forward = Column(Integer, nullable=True) # 1 on the rows standing in for the rows archived to Parquet, see archive.py
 
-    def __init__(self, fund_name=None, transaction_type=None, amount=None, units=None, nav=None, timestamp=None):
+    def __init__(self, fund_name=None, transaction_type=None, amount=None, units=None, nav=None, timestamp=None, carried_forward=None):
         self.fund_name = fund_name
         self.transaction_type = transaction_type
         self.amount = amount
         self.units = units
         self.nav = nav
         self.timestamp = timestamp
+        self.carried_forward = carried_forward
 
     def __repr__(self):
         return '<MutualFundTransaction %r>' % (self.fund_name)
@@ -76,8 +82,9 @@ class FixedDeposit(Base):
     total_interest_earned = Column(Float, nullable=True, default=0.0) # Field for tracking interest
     status = Column(String(50), nullable=False, default='open') # New field for status (open, closed, matured)
     closure_date = Column(DateTime, nullable=True) # New field for closure/maturity date
+    compounding = Column(String(20), nullable=False, default='quarterly') # simple, monthly, quarterly, half-yearly or yearly
 
-    def __init__(self, bank=None, amount=None, interest_rate=None, start_date=None, maturity_date=None, total_interest_earned=0.0, status='open', closure_date=None):
+    def __init__(self, bank=None, amount=None, interest_rate=None, start_date=None, maturity_date=None, total_interest_earned=0.0, status='open', closure_date=None, compounding='quarterly'):
         self.bank = bank
         self.amount = amount
         self.interest_rate = interest_rate
@@ -86,6 +93,158 @@ class FixedDeposit(Base):
         self.total_interest_earned = total_interest_earned
         self.status = status
         self.closure_date = closure_date
+        self.compounding = compounding
 
     def __repr__(self):
         return '<FixedDeposit %r>' % (self.bank)
+
+class IngestionWatermark(Base):
+    __tablename__ = 'ingestion_watermark'
+    __table_args__ = (UniqueConstraint('source_format', 'account', name='uq_watermark_source_account'),)
+    id = Column(Integer, primary_key=True)
+    source_format = Column(String(50), nullable=False) # e.g., mf_xlsx, balance_xlsx, icici_pdf, cams_pdf
+    account = Column(String(120), nullable=False) # Bank name, folio or fund name the rows belong to
+    last_date = Column(DateTime, nullable=False) # Date of the last imported row
+    row_fingerprint = Column(String(64), nullable=True) # Hash of the last imported row, to resume within the same day
+    closing_balance = Column(Float, nullable=True) # Closing balance after the last imported row (bank sources only)
+    updated_at = Column(DateTime, nullable=True)
+
+    def __init__(self, source_format=None, account=None, last_date=None, row_fingerprint=None, closing_balance=None, updated_at=None):
+        self.source_format = source_format
+        self.account = account
+        self.last_date = last_date
+        self.row_fingerprint = row_fingerprint
+        self.closing_balance = closing_balance
+        self.updated_at = updated_at
+
+    def __repr__(self):
+        return '<IngestionWatermark %r %r>' % (self.source_format, self.account)
+
+class ImportRun(Base):
+    __tablename__ = 'import_run'
+    id = Column(Integer, primary_key=True)
+    run_id = Column(String(32), nullable=False, index=True)
+    name = Column(String(50), nullable=False) # e.g., process_excel_data
+    files = Column(Text, nullable=True) # JSON list of imported file names
+    mode = Column(String(20), nullable=True) # preview or commit
+    started_at = Column(DateTime, nullable=False, index=True)
+    duration_ms = Column(Float, nullable=True)
+    status = Column(String(20), nullable=False) # success or error
+    error = Column(Text, nullable=True)
+    rows = Column(Integer, nullable=True)
+    spans = Column(Text, nullable=True) # JSON list of {stage, offset_ms, duration_ms, rows}
+
+    def __init__(self, run_id=None, name=None, files=None, mode=None, started_at=None, duration_ms=None, status=None, error=None, rows=None, spans=None):
+        self.run_id = run_id
+        self.name = name
+        self.files = files
+        self.mode = mode
+        self.started_at = started_at
+        self.duration_ms = duration_ms
+        self.status = status
+        self.error = error
+        self.rows = rows
+        self.spans = spans
+
+    def __repr__(self):
+        return '<ImportRun %r>' % (self.run_id)
+
+class DataVersion(Base):
+    __tablename__ = 'data_version'
+    id = Column(Integer, primary_key=True)
+    table_name = Column(String(64), unique=True, nullable=False)
+    version = Column(Integer, nullable=False, default=0) # Incremented by every commit that changes the table
+    rewritten = Column(Integer, nullable=False, default=0) # Incremented by commits that update or delete rows, not only insert
+    updated_at = Column(DateTime, nullable=True)
+
+    def __init__(self, table_name=None, version=0, rewritten=0, updated_at=None):
+        self.table_name = table_name
+        self.version = version
+        self.rewritten = rewritten
+        self.updated_at = updated_at
+
+    def __repr__(self):
+        return '<DataVersion %r %r>' % (self.table_name, self.version)
+
+class CategoryRule(Base):
+    __tablename__ = 'category_rules'
+    id = Column(Integer, primary_key=True)
+    category = Column(String(60), nullable=False)
+    pattern = Column(String(255), nullable=False) # Matched case-insensitively against the narration
+    kind = Column(String(20), nullable=False, default='keyword') # keyword, upi or merchant (with * wildcards)
+    priority = Column(Integer, nullable=False, default=0) # The highest priority matching rule wins
+
+    def __init__(self, category=None, pattern=None, kind='keyword', priority=0):
+        self.category = category
+        self.pattern = pattern
+        self.kind = kind
+        self.priority = priority
+
+    def __repr__(self):
+        return '<CategoryRule %r %r>' % (self.category, self.pattern)
+
+class ScheduledJob(Base):
+    __tablename__ = 'scheduled_jobs'
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50), unique=True, nullable=False) # One of scheduler.JOBS
+    schedule = Column(String(50), nullable=False) # e.g. 'every 15m' or 'daily 06:30'; 'off' disables the job
+    next_run_at = Column(DateTime, nullable=True, index=True)
+    last_started_at = Column(DateTime, nullable=True)
+    last_duration_ms = Column(Float, nullable=True)
+    last_status = Column(String(20), nullable=True) # success or error
+    last_result = Column(Text, nullable=True) # JSON returned by the job, or the error
+    locked_by = Column(String(100), nullable=True) # host:pid of the worker running the job
+    locked_until = Column(DateTime, nullable=True) # The lock lapses after this, should that worker die
+
+    def __init__(self, name=None, schedule=None, next_run_at=None):
+        self.name = name
+        self.schedule = schedule
+        self.next_run_at = next_run_at
+
+    def __repr__(self):
+        return '<ScheduledJob %r>' % (self.name)
+
+class IngestedFile(Base):
+    __tablename__ = 'ingested_files'
+    id = Column(Integer, primary_key=True)
+    sha256 = Column(String(64), unique=True, nullable=False) # Content hash; the same statement dropped again is not imported again
+    path = Column(String(500), nullable=False)
+    size = Column(Integer, nullable=False)
+    modified_at = Column(Float, nullable=False) # The file's mtime when it was picked up
+    kind = Column(String(20), nullable=True) # mutual_funds or balances
+    status = Column(String(20), nullable=False) # processing, imported, failed or skipped
+    error = Column(Text, nullable=True)
+    rows = Column(Integer, nullable=True)
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+
+    def __init__(self, sha256=None, path=None, size=None, modified_at=None, kind=None, status='processing', error=None, rows=None, started_at=None, finished_at=None):
+        self.sha256 = sha256
+        self.path = path
+        self.size = size
+        self.modified_at = modified_at
+        self.kind = kind
+        self.status = status
+        self.error = error
+        self.rows = rows
+        self.started_at = started_at
+        self.finished_at = finished_at
+
+    def __repr__(self):
+        return '<IngestedFile %r>' % (self.path)
+
+class NavHistory(Base):
+    __tablename__ = 'nav_history'
+    __table_args__ = (UniqueConstraint('fund_code', 'date', name='uq_nav_history_fund_date'),)
+    id = Column(Integer, primary_key=True)
+    fund_code = Column(String(20), nullable=False) # Scheme code, as in Fund.fund_code
+    date = Column(DateTime, nullable=False) # The day the NAV was published for
+    nav = Column(Float, nullable=False)
+
+    def __init__(self, fund_code=None, date=None, nav=None):
+        self.fund_code = fund_code
+        self.date = date
+        self.nav = nav
+
+    def __repr__(self):
+        return '<NavHistory %r %r>' % (self.fund_code, self.date)
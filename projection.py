@@ -0,0 +1,227 @@
+"""
+Monte Carlo projection of what the portfolio may be worth on a future date.
+
+Every path starts from the current value of the funds held and, month by month:
+  - invests the SIPs inferred from the transactions: funds bought in at least SIP_MIN_MONTHS of
+    the last SIP_LOOKBACK_MONTHS months, at the median amount bought in those months
+  - reinvests the maturity value of every open fixed deposit in the month after it matures
+    (until then the deposit counts at its accrued value)
+  - grows by a monthly return drawn at random, with replacement, from the monthly returns of the
+    funds held in their current proportions (metrics.portfolio_index over nav_history); months are
+    drawn in blocks of BLOCK_MONTHS consecutive months, so runs of good and bad months survive
+The value of all paths is percentiled at every year from now and at the target date; a last
+partial month up to the target grows by its drawn return pro rata.
+
+All paths advance together as arrays, one month at a time; they are simulated in chunks of
+CHUNK_PATHS, each with its own random stream spawned from the seed, so the result is the same
+whether the chunks run in this process or are spread over a process pool.
+
+Usage:
+    python projection.py --target 2045-03-31 --paths 100000 --workers 4 --goal 50000000
+"""
+import argparse
+import concurrent.futures
+import datetime
+import logging
+import sys
+import numpy as np
+from models import Fund, FixedDeposit, MutualFundTransaction, NavHistory
+from cache import shared_cache
+from dataversion import data_versions
+from fdengine import add_months, compute_fixed_deposits, months_between
+from metrics import _digest, load_nav_series, portfolio_index
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (5, 25, 50, 75, 95)
+DEFAULT_PATHS = 10000
+MAX_PATHS = 1000000
+MAX_YEARS = 50
+CHUNK_PATHS = 25000 # Paths simulated together; bounds the memory of one chunk to a few MB
+BLOCK_MONTHS = 3 # Consecutive historical months drawn together
+MIN_HISTORY_MONTHS = 12 # Fewer monthly returns than this and there is nothing to draw from
+SIP_LOOKBACK_MONTHS = 6
+SIP_MIN_MONTHS = 4
+PROJECTION_CACHE_TTL = 24 * 60 * 60
+
+def monthly_returns(grid, index):
+    """Returns of a daily index from the last NAV of one calendar month to the last of the next."""
+    months = grid.astype('datetime64[M]')
+    month_end = np.r_[months[1:] != months[:-1], True]
+    values = index[month_end]
+    return values[1:] / values[:-1] - 1
+
+def infer_sips(snapshot, as_of, lookback=SIP_LOOKBACK_MONTHS, min_months=SIP_MIN_MONTHS):
+    """
+    Funds bought in at least min_months of the lookback complete months before as_of, with the
+    median amount bought in those months. Returns a list of dicts with fund_name, fund_code,
+    monthly_amount and months.
+    """
+    transactions = snapshot.transactions
+    first_month = np.datetime64(as_of, 'M') - lookback
+    months = transactions['timestamp'].astype('datetime64[M]')
+    offsets = (months - first_month).astype(np.int64)
+    recent = (transactions['kind'] == 1) & (transactions['carried'] == 0) & (offsets >= 0) & (offsets < lookback)
+    bought = np.zeros((len(snapshot.fund_names), lookback))
+    np.add.at(bought, (transactions['fund'][recent], offsets[recent]), np.abs(transactions['amount'][recent]))
+    months_bought = (bought > 0).sum(axis=1)
+    return [{'fund_name': snapshot.fund_names[fund], 'fund_code': snapshot.fund_codes[fund],
+             'monthly_amount': float(np.median(bought[fund][bought[fund] > 0])), 'months': int(months_bought[fund])}
+            for fund in np.flatnonzero(months_bought >= min_months)]
+
+def _simulate(task):
+    """
+    Simulates one chunk of paths: (returns, start value, contributions per month, checkpoint months,
+    paths, seed sequence, block months, fraction of the last month) -> paths x checkpoints values.
+    """
+    returns, start_value, contributions, checkpoints, paths, seed, block, last_fraction = task
+    rng = np.random.default_rng(seed)
+    months = len(contributions)
+    block = min(block, len(returns))
+    starts = rng.integers(0, len(returns) - block + 1, size=(paths, -(-months // block)))
+    values = np.full(paths, start_value, dtype=np.float64)
+    recorded = np.empty((paths, len(checkpoints)))
+    column = 0
+    for month in range(months):
+        values += contributions[month]
+        growth = 1 + returns[starts[:, month // block] + month % block]
+        values *= growth ** last_fraction if month == months - 1 else growth
+        while column < len(checkpoints) and checkpoints[column] == month + 1:
+            recorded[:, column] = values
+            column += 1
+    return recorded
+
+def simulate(returns, start_value, contributions, checkpoints, paths=DEFAULT_PATHS, workers=1, seed=0, block=BLOCK_MONTHS,
+             last_fraction=1.0):
+    """
+    Values of `paths` paths after each of the checkpoint months (1-based, ascending), as a paths x
+    checkpoints array. contributions[m] is invested at the start of month m; each month's return is
+    bootstrapped from `returns` in blocks, the last month's compounded over last_fraction of it.
+    workers > 1 spreads the chunks over a process pool.
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    contributions = np.asarray(contributions, dtype=np.float64)
+    sizes = [min(CHUNK_PATHS, paths - start) for start in range(0, paths, CHUNK_PATHS)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(returns, start_value, contributions, list(checkpoints), size, chunk_seed, block, last_fraction) for size, chunk_seed in zip(sizes, seeds)]
+    if workers == 1 or len(tasks) == 1:
+        chunks = [_simulate(task) for task in tasks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            chunks = list(executor.map(_simulate, tasks))
+    return np.concatenate(chunks)
+
+def project(series, holdings, sips, fixed_deposits, target, today, paths=DEFAULT_PATHS, goal=None, workers=1, seed=0):
+    """
+    Projects the portfolio from `today` to `target`. holdings is fund code -> current value (funds
+    without a code or NAV history still count towards the starting value, growing like the rest),
+    sips the monthly amounts from infer_sips() and fixed_deposits the open deposits. Returns None
+    without MIN_HISTORY_MONTHS of monthly returns.
+    """
+    history = portfolio_index(series, {code: value for code, value in holdings.items() if code and value > 0})
+    returns = monthly_returns(*history) if history else np.zeros(0)
+    if len(returns) < MIN_HISTORY_MONTHS:
+        return None
+
+    today, target = np.datetime64(today, 'D'), np.datetime64(target, 'D')
+    # Whole months, and the part of one more that reaches the target
+    months = int(months_between(today, target))
+    last_fraction = 1.0
+    if add_months(today, months) < target:
+        month_start, month_end = add_months(today, months), add_months(today, months + 1)
+        last_fraction = float((target - month_start) / (month_end - month_start))
+        months += 1
+    checkpoints = sorted(set(range(12, months, 12)) | {months})
+    dates = add_months(today, np.array(checkpoints))
+    dates[-1] = target
+    monthly_sip = sum(sip['monthly_amount'] for sip in sips)
+    contributions = np.full(months, monthly_sip)
+
+    # A deposit's maturity value joins the paths the month after it matures; until then it counts at its accrued value
+    deposits = compute_fixed_deposits(fixed_deposits, today.astype(datetime.date))
+    ends = np.array([fd.closure_date or fd.maturity_date for fd in fixed_deposits], dtype='datetime64[s]').astype('datetime64[D]')
+    joins = np.where(ends > today, months_between(today, ends) + 1, 0)
+    np.add.at(contributions, joins[joins < months], deposits['maturity_value'][joins < months])
+    accrued = np.zeros(len(checkpoints))
+    for column, (checkpoint, date) in enumerate(zip(checkpoints, dates)):
+        waiting = joins >= checkpoint
+        if waiting.any():
+            accrued[column] = compute_fixed_deposits(fixed_deposits, date.astype(datetime.date))['current_value'][waiting].sum()
+
+    start_value = float(sum(value for value in holdings.values() if value > 0))
+    values = simulate(returns, start_value, contributions, checkpoints, paths, workers, seed, last_fraction=last_fraction) + accrued
+    bands = np.percentile(values, PERCENTILES, axis=0)
+    invested = start_value + deposits['current_value'].sum() + monthly_sip * np.array(checkpoints)
+    years = len(returns) / 12
+    growth = float(np.prod(1 + returns) ** (1 / years) - 1)
+    return {
+        'start': str(today), 'target': str(dates[-1]), 'months': months, 'paths': paths, 'percentiles': list(PERCENTILES),
+        'start_value': start_value, 'fixed_deposits_value': float(deposits['current_value'].sum()),
+        'monthly_sip': monthly_sip, 'sips': sips,
+        'history': {'months': len(returns), 'annual_return': growth, 'volatility': float(returns.std(ddof=1) * np.sqrt(12))},
+        'bands': [{'date': str(date), 'invested': float(paid), 'values': band.tolist(),
+                   'goal_probability': float((column >= goal).mean()) if goal else None}
+                  for date, paid, band, column in zip(dates, invested, bands.T, values.T)],
+        'goal': goal,
+    }
+
+def goal_projection(db_session, snapshot, target, paths=DEFAULT_PATHS, goal=None, monthly_sip=None, workers=1, seed=0):
+    """
+    project() for the holdings in the snapshot as of today, with the SIPs inferred from its
+    transactions (or a single SIP of monthly_sip instead) and the fixed deposits not closed.
+    Memoized in the shared cache for the day, until the transactions, funds, deposits or NAV history change.
+    """
+    today = datetime.date.today()
+    if not add_months(np.datetime64(today, 'D'), 1) <= np.datetime64(target, 'D') <= add_months(np.datetime64(today, 'D'), 12 * MAX_YEARS):
+        raise ValueError(f"target must be between a month and {MAX_YEARS} years from today")
+    if not 0 < paths <= MAX_PATHS:
+        raise ValueError(f"paths must be between 1 and {MAX_PATHS}")
+    tables = {MutualFundTransaction.__tablename__, Fund.__tablename__, FixedDeposit.__tablename__, NavHistory.__tablename__}
+    versions = data_versions(db_session, tables)
+    key = f"projection:{today.isoformat()}:{_digest(versions)}:{target.isoformat()}:{paths}:{goal}:{monthly_sip}:{seed}"
+
+    def compute():
+        values = snapshot.units_held() * np.nan_to_num(np.asarray(snapshot.navs))
+        holdings = {}
+        for code, value in zip(snapshot.fund_codes, values.tolist()):
+            holdings[code] = holdings.get(code, 0) + value
+        sips = infer_sips(snapshot, today) if monthly_sip is None else \
+            [{'fund_name': None, 'fund_code': None, 'monthly_amount': float(monthly_sip), 'months': None}]
+        fixed_deposits = db_session.query(FixedDeposit).filter(FixedDeposit.status != 'closed').all()
+        series = load_nav_series(db_session, [code for code in holdings if code], today)
+        return project(series, holdings, sips, fixed_deposits, target, today, paths, goal, workers, seed)
+
+    return shared_cache.get_or_set(key, compute, ttl=PROJECTION_CACHE_TTL)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Project the portfolio value to a target date.')
+    parser.add_argument('--target', type=datetime.date.fromisoformat, required=True, help='date to project to (YYYY-MM-DD)')
+    parser.add_argument('--paths', type=int, default=DEFAULT_PATHS, help='simulated paths')
+    parser.add_argument('--workers', type=int, default=1, help='processes simulating the paths')
+    parser.add_argument('--goal', type=float, default=None, help='report the chance of reaching this value')
+    parser.add_argument('--sip', type=float, default=None, help='monthly investment instead of the inferred SIPs')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    from app import create_app, db_session, init_db, analytics_snapshot
+    app = create_app()
+    with app.app_context():
+        init_db()
+        try:
+            report = goal_projection(db_session, analytics_snapshot(), args.target, args.paths, args.goal, args.sip, args.workers, args.seed)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+    if report is None:
+        print(f"Less than {MIN_HISTORY_MONTHS} months of NAV history for the funds held; refresh it first", file=sys.stderr)
+        return 1
+    print(f"{report['start_value']:.0f} in funds, {report['fixed_deposits_value']:.0f} in deposits, {report['monthly_sip']:.0f} a month "
+          f"({len(report['sips'])} SIPs), {report['paths']} paths over {report['history']['months']} months of history")
+    print('date        invested  ' + '  '.join(f"p{p:<11}" for p in report['percentiles']) + ('  goal' if report['goal'] else ''))
+    for band in report['bands']:
+        print(f"{band['date']}  {band['invested']:<9.0f} " + '  '.join(f"{value:<12.0f}" for value in band['values'])
+              + (f"  {band['goal_probability']:.0%}" if report['goal'] else ''))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""
+Balance reconciliation: checks that the account balance rows of each bank form an unbroken chain,
+every row's closing balance being the previous one's plus its deposit minus its withdrawal.
+
+    python reconcile.py              # audit the whole history
+    python reconcile.py --json
+
+Reports three kinds of issue per bank:
+  breaks      rows whose opening balance (closing balance - deposit + withdrawal) isn't the
+              closing balance before them: a missing or mistyped row, or a statement that
+              doesn't follow on from the one before
+  gaps        stretches of more than gap_days without any row, e.g. a statement never imported
+  duplicates  runs of rows repeating an earlier row of the bank (same date, amounts and closing
+              balance), e.g. a statement imported twice
+Every check works on whole columns at once, so auditing millions of rows takes seconds.
+"""
+import argparse
+import json
+import sys
+import numpy as np
+from models import AccountBalance
+
+TOLERANCE = 0.01 # Rupees of rounding allowed between balances
+GAP_DAYS = 35 # A month's statement, and a few days' grace
+MAX_ISSUES = 1000 # Issues of each kind listed in a report; all are counted
+
+def _cents(values):
+    return np.rint(np.asarray(values, dtype=np.float64) * 100).astype(np.int64)
+
+def _day(value):
+    return str(np.datetime64(int(value), 'D'))
+
+def _midnight(value):
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _groups(*columns):
+    """
+    Numbers the distinct combinations of the columns (the first varying slowest). Returns each
+    row's group, and each group's first row.
+    """
+    order = np.lexsort(columns[::-1])
+    changes = np.ones(len(order), dtype=bool)
+    changes[1:] = np.any([column[order][1:] != column[order][:-1] for column in columns], axis=0)
+    groups = np.empty(len(order), dtype=np.int64)
+    groups[order] = np.cumsum(changes) - 1
+    # lexsort is stable, so each group's rows come in row order
+    return groups, order[changes]
+
+def _linked(banks, days, previous_days, closing_cents, opening_cents, rows):
+    """
+    Whether each of `rows` has the closing balance of another row of its bank, on its own day or the
+    bank's previous day with rows, equal to its opening balance. Rows of one day aren't always stored
+    in the order the bank applied them (statements list credits and debits separately), so the row
+    before one in the table isn't necessarily the one it follows on from.
+    """
+    if not len(rows):
+        return np.zeros(0, dtype=bool)
+    # Number each (bank, balance) pair, then look the opening balances up among the closing balances
+    # by (pair, day): one sorted key per closing balance, one range of keys per row checked
+    pair_ids = _groups(np.r_[banks, banks[rows]], np.r_[closing_cents, opening_cents[rows]])[0]
+    first_day = days.min()
+    span = np.int64(days.max() - first_day + 1)
+    keys = np.sort(pair_ids[:len(banks)] * span + (days - first_day))
+    lo = pair_ids[len(banks):] * span + (previous_days[rows] - first_day)
+    hi = pair_ids[len(banks):] * span + (days[rows] - first_day)
+    matches = np.searchsorted(keys, hi, 'right') - np.searchsorted(keys, lo, 'left')
+    # A row that changes nothing matches itself
+    matches -= closing_cents[rows] == opening_cents[rows]
+    return matches > 0
+
+def reconcile(ids, dates, banks, closing_balances, deposits, withdrawals, bank_names, tolerance=TOLERANCE, gap_days=GAP_DAYS,
+              max_issues=MAX_ISSUES):
+    """
+    Reconciles account balance rows given as columns: ids (the table order within a day), dates,
+    bank indexes into bank_names, closing balances, deposits and withdrawals. Returns
+    {'rows', 'ok', 'counts', 'accounts', 'breaks', 'gaps', 'duplicates'}: counts and accounts give
+    the number of issues of each kind (overall and per bank), and the lists the first max_issues of each.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    days = np.asarray(dates).astype('datetime64[D]').astype(np.int64)
+    banks = np.asarray(banks, dtype=np.int64)
+    order = np.lexsort((ids, days, banks))
+    ids, days, banks = ids[order], days[order], banks[order]
+    closing = np.asarray(closing_balances, dtype=np.float64)[order]
+    net = (np.asarray(deposits, dtype=np.float64) - np.asarray(withdrawals, dtype=np.float64))[order]
+    opening = closing - net
+    n = len(ids)
+    if not n:
+        return {'rows': 0, 'ok': True, 'counts': {'breaks': 0, 'gaps': 0, 'duplicates': 0, 'duplicate_runs': 0}, 'accounts': [],
+                'breaks': [], 'gaps': [], 'duplicates': []}
+
+    same_bank = banks[1:] == banks[:-1]
+    new_day = np.r_[True, ~same_bank | (days[1:] != days[:-1])]
+    # The bank's previous day with rows (the row's own day for the bank's first day)
+    day_start = np.maximum.accumulate(np.where(new_day, np.arange(n), 0))
+    after_previous_day = np.maximum(day_start - 1, 0)
+    previous_days = np.where((day_start > 0) & (banks[after_previous_day] == banks), days[after_previous_day], days)
+    idle_days = days - previous_days
+
+    # Breaks: compare each row with the one before it, and look further only for those that don't
+    # follow on (and each bank's first row, which may not be the first the bank applied that day)
+    difference = opening[1:] - closing[:-1]
+    bank_start = np.r_[True, ~same_bank]
+    suspects = np.flatnonzero(bank_start | np.r_[False, np.abs(difference) > tolerance])
+    closing_cents, opening_cents = _cents(closing), _cents(opening)
+    unlinked = suspects[~_linked(banks, days, previous_days, closing_cents, opening_cents, suspects)]
+    # One row on a bank's first day has nothing before it: the account's opening row
+    first_days = days[np.maximum.accumulate(np.where(bank_start, np.arange(n), 0))]
+    on_first_day = unlinked[days[unlinked] == first_days[unlinked]]
+    breaks = np.setdiff1d(unlinked, on_first_day[np.unique(banks[on_first_day], return_index=True)[1]])
+
+    # Gaps: the first row after a long stretch without any
+    gaps = np.flatnonzero(new_day & (idle_days > gap_days))
+
+    # Duplicates: rows with the same day, amounts and closing balance as an earlier row of the bank,
+    # grouped into runs of rows stored one after another (by id), as a statement imported twice is
+    groups, first = _groups(banks, days, _cents(np.asarray(deposits, dtype=np.float64)[order]),
+                            _cents(np.asarray(withdrawals, dtype=np.float64)[order]), closing_cents)
+    original = first[groups]
+    duplicate = original != np.arange(n)
+    stored_order = np.lexsort((ids, banks))
+    stored_duplicate = duplicate[stored_order]
+    same_bank_stored = banks[stored_order][1:] == banks[stored_order][:-1]
+    run_starts = np.flatnonzero(stored_duplicate & ~np.r_[False, stored_duplicate[:-1] & same_bank_stored])
+    run_ends = np.flatnonzero(stored_duplicate & ~np.r_[stored_duplicate[1:] & same_bank_stored, False])
+    run_days = days[stored_order]
+
+    def count(rows):
+        return np.bincount(banks[rows], minlength=len(bank_names))
+
+    per_bank = {'rows': np.bincount(banks, minlength=len(bank_names)), 'breaks': count(breaks), 'gaps': count(gaps),
+                'duplicates': count(np.flatnonzero(duplicate))}
+    accounts = [{'bank': bank_names[bank], **{name: int(values[bank]) for name, values in per_bank.items()}}
+                for bank in np.flatnonzero(per_bank['rows'])]
+    return {
+        'rows': n,
+        'ok': not (len(breaks) or len(gaps) or len(run_starts)),
+        'counts': {'breaks': len(breaks), 'gaps': len(gaps), 'duplicates': int(duplicate.sum()), 'duplicate_runs': len(run_starts)},
+        'accounts': accounts,
+        'breaks': [{'bank': bank_names[banks[i]], 'id': int(ids[i]), 'date': _day(days[i]), 'expected_opening': round(float(closing[i - 1]), 2),
+                    'opening': round(float(opening[i]), 2), 'difference': round(float(opening[i] - closing[i - 1]), 2),
+                    'after_gap': bool(idle_days[i] > gap_days)} for i in breaks[:max_issues]],
+        'gaps': [{'bank': bank_names[banks[i]], 'id': int(ids[i]), 'from': _day(previous_days[i]), 'to': _day(days[i]),
+                  'days': int(idle_days[i])} for i in gaps[:max_issues]],
+        'duplicates': [{'bank': bank_names[banks[stored_order[start]]], 'from': _day(run_days[start:end + 1].min()),
+                        'to': _day(run_days[start:end + 1].max()), 'rows': int(end - start + 1), 'first_id': int(ids[stored_order[start]]),
+                        'last_id': int(ids[stored_order[end]]), 'duplicate_of': int(ids[original[stored_order[start]]])}
+                       for start, end in zip(run_starts[:max_issues], run_ends[:max_issues])],
+    }
+
+def audit_balances(snapshot, tolerance=TOLERANCE, gap_days=GAP_DAYS):
+    """Reconciles every account balance row, from the columnar snapshot."""
+    balances = snapshot.balances
+    return reconcile(balances['id'], balances['date'], balances['bank'], balances['closing_balance'], balances['deposit_amt'],
+                     balances['withdrawal_amt'], snapshot.banks, tolerance, gap_days)
+
+def check_new_balances(db_session, entries, tolerance=TOLERANCE, gap_days=GAP_DAYS):
+    """
+    Reconciles AccountBalance entries about to be imported (in import order) with the rows already
+    stored before them: the bank's last day of rows up to the first new date, and any stored since.
+    Returns the reconcile() report, with only the issues the new entries bring.
+    """
+    if not entries:
+        return reconcile([], np.array([], dtype='datetime64[s]'), [], [], [], [], [], tolerance, gap_days)
+    bank_names = sorted({entry.bank for entry in entries}, key=str)
+    stored = []
+    # The entries may already be in the session; they mustn't be flushed and read back as stored rows
+    with db_session.no_autoflush:
+        for bank in bank_names:
+            first_date = min(entry.date for entry in entries if entry.bank == bank)
+            seam = (db_session.query(AccountBalance.date).filter(AccountBalance.bank == bank, AccountBalance.date <= first_date)
+                    .order_by(AccountBalance.date.desc()).limit(1).scalar())
+            query = db_session.query(AccountBalance.id, AccountBalance.date, AccountBalance.bank, AccountBalance.closing_balance,
+                                     AccountBalance.deposit_amt, AccountBalance.withdrawal_amt).filter(AccountBalance.bank == bank)
+            if seam is not None:
+                query = query.filter(AccountBalance.date >= _midnight(seam))
+            else:
+                query = query.filter(AccountBalance.date > first_date)
+            stored += query.all()
+    # The new entries have no ids yet; number them after the stored rows, in import order
+    first_new_id = max((row.id for row in stored), default=0) + 1
+    rows = stored + [(first_new_id + i, entry.date, entry.bank, entry.closing_balance, entry.deposit_amt, entry.withdrawal_amt)
+                     for i, entry in enumerate(entries)]
+    ids, dates, banks, closing, deposits, withdrawals = zip(*rows)
+    report = reconcile(ids, np.array(dates, dtype='datetime64[s]'), [bank_names.index(bank) for bank in banks],
+                       *(np.nan_to_num(np.array(values, dtype=np.float64)) for values in (closing, deposits, withdrawals)),
+                       bank_names, tolerance, gap_days)
+    report['breaks'] = [issue for issue in report['breaks'] if issue['id'] >= first_new_id]
+    report['gaps'] = [issue for issue in report['gaps'] if issue['id'] >= first_new_id]
+    report['duplicates'] = [issue for issue in report['duplicates'] if issue['last_id'] >= first_new_id]
+    report['counts'] = {'breaks': len(report['breaks']), 'gaps': len(report['gaps']),
+                        'duplicates': sum(issue['rows'] for issue in report['duplicates']), 'duplicate_runs': len(report['duplicates'])}
+    report['rows'] = len(entries)
+    report['accounts'] = [{'bank': bank, 'rows': sum(entry.bank == bank for entry in entries),
+                           **{kind: sum(issue['rows'] if kind == 'duplicates' else 1 for issue in report[kind] if issue['bank'] == bank)
+                              for kind in ('breaks', 'gaps', 'duplicates')}} for bank in bank_names]
+    report['ok'] = not (report['breaks'] or report['gaps'] or report['duplicates'])
+    return report
+
+def describe(report):
+    """One line per issue, for logs and flash messages."""
+    lines = [f"{issue['bank']}: balance on {issue['date']} doesn't follow on from the row before "
+             f"(opens at {issue['opening']:,.2f}, expected {issue['expected_opening']:,.2f})" for issue in report['breaks']]
+    lines += [f"{issue['bank']}: no rows from {issue['from']} to {issue['to']} ({issue['days']} days)" for issue in report['gaps']]
+    lines += [f"{issue['bank']}: {issue['rows']} row(s) from {issue['from']} to {issue['to']} repeat earlier rows" for issue in report['duplicates']]
+    return lines
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--gap-days', type=int, default=GAP_DAYS, help='days without rows reported as a gap')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    from app import create_app, db_session, init_db
+    from snapshot import get_snapshot
+    app = create_app()
+    with app.app_context():
+        init_db()
+        report = audit_balances(get_snapshot(db_session, app.config['SNAPSHOT_DIR']), args.tolerance, args.gap_days)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        counts = report['counts']
+        print(f"{report['rows']} rows in {len(report['accounts'])} accounts: {counts['breaks']} breaks, {counts['gaps']} gaps, "
+              f"{counts['duplicates']} duplicate rows in {counts['duplicate_runs']} runs")
+        for line in describe(report):
+            print(f"  {line}")
+    return 0 if report['ok'] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,338 @@
+"""
+Maintenance jobs run in the background by the web workers, off the request path.
+
+Every job has a row in the scheduled_jobs table with its schedule, when it runs next and how its
+last run went. Each worker process runs a Scheduler thread that wakes up every TICK_SECONDS and runs
+the jobs that are due; a job is claimed with a single conditional UPDATE first, so however many
+workers see it due, only one runs it. A worker that dies mid-job holds the claim until
+locked_until, after which another worker retries the job.
+
+    python scheduler.py list              # the jobs, their schedules and last runs
+    python scheduler.py run warm_caches   # run one job now, in this process
+"""
+import argparse
+import datetime
+import glob
+import json
+import logging
+import os
+import re
+import socket
+import sys
+import tempfile
+import threading
+import time
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+from models import FixedDeposit, ScheduledJob
+from analytics import REPORTS, analytics
+from cache import shared_cache
+from mfapi import mfapi
+from fdengine import compute_fixed_deposits
+from snapshot import get_snapshot
+from metrics import sync_nav_history
+from archive import PARQUET_INSTALLED, archive, horizon_for
+from reconcile import audit_balances as reconcile_balances, describe as describe_reconciliation
+
+logger = logging.getLogger(__name__)
+
+TICK_SECONDS = 30
+LEASE = datetime.timedelta(hours=1) # Longer than any job takes
+TEMP_FILE_MAX_AGE = 6 * 3600 # seconds
+
+# When each job runs unless app.config['SCHEDULE'] says otherwise:
+# 'every <n>m', 'every <n>h', 'every <n>d', 'daily HH:MM' (local time) or 'off'
+DEFAULT_SCHEDULE = {
+    'mature_fixed_deposits': 'daily 00:05',
+    'refresh_analytics': 'every 15m',
+    'prune_files': 'daily 03:00',
+    'warm_caches': 'daily 06:30',
+    'audit_balances': 'daily 04:00',
+    'refresh_nav_history': 'daily 06:00',
+    'archive_history': 'daily 02:30',
+}
+
+# Pages and chart data requested by warm_caches, so the first visitors of the day find them cached
+WARM_ROUTES = ['/', '/balances', '/performance', '/fixed_deposits', '/spending',
+               '/api/charts/portfolio', '/api/charts/balances', '/api/metrics', '/api/correlation'] + [f'/api/analytics/{report}' for report in REPORTS]
+
+AUDIT_LOG_LINES = 20 # Issues audit_balances logs; the rest are in /api/reconciliation
+
+INTERVAL_UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days'}
+
+def next_run(schedule, after):
+    """Returns when a job on `schedule` runs next after the datetime `after`, or None when it is off."""
+    spec = ' '.join(schedule.lower().split())
+    if spec == 'off':
+        return None
+    match = re.fullmatch(r'every (\d+) ?([mhd])', spec)
+    if match and int(match[1]) > 0:
+        return after + datetime.timedelta(**{INTERVAL_UNITS[match[2]]: int(match[1])})
+    match = re.fullmatch(r'daily (\d{1,2}):(\d{2})', spec)
+    if match and int(match[1]) < 24 and int(match[2]) < 60:
+        at = after.replace(hour=int(match[1]), minute=int(match[2]), second=0, microsecond=0)
+        return at if at > after else at + datetime.timedelta(days=1)
+    raise ValueError(f"Invalid schedule: {schedule}")
+
+def parse_schedule(text):
+    """Parses the SCHEDULE environment variable, e.g. 'warm_caches=daily 07:00; prune_files=off'."""
+    schedule = {}
+    for item in filter(None, (item.strip() for item in (text or '').split(';'))):
+        name, _, spec = item.partition('=')
+        schedule[name.strip()] = spec.strip()
+    return schedule
+
+def mature_fixed_deposits(app, db_session):
+    """Marks open deposits past their maturity date as matured, with the interest they earned."""
+    now = datetime.datetime.now()
+    due = db_session.query(FixedDeposit).filter(FixedDeposit.status == 'open', FixedDeposit.maturity_date <= now).all()
+    if due:
+        maturity_values = compute_fixed_deposits(due, now)['maturity_value']
+        for fd, maturity_value in zip(due, maturity_values.tolist()):
+            fd.status = 'matured'
+            fd.closure_date = fd.maturity_date
+            fd.total_interest_earned = maturity_value - fd.amount
+        db_session.commit()
+    return {'matured': [fd.id for fd in due]}
+
+def refresh_analytics(app, db_session):
+    """Brings the columnar snapshot and the roll-up reports up to date with the data."""
+    snapshot = get_snapshot(db_session, app.config['SNAPSHOT_DIR'])
+    analytics.run(REPORTS, snapshot)
+    return {'versions': snapshot.versions, 'transactions': len(snapshot.transactions), 'balances': len(snapshot.balances)}
+
+def _remove_older(paths, cutoff):
+    removed = 0
+    for path in paths:
+        try:
+            if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError as e:
+            logger.warning(f"Could not remove {path}: {e}")
+    return removed
+
+def prune_files(app, db_session):
+    """
+    Removes uploaded statements older than UPLOAD_RETENTION_DAYS, decrypted PDF copies and snapshot
+    files left behind by interrupted imports and rebuilds, expired shared cache entries and mfapi.in
+    responses not fetched for a month.
+    """
+    from fileparse import TEMP_PREFIX
+    now = time.time()
+    result = {
+        'uploads': _remove_older(glob.glob(os.path.join(app.config['UPLOAD_FOLDER'], '*')),
+                                 now - app.config['UPLOAD_RETENTION_DAYS'] * 86400),
+        'temp_files': _remove_older(glob.glob(os.path.join(tempfile.gettempdir(), f'{TEMP_PREFIX}*.pdf')), now - TEMP_FILE_MAX_AGE),
+    }
+    if app.config['SNAPSHOT_DIR']:
+        result['temp_files'] += _remove_older(glob.glob(os.path.join(app.config['SNAPSHOT_DIR'], '*.tmp')), now - TEMP_FILE_MAX_AGE)
+    result['cache_entries'] = shared_cache.prune()
+    result['http_cache_entries'] = mfapi.prune()
+    return result
+
+def warm_caches(app, db_session):
+    """Requests the dashboard pages and chart data once, filling the snapshot, report and response caches."""
+    client = app.test_client()
+    timings = {}
+    for route in WARM_ROUTES:
+        start = time.perf_counter()
+        response = client.get(route)
+        timings[route] = {'status': response.status_code, 'ms': round((time.perf_counter() - start) * 1000, 1)}
+    return timings
+
+def audit_balances(app, db_session):
+    """Reconciles the whole balance history, logging breaks, gaps and duplicated rows."""
+    report = reconcile_balances(get_snapshot(db_session, app.config['SNAPSHOT_DIR']))
+    if not report['ok']:
+        logger.warning(f"Balance audit: {report['counts']}; /api/reconciliation lists them")
+        for line in describe_reconciliation(report)[:AUDIT_LOG_LINES]:
+            logger.warning(line)
+    return dict(report['counts'], rows=report['rows'])
+
+def refresh_nav_history(app, db_session):
+    """Stores the NAVs published since the last run, for the fund metrics."""
+    return sync_nav_history(db_session)
+
+def archive_history(app, db_session):
+    """Moves balance and transaction rows older than ARCHIVE_HORIZON_DAYS to the Parquet archive, see archive.py."""
+    if not app.config['ARCHIVE_HORIZON_DAYS'] or not app.config['ARCHIVE_DIR']:
+        return {'skipped': 'ARCHIVE_HORIZON_DAYS is not set'}
+    if not PARQUET_INSTALLED:
+        return {'skipped': 'pyarrow is not installed'}
+    return archive(db_session, app.config['ARCHIVE_DIR'], horizon_for(app.config['ARCHIVE_HORIZON_DAYS']))
+
+JOBS = {
+    'mature_fixed_deposits': mature_fixed_deposits,
+    'refresh_analytics': refresh_analytics,
+    'prune_files': prune_files,
+    'warm_caches': warm_caches,
+    'audit_balances': audit_balances,
+    'refresh_nav_history': refresh_nav_history,
+    'archive_history': archive_history,
+}
+
+def job_schedule(app):
+    """DEFAULT_SCHEDULE with app.config['SCHEDULE'] applied; raises ValueError for unknown jobs or invalid schedules."""
+    schedule = dict(DEFAULT_SCHEDULE, **(app.config.get('SCHEDULE') or {}))
+    unknown = [name for name in schedule if name not in JOBS]
+    if unknown:
+        raise ValueError(f"Unknown jobs: {', '.join(unknown)}")
+    for spec in schedule.values():
+        next_run(spec, datetime.datetime.now())
+    return schedule
+
+class Scheduler:
+    """Runs the jobs in JOBS that are due, on a background thread of this worker process."""
+
+    def __init__(self, app, db_session, tick=TICK_SECONDS):
+        self.app = app
+        self.db_session = db_session
+        self.tick = tick
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def engine(self):
+        return self.app.extensions['engine']
+
+    def sync(self):
+        """
+        Adds a row for every job and applies schedule changes from the configuration. A new job
+        runs on the first tick; a rescheduled one at its next time on the new schedule.
+        """
+        now = datetime.datetime.now()
+        for name, spec in job_schedule(self.app).items():
+            with self.engine.begin() as connection:
+                job = connection.execute(ScheduledJob.__table__.select().where(ScheduledJob.name == name)).first()
+                if job is None:
+                    try:
+                        connection.execute(ScheduledJob.__table__.insert().values(name=name, schedule=spec, next_run_at=now))
+                    except IntegrityError:
+                        pass # Another worker added it first
+                elif job.schedule != spec:
+                    connection.execute(update(ScheduledJob).where(ScheduledJob.name == name)
+                                       .values(schedule=spec, next_run_at=next_run(spec, now)))
+
+    def _claim(self, name, now, force=False):
+        # Atomic across processes: the UPDATE only matches while the job is due and nobody holds it
+        query = update(ScheduledJob).where(ScheduledJob.name == name,
+                                           or_(ScheduledJob.locked_until.is_(None), ScheduledJob.locked_until < now))
+        if not force:
+            query = query.where(ScheduledJob.next_run_at <= now)
+        with self.engine.begin() as connection:
+            return connection.execute(query.values(locked_by=self.worker, locked_until=now + LEASE)).rowcount == 1
+
+    def run_job(self, name, force=False):
+        """
+        Runs one job if it is due (or regardless, with force) and no other worker is running it.
+        Returns the job's result, or None when it didn't run.
+        """
+        started = datetime.datetime.now()
+        if not self._claim(name, started, force):
+            return None
+        start = time.perf_counter()
+        status, result = 'success', None
+        try:
+            with self.app.app_context():
+                try:
+                    result = JOBS[name](self.app, self.db_session)
+                finally:
+                    self.db_session.remove()
+        except Exception as e:
+            logger.exception(f"Scheduled job {name} failed")
+            status, result = 'error', str(e)
+        duration_ms = (time.perf_counter() - start) * 1000
+        with self.engine.begin() as connection:
+            schedule = connection.execute(ScheduledJob.__table__.select().where(ScheduledJob.name == name)).first().schedule
+            connection.execute(update(ScheduledJob).where(ScheduledJob.name == name, ScheduledJob.locked_by == self.worker)
+                               .values(next_run_at=next_run(schedule, datetime.datetime.now()), last_started_at=started,
+                                       last_duration_ms=duration_ms, last_status=status,
+                                       last_result=json.dumps(result, default=str), locked_by=None, locked_until=None))
+        logger.info(f"Scheduled job {name}: {status} in {duration_ms:.0f} ms")
+        return result
+
+    def run_pending(self):
+        """Runs every job that is due; returns the names of those this worker ran."""
+        now = datetime.datetime.now()
+        with self.engine.connect() as connection:
+            due = connection.execute(ScheduledJob.__table__.select().where(ScheduledJob.next_run_at <= now)
+                                     .order_by(ScheduledJob.next_run_at)).all()
+        ran = []
+        for job in due:
+            if job.name in JOBS and self.run_job(job.name) is not None:
+                ran.append(job.name)
+        return ran
+
+    def _loop(self):
+        while not self._stop.wait(self.tick):
+            try:
+                self.run_pending()
+            except Exception:
+                logger.exception("Scheduler tick failed")
+
+    def start(self):
+        self.sync()
+        self._thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def start_scheduler(app, db_session):
+    """
+    Starts this process's scheduler thread, once. Call it in each worker process after it has
+    started (not before forking: threads don't survive a fork).
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None or _scheduler.worker != f"{socket.gethostname()}:{os.getpid()}":
+            _scheduler = Scheduler(app, db_session)
+            _scheduler.start()
+    return _scheduler
+
+def job_status(db_session):
+    """The rows of scheduled_jobs as dicts, for the jobs API and the command line."""
+    return [{
+        'name': job.name,
+        'schedule': job.schedule,
+        'next_run_at': job.next_run_at.isoformat() if job.next_run_at else None,
+        'last_started_at': job.last_started_at.isoformat() if job.last_started_at else None,
+        'last_duration_ms': job.last_duration_ms,
+        'last_status': job.last_status,
+        'last_result': json.loads(job.last_result) if job.last_result else None,
+        'running_on': job.locked_by,
+    } for job in db_session.query(ScheduledJob).order_by(ScheduledJob.name).all()]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help='show the jobs and their last runs')
+    run_parser = subparsers.add_parser('run', help='run a job now')
+    run_parser.add_argument('name', choices=sorted(JOBS))
+    args = parser.parse_args(argv)
+
+    from app import create_app, db_session, init_db
+    app = create_app()
+    with app.app_context():
+        init_db()
+    scheduler = Scheduler(app, db_session)
+    scheduler.sync()
+    if args.command == 'run':
+        result = scheduler.run_job(args.name, force=True)
+        if result is None:
+            print(f"{args.name} is already running on another worker")
+            return 1
+        print(json.dumps(result, indent=2, default=str))
+    with app.app_context():
+        print(json.dumps(job_status(db_session), indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import re
+from markupsafe import Markup, escape
+from sqlalchemy import text
+
+MAX_PER_PAGE = 100
+RANKED_MATCHES = 10000 # Above this many matches results are ordered by date instead of rank
+# Marks matched terms in snippets; replaced with <mark> after the snippet is escaped
+MATCH_START, MATCH_END = '\x02', '\x03'
+
+# Full-text indexes over the searchable columns, as external content tables: the text stays in the
+# source table and the index is kept in sync by the triggers below. `date` is the source table's
+# indexed date column, which orders the results newest first
+SEARCH_TABLES = {
+    'balance': {'table': 'account_balances', 'columns': ['narration', 'chq_ref_no', 'bank'], 'date': 'date'},
+    'transaction': {'table': 'mutual_fund_transactions', 'columns': ['fund_name', 'transaction_type'], 'date': 'timestamp'},
+    'fund': {'table': 'funds', 'columns': ['fund_name', 'fund_code'], 'date': 'last_updated'},
+}
+
+# What each kind of result shows: its date, title and amount
+RESULT_COLUMNS = {
+    'balance': "source.date AS date, source.bank AS title, coalesce(source.withdrawal_amt, 0) - coalesce(source.deposit_amt, 0) AS amount",
+    'transaction': "source.timestamp AS date, source.transaction_type AS title, source.amount AS amount",
+    'fund': "source.last_updated AS date, source.fund_code AS title, source.current_nav AS amount",
+}
+
+def _fts_table(kind):
+    return f"{SEARCH_TABLES[kind]['table']}_fts"
+
+def _schema(kind):
+    table, columns = SEARCH_TABLES[kind]['table'], SEARCH_TABLES[kind]['columns']
+    fts = _fts_table(kind)
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f"new.{column}" for column in columns)
+    old_values = ', '.join(f"old.{column}" for column in columns)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({column_list}, content='{table}', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values}); END",
+        # Only changes to indexed columns touch the index (not, say, a category backfill)
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {column_list} ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values}); END",
+    ]
+
+def search_available(engine):
+    return engine.dialect.name == 'sqlite'
+
+def init_search(connection):
+    """
+    Creates the full-text indexes and their triggers if they don't exist yet, and indexes the rows
+    already stored when an index is new. Does nothing on databases other than SQLite.
+    """
+    if not search_available(connection.engine):
+        return
+    existing = {row[0] for row in connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+    for kind in SEARCH_TABLES:
+        for statement in _schema(kind):
+            connection.execute(text(statement))
+        if _fts_table(kind) not in existing:
+            connection.execute(text(f"INSERT INTO {_fts_table(kind)}({_fts_table(kind)}) VALUES ('rebuild')"))
+
+def match_query(query):
+    """
+    Turns free text into an FTS5 query: every word must occur, as a prefix, so `swig 4021` finds
+    narrations containing SWIGGY and a reference number starting with 4021. Returns None when
+    the text has no words.
+    """
+    words = re.findall(r'\w+', query or '')
+    return ' '.join(f'"{word}"*' for word in words) or None
+
+def _highlight(snippet):
+    return Markup(str(escape(snippet or '')).replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>'))
+
+def search(db_session, query, kinds=None, page=1, per_page=20):
+    """
+    Full-text search over narrations, cheque/reference numbers and fund names. Returns
+    {'total', 'page', 'per_page', 'order', 'results'}, each result a dict with kind, id, date, title,
+    amount, snippet (plain text) and snippet_html (matches in <mark>).
+    Results are ordered by BM25 rank, unless the query matches more than RANKED_MATCHES rows: scoring
+    every match of a word that occurs nearly everywhere takes far longer than the page itself, so
+    those come newest first instead ('order' says which), read from the date index without scoring.
+    """
+    kinds = [kind for kind in (kinds or SEARCH_TABLES) if kind in SEARCH_TABLES]
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    page = max(1, page)
+    fts_query = match_query(query)
+    if fts_query is None or not kinds:
+        return {'total': 0, 'page': page, 'per_page': per_page, 'order': 'rank', 'results': []}
+
+    total = sum(db_session.execute(text(f"SELECT count(*) FROM {_fts_table(kind)} WHERE {_fts_table(kind)} MATCH :query"),
+                                   {'query': fts_query}).scalar() for kind in kinds)
+    order = 'rank' if total <= RANKED_MATCHES else 'recent'
+    offset = (page - 1) * per_page
+    selects = []
+    for kind in kinds:
+        fts, table, date = _fts_table(kind), SEARCH_TABLES[kind]['table'], SEARCH_TABLES[kind]['date']
+        select = (f"SELECT '{kind}' AS kind, source.id AS id, {RESULT_COLUMNS[kind]}, "
+                  f"snippet({fts}, -1, '{MATCH_START}', '{MATCH_END}', '…', 12) AS snippet, "
+                  f"{'bm25(' + fts + ')' if order == 'rank' else '0.0'} AS rank "
+                  f"FROM {fts} JOIN {table} AS source ON source.id = {fts}.rowid "
+                  f"WHERE {fts} MATCH :query")
+        if order == 'recent':
+            # Only the newest rows of each kind can make it onto the page: walk the date index down
+            # until `window` of them match (+id keeps the planner off the primary key), and make
+            # snippets of those alone
+            select += (f" AND {fts}.rowid IN (SELECT id FROM {table} "
+                       f"WHERE +id IN (SELECT rowid FROM {fts} WHERE {fts} MATCH :query) "
+                       f"ORDER BY {date} DESC, id DESC LIMIT :window)")
+        selects.append(f"SELECT * FROM ({select})")
+    statement = ' UNION ALL '.join(selects) + (" ORDER BY rank" if order == 'rank' else " ORDER BY date DESC, id DESC")
+    rows = db_session.execute(text(statement + " LIMIT :limit OFFSET :offset"),
+                              {'query': fts_query, 'limit': per_page, 'offset': offset, 'window': offset + per_page}).all()
+    results = []
+    for row in rows:
+        result = dict(row._mapping)
+        result['snippet_html'] = _highlight(result['snippet'])
+        result['snippet'] = (result['snippet'] or '').replace(MATCH_START, '').replace(MATCH_END, '')
+        results.append(result)
+    return {'total': total, 'page': page, 'per_page': per_page, 'order': order, 'results': results}
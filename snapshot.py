@@ -0,0 +1,219 @@
+import contextlib
+import datetime
+import json
+import os
+import tempfile
+import threading
+import numpy as np
+from sqlalchemy import select
+from models import AccountBalance, Fund, MutualFundTransaction
+from dataversion import data_version_state
+
+try:
+    import fcntl
+except ImportError: # Windows: only the in-process lock applies
+    fcntl = None
+
+TRANSACTION_DTYPE = np.dtype([('id', 'i8'), ('timestamp', 'M8[s]'), ('fund', 'i4'), ('kind', 'i1'),
+                              ('amount', 'f8'), ('units', 'f8'), ('nav', 'f8'), ('carried', 'i1')])
+BALANCE_DTYPE = np.dtype([('id', 'i8'), ('date', 'M8[s]'), ('bank', 'i4'),
+                          ('closing_balance', 'f8'), ('withdrawal_amt', 'f8'), ('deposit_amt', 'f8')])
+# transaction_type as stored in `kind`; dividends and unrecognised types are 0 and don't change units
+KIND_CODES = {'buy': 1, 'sell': -1}
+# Bumped when the arrays' layout changes, so snapshots saved by an older version are rebuilt
+SNAPSHOT_FORMAT = 2
+SNAPSHOT_TABLES = {MutualFundTransaction.__tablename__, AccountBalance.__tablename__, Fund.__tablename__}
+
+class Snapshot:
+    """
+    Read-only columnar copy of the transactions, balances and fund NAVs.
+    transactions is sorted by (timestamp, id) and balances by (date, id); their `fund` and `bank`
+    columns index into fund_names and banks. navs[i] is the current NAV of fund_names[i] (NaN if unknown).
+    """
+
+    def __init__(self, meta, transactions, balances, navs):
+        self.versions = meta['versions']
+        self.built_at = meta['built_at']
+        self.fund_names = meta['fund_names']
+        self.fund_codes = meta['fund_codes']
+        self.banks = meta['banks']
+        self.transactions = transactions
+        self.balances = balances
+        self.navs = navs
+
+    def signed_units(self):
+        """Units bought (positive) or sold (negative) by each transaction."""
+        return self.transactions['units'] * self.transactions['kind']
+
+    def units_held(self):
+        """Units currently held per fund, aligned with fund_names."""
+        return np.bincount(self.transactions['fund'], weights=self.signed_units(), minlength=len(self.fund_names))
+
+    def latest_balances(self):
+        """Index into balances of the latest row (by date, then id) of every bank."""
+        if not len(self.balances):
+            return np.array([], dtype=np.int64)
+        banks = self.balances['bank']
+        # balances is sorted by (date, id), so the last occurrence of each bank is its latest row
+        last = len(banks) - 1 - np.unique(banks[::-1], return_index=True)[1]
+        return np.sort(last)
+
+def _rows_to_array(rows, dtype):
+    array = np.zeros(len(rows), dtype=dtype)
+    if rows:
+        for name, column in zip(dtype.names, zip(*rows)):
+            array[name] = column
+    return array
+
+def _index(names, values):
+    """Maps values to positions in names, appending values not seen before."""
+    positions = {name: i for i, name in enumerate(names)}
+    indexes = []
+    for value in values:
+        if value not in positions:
+            positions[value] = len(names)
+            names.append(value)
+        indexes.append(positions[value])
+    return indexes
+
+def _read_transactions(db_session, fund_names, after_id=0):
+    rows = db_session.execute(select(MutualFundTransaction.id, MutualFundTransaction.timestamp, MutualFundTransaction.fund_name,
+                                     MutualFundTransaction.transaction_type, MutualFundTransaction.amount,
+                                     MutualFundTransaction.units, MutualFundTransaction.nav, MutualFundTransaction.carried_forward)
+                              .where(MutualFundTransaction.id > after_id)).all()
+    funds = _index(fund_names, [row.fund_name for row in rows])
+    return _rows_to_array([(row.id, row.timestamp, fund, KIND_CODES.get(str(row.transaction_type).lower(), 0),
+                            row.amount or 0.0, row.units or 0.0, row.nav or 0.0, row.carried_forward or 0) for row, fund in zip(rows, funds)], TRANSACTION_DTYPE)
+
+def _read_balances(db_session, banks, after_id=0):
+    rows = db_session.execute(select(AccountBalance.id, AccountBalance.date, AccountBalance.bank, AccountBalance.closing_balance,
+                                     AccountBalance.withdrawal_amt, AccountBalance.deposit_amt)
+                              .where(AccountBalance.id > after_id)).all()
+    bank_indexes = _index(banks, [row.bank for row in rows])
+    return _rows_to_array([(row.id, row.date, bank, row.closing_balance or 0.0, row.withdrawal_amt or 0.0, row.deposit_amt or 0.0)
+                           for row, bank in zip(rows, bank_indexes)], BALANCE_DTYPE)
+
+def _refresh(previous, state, table_name, read, sort_keys):
+    """
+    Brings one table's array up to date: unchanged tables are kept, tables that only had rows
+    appended since the previous snapshot read just the new rows, anything else is read in full.
+    """
+    old_state = previous['meta']['tables'].get(table_name) if previous else None
+    old_array = previous['arrays'][table_name] if previous else None
+    if old_state and old_state['version'] == state['version']:
+        return old_array, old_state['max_id']
+    if old_state and old_state['rewritten'] == state['rewritten']:
+        array = np.concatenate([old_array, read(old_state['max_id'])])
+    else:
+        array = read(0)
+    array = array[np.lexsort([array[key] for key in reversed(sort_keys)])]
+    return array, int(array['id'].max()) if len(array) else 0
+
+def build_snapshot(db_session, state, previous=None):
+    """Builds a snapshot at the data versions in state, reusing what it can from the previous one."""
+    database = _database(db_session)
+    if previous and (previous['meta'].get('database') != database or previous['meta'].get('format') != SNAPSHOT_FORMAT):
+        previous = None
+    meta = {
+        'format': SNAPSHOT_FORMAT,
+        'database': database,
+        'versions': state,
+        'built_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        # Name lists only ever grow, so indexes stored in the previous arrays stay valid
+        'fund_names': list(previous['meta']['fund_names']) if previous else [],
+        'banks': list(previous['meta']['banks']) if previous else [],
+        'tables': {},
+    }
+    arrays = {}
+    for table_name, read, sort_keys in [
+        (MutualFundTransaction.__tablename__, lambda after_id: _read_transactions(db_session, meta['fund_names'], after_id), ['timestamp', 'id']),
+        (AccountBalance.__tablename__, lambda after_id: _read_balances(db_session, meta['banks'], after_id), ['date', 'id']),
+    ]:
+        arrays[table_name], max_id = _refresh(previous, state[table_name], table_name, read, sort_keys)
+        meta['tables'][table_name] = dict(state[table_name], max_id=max_id)
+
+    # The fund table is small; it is always read in full
+    funds = db_session.execute(select(Fund.fund_name, Fund.fund_code, Fund.current_nav)).all()
+    _index(meta['fund_names'], [fund.fund_name for fund in funds])
+    navs = np.full(len(meta['fund_names']), np.nan)
+    codes = [None] * len(meta['fund_names'])
+    positions = {name: i for i, name in enumerate(meta['fund_names'])}
+    for fund in funds:
+        navs[positions[fund.fund_name]] = fund.current_nav if fund.current_nav is not None else np.nan
+        codes[positions[fund.fund_name]] = fund.fund_code
+    meta['fund_codes'] = codes
+    arrays[Fund.__tablename__] = navs
+    return {'meta': meta, 'arrays': arrays}
+
+ARRAY_FILES = {MutualFundTransaction.__tablename__: 'transactions.npy', AccountBalance.__tablename__: 'balances.npy', Fund.__tablename__: 'navs.npy'}
+
+def _save(directory, built):
+    """Writes the arrays and then meta.json, each to a temporary file renamed into place."""
+    os.makedirs(directory, exist_ok=True)
+    for table_name, filename in ARRAY_FILES.items():
+        with tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp', delete=False) as f:
+            np.save(f, built['arrays'][table_name])
+        os.replace(f.name, os.path.join(directory, filename))
+    with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False) as f:
+        json.dump(built['meta'], f)
+    os.replace(f.name, os.path.join(directory, 'meta.json'))
+
+def _open(directory):
+    """Maps a saved snapshot read-only; returns None if there isn't one."""
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {table_name: np.load(os.path.join(directory, filename), mmap_mode='r') for table_name, filename in ARRAY_FILES.items()}
+    except (FileNotFoundError, ValueError):
+        return None
+    return {'meta': meta, 'arrays': arrays}
+
+@contextlib.contextmanager
+def _directory_lock(directory):
+    # Only one worker process rebuilds at a time; the others wait and then map its result
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, '.lock'), 'w') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _database(db_session):
+    return db_session.get_bind().url.render_as_string(hide_password=True)
+
+def _current(loaded, database, state):
+    # A snapshot directory left over from another database or version may carry the same version numbers
+    return (loaded is not None and loaded['meta'].get('format') == SNAPSHOT_FORMAT and loaded['meta'].get('database') == database
+            and loaded['meta']['versions'] == state)
+
+_snapshots = {} # directory -> {'meta', 'arrays'} opened by this process
+_lock = threading.Lock()
+
+def get_snapshot(db_session, directory=None):
+    """
+    Returns a Snapshot matching the current data versions, rebuilding it when they have changed.
+    With a directory the snapshot is saved there as .npy files and memory-mapped, so all worker
+    processes share one copy; without one it is kept in this process only.
+    """
+    state = data_version_state(db_session, SNAPSHOT_TABLES)
+    database = _database(db_session)
+    loaded = _snapshots.get(directory)
+    if not _current(loaded, database, state):
+        with _lock:
+            loaded = _snapshots.get(directory)
+            if not _current(loaded, database, state):
+                if directory is None:
+                    loaded = build_snapshot(db_session, state, loaded)
+                else:
+                    with _directory_lock(directory):
+                        saved = _open(directory)
+                        if not _current(saved, database, state):
+                            _save(directory, build_snapshot(db_session, state, saved))
+                            saved = _open(directory)
+                    loaded = saved
+                _snapshots[directory] = loaded
+    arrays = loaded['arrays']
+    return Snapshot(loaded['meta'], arrays[MutualFundTransaction.__tablename__], arrays[AccountBalance.__tablename__], arrays[Fund.__tablename__])
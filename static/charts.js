@@ -0,0 +1,59 @@
+// Line charts fed by the /api/charts endpoints. The series are first loaded downsampled to the
+// width of the chart; zooming in fetches the visible window again at that resolution, so detail
+// appears on zoom without ever sending every point.
+function zoomableChart(chartDom, url, option) {
+    chartDom.style.width = '100%';
+    chartDom.style.height = '500px';
+    const chart = echarts.init(chartDom);
+    let params = {};
+    let overview = [];
+    let zoomTimer = null;
+
+    function fetchSeries(extra) {
+        const query = new URLSearchParams(Object.assign({points: Math.max(100, Math.round(chartDom.clientWidth))}, params, extra));
+        return fetch(url + '?' + query).then(response => response.json());
+    }
+
+    function toData(points) {
+        return points.map(item => [item[0], item[1].toFixed(0)]);
+    }
+
+    function load(newParams, title) {
+        params = newParams || {};
+        return fetchSeries({}).then(payload => {
+            overview = payload.series;
+            chart.setOption(Object.assign({}, option, {
+                title: {text: title || (overview[0] && overview[0].name) || ''},
+                dataZoom: [{type: 'inside', start: 0, end: 100}, {start: 0, end: 100}],
+                series: overview.map(series => ({name: series.name, type: 'line', showSymbol: false, data: toData(series.data)})),
+            }), true);
+        });
+    }
+
+    chart.on('dataZoom', function () {
+        clearTimeout(zoomTimer);
+        zoomTimer = setTimeout(function () {
+            const zoom = chart.getOption().dataZoom[0];
+            if (zoom.start <= 0 && zoom.end >= 100) {
+                chart.setOption({series: overview.map(series => ({name: series.name, data: toData(series.data)}))});
+                return;
+            }
+            const start = new Date(zoom.startValue).toISOString().slice(0, 10);
+            const end = new Date(zoom.endValue).toISOString().slice(0, 10);
+            fetchSeries({start: start, end: end}).then(payload => {
+                // Keep the overview outside the window so the axis range, and with it the zoom, stays put
+                chart.setOption({series: payload.series.map((series, i) => {
+                    const outside = (overview[i] ? overview[i].data : []).filter(item => item[0] < start || item[0] > end);
+                    const data = outside.concat(series.data).sort((a, b) => (a[0] < b[0] ? -1 : a[0] > b[0] ? 1 : 0));
+                    return {name: series.name, data: toData(data)};
+                })});
+            });
+        }, 250);
+    });
+
+    $(window).on('resize', function () {
+        chart.resize();
+    });
+
+    return {chart: chart, load: load};
+}
@@ -0,0 +1,122 @@
+import contextlib
+import contextvars
+import datetime
+import json
+import logging
+import sys
+import time
+import uuid
+from sqlalchemy import insert
+from models import ImportRun
+
+logger = logging.getLogger('finapp.import')
+if not logger.handlers:
+    # One JSON object per line on stderr, independent of the root logger configuration
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+_current_trace = contextvars.ContextVar('import_trace', default=None)
+
+def log_event(event, **fields):
+    """Writes a structured log line for the import pipeline."""
+    logger.info(json.dumps({'event': event, 'time': datetime.datetime.now().isoformat(timespec='milliseconds'), **fields}, default=str))
+
+class ImportTrace:
+    """Timed spans (stage, duration, row count) collected over one import."""
+
+    def __init__(self, name, attributes):
+        self.run_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attributes = attributes
+        self.spans = []
+        self.started_at = datetime.datetime.now()
+        self.duration_ms = None
+        self.status = 'running'
+        self.error = None
+        self.rows = 0
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def span(self, stage, **attributes):
+        record = {'stage': stage, 'offset_ms': round((time.perf_counter() - self._start) * 1000, 3), 'rows': None, **attributes}
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record['error'] = str(e)
+            raise
+        finally:
+            record['duration_ms'] = round((time.perf_counter() - start) * 1000, 3)
+            self.spans.append(record)
+            log_event('span', run_id=self.run_id, **record)
+
+    def finish(self, error=None, rows=0):
+        self.duration_ms = round((time.perf_counter() - self._start) * 1000, 3)
+        self.status = 'error' if error else 'success'
+        self.error = error
+        self.rows = rows
+        log_event('import_run', run_id=self.run_id, name=self.name, status=self.status, error=error, rows=rows,
+                  duration_ms=self.duration_ms, **self.attributes)
+
+@contextlib.contextmanager
+def start_trace(name, **attributes):
+    """Makes a new ImportTrace the current one for span() calls inside the block."""
+    trace = ImportTrace(name, attributes)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+@contextlib.contextmanager
+def span(stage, **attributes):
+    """
+    Times a stage of the current import. Yields a dict; set record['rows'] to report a row count.
+    Outside of start_trace() this only yields a throwaway dict.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield {}
+        return
+    with trace.span(stage, **attributes) as record:
+        yield record
+
+def save_import_run(bind, trace):
+    """
+    Stores a finished trace in the import_run table. Uses its own connection so the run is
+    recorded even when the import itself was rolled back or only previewed.
+    """
+    try:
+        with bind.begin() as connection:
+            connection.execute(insert(ImportRun.__table__).values(
+                run_id=trace.run_id,
+                name=trace.name,
+                files=json.dumps(trace.attributes.get('files', [])),
+                mode=trace.attributes.get('mode'),
+                started_at=trace.started_at,
+                duration_ms=trace.duration_ms,
+                status=trace.status,
+                error=trace.error,
+                rows=trace.rows,
+                spans=json.dumps(trace.spans, default=str),
+            ))
+    except Exception as e:
+        log_event('import_run_not_saved', run_id=trace.run_id, error=str(e))
+
+def slowest_stages(db_session, limit=50):
+    """Aggregates span durations over the last `limit` import runs, slowest stage first."""
+    runs = db_session.query(ImportRun).order_by(ImportRun.started_at.desc()).limit(limit).all()
+    stages = {}
+    for run in runs:
+        for record in json.loads(run.spans or '[]'):
+            stats = stages.setdefault(record['stage'], {'stage': record['stage'], 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0})
+            stats['count'] += 1
+            stats['total_ms'] += record['duration_ms']
+            stats['max_ms'] = max(stats['max_ms'], record['duration_ms'])
+            stats['rows'] += record.get('rows') or 0
+    for stats in stages.values():
+        stats['mean_ms'] = stats['total_ms'] / stats['count']
+    return sorted(stages.values(), key=lambda stats: stats['total_ms'], reverse=True)
@@ -0,0 +1,272 @@
+"""
+Watch-folder ingestion: imports statements dropped into a directory, without the upload form.
+
+    python watcher.py statements/            # import what arrives until interrupted
+    python watcher.py statements/ --once     # import what is there now and exit
+
+Files in statements/mutual_funds/ are read as mutual fund statements and files in
+statements/balances/ as account statements; an .xlsx dropped in statements/ itself is told apart by
+its sheets. A file is picked up once it has been left alone for --debounce seconds, so statements
+still being copied in are not read half-written. Each file goes through process_excel_data, with
+the same parsing, watermark de-duplication and categorization as an upload, and is recorded in the
+ingested_files table by its SHA-256: restarting the watcher, or dropping the same statement again,
+never imports it twice. A file that failed to import, or couldn't be told apart, is tried again
+when the watcher restarts or the file is dropped again (or moved to the right subdirectory). Run
+one watcher per directory.
+
+On Linux the watcher sleeps on inotify until something changes; elsewhere (or with --poll) it
+rescans every --interval seconds.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import datetime
+import hashlib
+import logging
+import os
+import select
+import sys
+import time
+from sqlalchemy.exc import IntegrityError
+from models import IngestedFile
+
+logger = logging.getLogger(__name__)
+
+DEBOUNCE_SECONDS = 5
+POLL_SECONDS = 10
+STATEMENT_EXTENSIONS = ('.xlsx', '.pdf')
+KIND_DIRECTORIES = ('mutual_funds', 'balances')
+# Names editors and download/copy tools give files they are still writing
+PARTIAL_SUFFIXES = ('.tmp', '.part', '.partial', '.crdownload', '.download')
+# Statuses of files that are imported again when they show up again
+RETRY_STATUSES = ('failed', 'skipped')
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def statement_kind(path, directory):
+    """'mutual_funds' or 'balances' by the subdirectory the file is in, or for a top-level .xlsx, its sheets. None if unknown."""
+    parent = os.path.basename(os.path.dirname(os.path.abspath(path)))
+    if os.path.dirname(os.path.abspath(path)) != os.path.abspath(directory) and parent in KIND_DIRECTORIES:
+        return parent
+    if path.lower().endswith('.xlsx'):
+        from openpyxl import load_workbook
+        from fileparse import MUTUAL_FUNDS_SHEET
+        workbook = load_workbook(path, read_only=True)
+        try:
+            return 'mutual_funds' if MUTUAL_FUNDS_SHEET in workbook.sheetnames else 'balances'
+        finally:
+            workbook.close()
+    return None
+
+class Inotify:
+    """Wakes the watcher when a file is written, moved in or touched in the watched directories (Linux only)."""
+    IN_ATTRIB, IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE = 0x4, 0x8, 0x80, 0x100
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add(self, path):
+        mask = self.IN_ATTRIB | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        if self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+
+    def wait(self, timeout):
+        # The events only say something changed; the watcher rescans the directories to find out what
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            try:
+                while os.read(self.fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+        return bool(ready)
+
+    def close(self):
+        os.close(self.fd)
+
+class FolderWatcher:
+    """Finds settled statement files in a directory and imports the ones not imported before."""
+
+    def __init__(self, app, db_session, directory, password=None, debounce=DEBOUNCE_SECONDS, interval=POLL_SECONDS):
+        self.app = app
+        self.db_session = db_session
+        self.directory = os.path.abspath(directory)
+        self.password = password
+        self.debounce = debounce
+        self.interval = interval
+        self.directories = [self.directory] + [os.path.join(self.directory, name) for name in KIND_DIRECTORIES]
+        for path in self.directories:
+            os.makedirs(path, exist_ok=True)
+        self._handled = {} # path -> (size, mtime) of files already looked at, so they aren't hashed on every scan
+
+    def recover(self):
+        """
+        Forgets files left 'processing' by a watcher that was stopped mid-import, so they are imported
+        again (the watermarks skip any rows that did get committed), and loads the files already handled;
+        failed and skipped files are left out, so they are tried again.
+        """
+        with self.app.app_context():
+            try:
+                interrupted = self.db_session.query(IngestedFile).filter(IngestedFile.status == 'processing').delete()
+                self.db_session.commit()
+                if interrupted:
+                    logger.warning(f"Retrying {interrupted} file(s) whose import was interrupted")
+                self._handled = {path: (size, modified_at) for path, size, modified_at in
+                                 self.db_session.query(IngestedFile.path, IngestedFile.size, IngestedFile.modified_at)
+                                 .filter(IngestedFile.status.notin_(RETRY_STATUSES))}
+            finally:
+                self.db_session.remove()
+
+    def scan(self):
+        """
+        Returns (settled, wait): the files ready to import, oldest first, and how many seconds until
+        the next file still being written settles (None if there is none).
+        """
+        now = time.time()
+        settled, wait = [], None
+        for directory in self.directories:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    name = entry.name.lower()
+                    if (not entry.is_file() or name.startswith(('.', '~$')) or name.endswith(PARTIAL_SUFFIXES)
+                            or not name.endswith(STATEMENT_EXTENSIONS)):
+                        continue
+                    stat = entry.stat()
+                    if stat.st_size == 0 or self._handled.get(entry.path) == (stat.st_size, stat.st_mtime):
+                        continue
+                    quiet = now - stat.st_mtime
+                    if quiet < self.debounce:
+                        wait = min(wait or self.debounce, self.debounce - quiet)
+                    else:
+                        settled.append((stat.st_mtime, entry.path, stat.st_size))
+        return [(path, size, mtime) for mtime, path, size in sorted(settled)], wait
+
+    def _import(self, path, size, mtime):
+        from fileparse import process_excel_data
+        try:
+            digest = file_digest(path)
+        except OSError as e:
+            logger.warning(f"Could not read {path}: {e}")
+            return None
+        record = IngestedFile(sha256=digest, path=path, size=size, modified_at=mtime, started_at=datetime.datetime.now())
+        self.db_session.add(record)
+        try:
+            self.db_session.commit()
+        except IntegrityError:
+            # Seen before, under this name or another: claimed again only if it didn't get imported
+            self.db_session.rollback()
+            retried = (self.db_session.query(IngestedFile)
+                       .filter(IngestedFile.sha256 == digest, IngestedFile.status.in_(RETRY_STATUSES))
+                       .update({'status': 'processing', 'path': path, 'size': size, 'modified_at': mtime, 'kind': None, 'error': None,
+                                'rows': None, 'started_at': record.started_at, 'finished_at': None}, synchronize_session=False))
+            self.db_session.commit()
+            if not retried:
+                logger.info(f"Already imported: {path}")
+                return None
+            record = self.db_session.query(IngestedFile).filter(IngestedFile.sha256 == digest).one()
+        try:
+            record.kind = statement_kind(path, self.directory)
+            if record.kind is None:
+                record.status, record.error = 'skipped', f"Can't tell what {os.path.basename(path)} is; put it in {' or '.join(f'{name}/' for name in KIND_DIRECTORIES)}"
+            else:
+                files = (path, '') if record.kind == 'mutual_funds' else ('', path)
+                result = process_excel_data(self.db_session, *files, password=self.password, commit_changes=True)
+                record.status = 'failed' if result.get('error') else 'imported'
+                record.error = result.get('error')
+                record.rows = len(result.get('new_mutual_fund_transactions', [])) + len(result.get('new_account_balances', []))
+        except Exception as e:
+            self.db_session.rollback()
+            record.status, record.error = 'failed', str(e)
+        record.finished_at = datetime.datetime.now()
+        self.db_session.commit()
+        return record
+
+    def ingest(self, files):
+        """Imports a batch of (path, size, mtime) in order, in one application context; returns the records of the files imported now."""
+        records = []
+        with self.app.app_context():
+            try:
+                for path, size, mtime in files:
+                    record = self._import(path, size, mtime)
+                    self._handled[path] = (size, mtime)
+                    if record is not None:
+                        logger.info(f"{record.status}: {path} ({record.rows or 0} rows){': ' + record.error if record.error else ''}")
+                        records.append({'path': path, 'kind': record.kind, 'status': record.status, 'rows': record.rows, 'error': record.error})
+            finally:
+                self.db_session.remove()
+        return records
+
+    def run_once(self):
+        """Imports the files in the directory now, waiting for any still being written to settle."""
+        self.recover()
+        records = []
+        while True:
+            settled, wait = self.scan()
+            records += self.ingest(settled)
+            if wait is None:
+                return records
+            time.sleep(wait)
+
+    def watch(self, use_inotify=True):
+        """Imports files as they arrive, until interrupted."""
+        self.recover()
+        inotify = None
+        if use_inotify:
+            try:
+                inotify = Inotify()
+                for path in self.directories:
+                    inotify.add(path)
+            except (OSError, AttributeError) as e:
+                logger.info(f"inotify is not available ({e}); polling every {self.interval} s")
+                inotify = None
+        logger.info(f"Watching {self.directory}")
+        try:
+            while True:
+                settled, wait = self.scan()
+                self.ingest(settled)
+                timeout = self.interval if wait is None else min(wait, self.interval)
+                if inotify is not None:
+                    # Still rescan now and then, in case an event was missed (e.g. on a network filesystem)
+                    inotify.wait(timeout if wait is not None else max(self.interval, 60))
+                else:
+                    time.sleep(timeout)
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory')
+    parser.add_argument('--once', action='store_true', help='import the files there now and exit')
+    parser.add_argument('--poll', action='store_true', help='rescan every --interval seconds instead of using inotify')
+    parser.add_argument('--interval', type=float, default=POLL_SECONDS)
+    parser.add_argument('--debounce', type=float, default=DEBOUNCE_SECONDS, help='seconds a file must be left alone before it is read')
+    parser.add_argument('--password', default=os.environ.get('STATEMENT_PASSWORD'), help='password of encrypted PDF statements')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    from app import create_app, db_session, init_db
+    app = create_app()
+    with app.app_context():
+        init_db()
+    watcher = FolderWatcher(app, db_session, args.directory, args.password, args.debounce, args.interval)
+    if args.once:
+        records = watcher.run_once()
+        print(f"{len(records)} file(s): " + ', '.join(f"{record['status']} {os.path.basename(record['path'])}" for record in records))
+        return 1 if any(record['status'] == 'failed' for record in records) else 0
+    try:
+        watcher.watch(use_inotify=not args.poll)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,41 @@
+"""
+WSGI entry point for running the app with several workers.
+
+    gunicorn -c gunicorn.conf.py wsgi:app      # worker processes x threads, see gunicorn.conf.py
+    python wsgi.py                             # waitress, a threaded server for platforms without gunicorn
+
+Run `python delivery.py` once per checkout first, so jQuery, DataTables and echarts are served from
+static/vendor rather than their CDNs.
+
+Both read DATABASE_URI and CACHE_PATH from the environment; BIND, WEB_CONCURRENCY and THREADS
+set the address, worker processes and threads per worker. Each worker also runs the maintenance
+scheduler (scheduler.py) unless SCHEDULER=0.
+"""
+import os
+from app import create_app, db_session, init_db
+from scheduler import start_scheduler
+
+app = create_app()
+
+def prepare():
+    """
+    Creates the upload folder and brings the schema up to date. Run once, before workers start,
+    so they don't race each other through the ALTER TABLE migrations.
+    """
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    with app.app_context():
+        init_db()
+    # Connections opened here must not be inherited by forked workers
+    app.extensions['engine'].dispose()
+
+def start_maintenance():
+    """Starts the maintenance scheduler in this worker process, unless it is turned off."""
+    if app.config['SCHEDULER']:
+        start_scheduler(app, db_session)
+
+if __name__ == '__main__':
+    from waitress import serve
+    prepare()
+    start_maintenance()
+    host, port = os.environ.get('BIND', '127.0.0.1:8000').rsplit(':', 1)
+    serve(app, host=host, port=int(port), threads=int(os.environ.get('THREADS', 8)))